@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Asset Server
+asyncio HTTP/1.1 server for the viewer's static files, for deployments that
+do not go through GitHub Pages. Standard library only; brotli sidecars are
+written if the brotli package is installed.
+
+Run with --precompress at build time to write the .gz/.br sidecars of the
+compressible files, then without it to serve the directory.
+
+Serving:
+  - precompressed sidecars (<file>.br, <file>.gz) are sent to clients that
+    accept them, as long as they are newer than the file itself
+  - strong ETags (content hashes, one per representation) with
+    If-None-Match -> 304; only versioned URLs, whose content never changes,
+    are sent with a long-lived Cache-Control: a content hash in the file
+    name (cortical_desikan.3f2a9c1d.bin) or a version in the query string
+    (cortical_desikan.bin?v=3f2a9c1d). Everything else, including bundles
+    rewritten in place by compile_mesh_bundles.py, is sent with no-cache so
+    that it is revalidated through its ETag
+  - single byte-range requests (Range, If-Range) on the uncompressed file,
+    e.g. one hemisphere group of a mesh bundle
+  - GET /batch?paths=a.obj,b.obj (or POST /batch with {"paths": [...]})
+    returns many files in one response:
+        uint32 little-endian length of the JSON header
+        JSON header {"files": [{"path", "status", "byteOffset", "byteLength", "etag"}]}
+        zero padding to a multiple of 4 bytes
+        the data section: every file 4-byte aligned, byteOffset relative to
+        the start of the data section; missing files have status 404
+  - every request is logged with its status, size, encoding and latency,
+    optionally as JSON lines (--access-log) to measure cold-load times
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import mimetypes
+import re
+import struct
+import time
+from email.utils import formatdate
+from pathlib import Path
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from mesh_cache import hash_file
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+DEFAULT_PORT = 8000
+DEFAULT_MAX_AGE = 365 * 24 * 3600
+
+# Sidecar suffix of each content coding, in order of preference
+SIDECAR_ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+
+COMPRESSIBLE_EXTENSIONS = {'.bin', '.obj', '.ply', '.json', '.csv', '.js', '.css', '.html', '.svg', '.txt'}
+# Sidecars that do not save at least this fraction of the file are not written
+MIN_COMPRESSION_SAVING = 0.1
+MIN_COMPRESS_BYTES = 1024
+
+# Versioned URLs, sent with the long-lived Cache-Control: a hex content
+# hash in the file name, or a version query parameter
+CONTENT_HASH_NAME = re.compile(r'\.[0-9a-f]{8,}\.[^.]+$')
+VERSION_PARAMETERS = ('v', 'version', 'hash')
+
+MAX_BATCH_FILES = 1024
+READ_CHUNK_BYTES = 1 << 20
+
+STATUS_REASONS = {
+    200: 'OK', 206: 'Partial Content', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 413: 'Payload Too Large', 416: 'Range Not Satisfiable',
+}
+
+mimetypes.add_type('text/plain', '.obj')
+mimetypes.add_type('application/octet-stream', '.ply')
+mimetypes.add_type('application/octet-stream', '.bin')
+
+def compress_file(path, encoding):
+    """Compressed bytes of a file for one content coding"""
+    data = path.read_bytes()
+    if encoding == 'gzip':
+        # mtime=0 keeps the sidecar identical from one build to the next
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+def precompress_assets(root, extensions=COMPRESSIBLE_EXTENSIONS):
+    """Write the missing or stale .gz (and .br) sidecars of the files under `root`
+
+    Returns (written, skipped): sidecars written, and files whose sidecar
+    would not be smaller by MIN_COMPRESSION_SAVING.
+    """
+    encodings = ['gzip'] + (['br'] if BROTLI_AVAILABLE else [])
+    written = skipped = 0
+    for path in sorted(Path(root).rglob('*')):
+        if not path.is_file() or path.suffix.lower() not in extensions:
+            continue
+        size = path.stat().st_size
+        if size < MIN_COMPRESS_BYTES:
+            continue
+        for encoding in encodings:
+            sidecar = path.with_name(path.name + SIDECAR_ENCODINGS[encoding])
+            if sidecar.exists() and sidecar.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+                continue
+            data = compress_file(path, encoding)
+            if len(data) > size * (1 - MIN_COMPRESSION_SAVING):
+                sidecar.unlink(missing_ok=True)
+                skipped += 1
+                continue
+            sidecar.write_bytes(data)
+            written += 1
+    return written, skipped
+
+def parse_accept_encoding(value):
+    """Content codings accepted by a client (q > 0)"""
+    accepted = set()
+    for item in value.split(','):
+        coding, _, parameters = item.strip().partition(';')
+        quality = 1.0
+        if parameters.strip().startswith('q='):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def parse_range(value, size):
+    """(start, end) inclusive byte range of a single-range Range header
+
+    Returns None if the header should be ignored (not bytes, several
+    ranges or malformed) and 'unsatisfiable' if the range is outside the file.
+    """
+    unit, _, ranges = value.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first == '':
+            # Suffix range: the last `last` bytes
+            length = int(last)
+            if length <= 0:
+                return 'unsatisfiable'
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+class AssetServer:
+    """Serves the files under `root`; see the module docstring"""
+
+    def __init__(self, root='.', max_age=DEFAULT_MAX_AGE, access_log=None):
+        self.root = Path(root).resolve()
+        self.max_age = max_age
+        self.access_log = open(access_log, 'a') if access_log else None
+        # (path, mtime_ns, size) -> ETag
+        self.etags = {}
+
+    def resolve_path(self, url_path):
+        """File of a URL path under the root, or None (missing or outside the root)"""
+        relative = unquote(url_path).lstrip('/') or 'index.html'
+        path = (self.root / relative).resolve()
+        if path != self.root and self.root not in path.parents:
+            return None
+        if path.is_dir():
+            path = path / 'index.html'
+        return path if path.is_file() else None
+
+    async def etag(self, path):
+        """Strong ETag of a file, from its content hash, cached while the file is unchanged"""
+        stat = path.stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        if key not in self.etags:
+            digest = await asyncio.to_thread(hash_file, path)
+            self.etags[key] = f'"{digest[:32]}"'
+        return self.etags[key]
+
+    def choose_representation(self, path, headers):
+        """(file to send, content coding or None) for a request"""
+        if 'range' in headers:
+            # Ranges address the uncompressed file
+            return path, None
+        accepted = parse_accept_encoding(headers.get('accept-encoding', ''))
+        mtime = path.stat().st_mtime_ns
+        for encoding, suffix in SIDECAR_ENCODINGS.items():
+            sidecar = path.with_name(path.name + suffix)
+            if encoding in accepted and sidecar.is_file() and sidecar.stat().st_mtime_ns >= mtime:
+                return sidecar, encoding
+        return path, None
+
+    def cache_headers(self, path, query=''):
+        """Long-lived Cache-Control for versioned URLs (see the module docstring), no-cache otherwise"""
+        parameters = parse_qs(query)
+        if CONTENT_HASH_NAME.search(path.name) or any(parameters.get(name) for name in VERSION_PARAMETERS):
+            return {'Cache-Control': f'public, max-age={self.max_age}, immutable'}
+        return {'Cache-Control': 'no-cache'}
+
+    async def send(self, writer, status, headers, body=b'', file=None, start=0, length=0, head=False):
+        """Write a response; the body is `body`, or `length` bytes of `file` from `start`"""
+        content_length = length if file is not None else len(body)
+        lines = [f'HTTP/1.1 {status} {STATUS_REASONS[status]}',
+                 f'Date: {formatdate(usegmt=True)}',
+                 f'Content-Length: {content_length}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if head:
+            await writer.drain()
+            return 0
+        if file is None:
+            writer.write(body)
+        else:
+            with open(file, 'rb') as f:
+                f.seek(start)
+                remaining = length
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(f.read, min(READ_CHUNK_BYTES, remaining))
+                    if not chunk:
+                        break
+                    writer.write(chunk)
+                    remaining -= len(chunk)
+                    await writer.drain()
+        await writer.drain()
+        return content_length
+
+    async def serve_file(self, writer, method, url_path, headers, query=''):
+        """Respond with one file; returns (status, body bytes, content coding)"""
+        path = self.resolve_path(url_path)
+        if path is None:
+            return 404, await self.send(writer, 404, {'Content-Type': 'text/plain'}, b'Not Found'), None
+
+        source, encoding = self.choose_representation(path, headers)
+        etag = await self.etag(source)
+        response_headers = {
+            'Content-Type': mimetypes.guess_type(path.name)[0] or 'application/octet-stream',
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            'Accept-Ranges': 'bytes',
+            **self.cache_headers(path, query),
+        }
+        if encoding:
+            response_headers['Content-Encoding'] = encoding
+
+        if_none_match = headers.get('if-none-match')
+        if if_none_match and (if_none_match.strip() == '*' or etag in
+                              [tag.strip() for tag in if_none_match.split(',')]):
+            return 304, await self.send(writer, 304, response_headers, head=True), encoding
+
+        size = source.stat().st_size
+        head = method == 'HEAD'
+        byte_range = None
+        if 'range' in headers and headers.get('if-range', etag) == etag:
+            byte_range = parse_range(headers['range'], size)
+        if byte_range == 'unsatisfiable':
+            response_headers['Content-Range'] = f'bytes */{size}'
+            return 416, await self.send(writer, 416, response_headers), None
+        if byte_range is not None:
+            start, end = byte_range
+            response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            sent = await self.send(writer, 206, response_headers, file=source, start=start,
+                                   length=end - start + 1, head=head)
+            return 206, sent, None
+        return 200, await self.send(writer, 200, response_headers, file=source, length=size, head=head), encoding
+
+    def batch_paths(self, method, query, body):
+        """Paths requested from /batch, from the query string or a JSON body"""
+        if method == 'POST':
+            request = json.loads(body or b'{}')
+            paths = request.get('paths', []) if isinstance(request, dict) else None
+        else:
+            values = parse_qs(query).get('paths', []) + parse_qs(query).get('path', [])
+            paths = [path for value in values for path in value.split(',') if path]
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            raise ValueError("'paths' must be a list of strings")
+        return paths
+
+    async def serve_batch(self, writer, method, query, headers, body):
+        """Respond with many files in one body; returns (status, body bytes, content coding)"""
+        try:
+            paths = self.batch_paths(method, query, body)
+        except ValueError as e:
+            return 400, await self.send(writer, 400, {'Content-Type': 'text/plain'}, str(e).encode()), None
+        if len(paths) > MAX_BATCH_FILES:
+            message = f"At most {MAX_BATCH_FILES} files per batch".encode()
+            return 413, await self.send(writer, 413, {'Content-Type': 'text/plain'}, message), None
+
+        files = []
+        chunks = []
+        offset = 0
+        for url_path in paths:
+            path = self.resolve_path(url_path)
+            if path is None:
+                files.append({'path': url_path, 'status': 404})
+                continue
+            data = await asyncio.to_thread(path.read_bytes)
+            files.append({'path': url_path, 'status': 200, 'byteOffset': offset,
+                          'byteLength': len(data), 'etag': await self.etag(path)})
+            padding = -len(data) % 4
+            chunks += [data, bytes(padding)]
+            offset += len(data) + padding
+
+        header = json.dumps({'files': files}).encode()
+        header += b' ' * (-(len(header) + 4) % 4)
+        payload = b''.join([struct.pack('<I', len(header)), header] + chunks)
+
+        response_headers = {'Content-Type': 'application/octet-stream', 'Cache-Control': 'no-cache',
+                            'Vary': 'Accept-Encoding'}
+        encoding = None
+        if 'gzip' in parse_accept_encoding(headers.get('accept-encoding', '')):
+            payload = await asyncio.to_thread(gzip.compress, payload, 6, mtime=0)
+            encoding = response_headers['Content-Encoding'] = 'gzip'
+        return 200, await self.send(writer, 200, response_headers, payload), encoding
+
+    def log(self, peer, method, target, status, sent, encoding, milliseconds):
+        print(f"{peer} {method} {target} {status} {sent} B {encoding or '-'} {milliseconds:.1f} ms")
+        if self.access_log:
+            self.access_log.write(json.dumps({
+                'time': time.time(), 'peer': peer, 'method': method, 'target': target, 'status': status,
+                'bytes': sent, 'encoding': encoding, 'ms': round(milliseconds, 3)
+            }) + '\n')
+            self.access_log.flush()
+
+    async def handle_connection(self, reader, writer):
+        """Serve the requests of one (keep-alive) connection"""
+        peer = writer.get_extra_info('peername')
+        peer = peer[0] if peer else '-'
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                url = urlsplit(target)
+                if url.path == '/batch' and method in ('GET', 'POST'):
+                    status, sent, encoding = await self.serve_batch(writer, method, url.query, headers, body)
+                elif method in ('GET', 'HEAD'):
+                    status, sent, encoding = await self.serve_file(writer, method, url.path, headers, url.query)
+                else:
+                    status, sent, encoding = 405, await self.send(
+                        writer, 405, {'Allow': 'GET, HEAD', 'Content-Type': 'text/plain'}, b'Method Not Allowed'
+                    ), None
+                self.log(peer, method, target, status, sent, encoding, (time.perf_counter() - start) * 1000)
+
+                if version != 'HTTP/1.1' or headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # Client went away, or a malformed request: drop the connection
+            pass
+        finally:
+            writer.close()
+
+async def serve(root='.', host='127.0.0.1', port=DEFAULT_PORT, max_age=DEFAULT_MAX_AGE, access_log=None):
+    """Run the asset server until cancelled"""
+    server = AssetServer(root, max_age, access_log)
+    listener = await asyncio.start_server(server.handle_connection, host, port)
+    print(f"Serving {server.root} on http://{host}:{port}/ (brotli sidecars: "
+          f"{'yes' if BROTLI_AVAILABLE else 'no, pip install brotli'})")
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the viewer assets with precompressed sidecars and caching')
+    parser.add_argument('--root', default='.',
+                       help='Directory to serve (default: .)')
+    parser.add_argument('--host', default='127.0.0.1',
+                       help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                       help=f'Port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('--max-age', type=int, default=DEFAULT_MAX_AGE,
+                       help='Cache-Control max-age of versioned URLs in seconds (default: one year)')
+    parser.add_argument('--access-log', default=None,
+                       help='Also append every request, with its latency, to this JSON lines file')
+    parser.add_argument('--precompress', action='store_true',
+                       help='Write the .gz/.br sidecars of the compressible files under --root and exit')
+
+    args = parser.parse_args()
+    if args.precompress:
+        written, skipped = precompress_assets(args.root)
+        print(f"Wrote {written} sidecars ({skipped} files do not compress)"
+              + ('' if BROTLI_AVAILABLE else '; install brotli for .br sidecars'))
+    else:
+        try:
+            asyncio.run(serve(args.root, args.host, args.port, args.max_age, args.access_log))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Mesh Reader Benchmark
+Times mesh_io against trimesh on every OBJ/PLY file of the meshes/ tree and
+checks that both return the same geometry.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from mesh_io import read_mesh
+
+try:
+    import trimesh
+    TRIMESH_AVAILABLE = True
+except ImportError:
+    TRIMESH_AVAILABLE = False
+
+def find_mesh_files(mesh_dir):
+    """All OBJ and PLY files under `mesh_dir`, sorted"""
+    mesh_dir = Path(mesh_dir)
+    return sorted(list(mesh_dir.rglob('*.obj')) + list(mesh_dir.rglob('*.ply')))
+
+def load_with_trimesh(mesh_file):
+    """Load a mesh file with trimesh, without any vertex merging or reordering"""
+    mesh = trimesh.load(mesh_file, process=False, force='mesh')
+    return {'vertices': mesh.vertices, 'faces': mesh.faces}
+
+def time_reader(reader, mesh_files, repeat):
+    """Best total wall time of reading every file, and the meshes of the last run"""
+    best = float('inf')
+    meshes = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        meshes = [reader(mesh_file) for mesh_file in mesh_files]
+        best = min(best, time.perf_counter() - start)
+    return best, meshes
+
+def run_benchmark(mesh_dir='meshes', repeat=3):
+    """Benchmark both readers and return the results as a dict"""
+    mesh_files = find_mesh_files(mesh_dir)
+    if not mesh_files:
+        raise FileNotFoundError(f"No OBJ/PLY files found under {mesh_dir}")
+
+    total_bytes = sum(f.stat().st_size for f in mesh_files)
+    print(f"Reading {len(mesh_files)} files ({total_bytes / 1e6:.1f} MB), best of {repeat}...")
+
+    results = {
+        'files': len(mesh_files),
+        'megabytes': total_bytes / 1e6,
+        'repeat': repeat,
+    }
+
+    mesh_io_time, meshes = time_reader(read_mesh, mesh_files, repeat)
+    results['mesh_io_seconds'] = mesh_io_time
+    results['vertices'] = int(sum(len(m['vertices']) for m in meshes))
+    results['faces'] = int(sum(len(m['faces']) for m in meshes))
+    print(f"  mesh_io: {mesh_io_time:.3f} s ({total_bytes / 1e6 / mesh_io_time:.1f} MB/s)")
+
+    if TRIMESH_AVAILABLE:
+        trimesh_time, reference = time_reader(load_with_trimesh, mesh_files, repeat)
+        mismatches = [
+            str(mesh_file) for mesh_file, ours, theirs in zip(mesh_files, meshes, reference)
+            if not (np.allclose(ours['vertices'], theirs['vertices'], atol=1e-5)
+                    and np.array_equal(ours['faces'], theirs['faces']))
+        ]
+        results['trimesh_seconds'] = trimesh_time
+        results['speedup'] = trimesh_time / mesh_io_time
+        results['mismatches'] = mismatches
+        print(f"  trimesh: {trimesh_time:.3f} s ({total_bytes / 1e6 / trimesh_time:.1f} MB/s)")
+        print(f"  Speedup: {results['speedup']:.1f}x, {len(mismatches)} mismatching files")
+        for mesh_file in mismatches:
+            print(f"    - {mesh_file}")
+    else:
+        print("  trimesh not installed, skipping comparison. Install with: pip install trimesh")
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark mesh_io against trimesh on the meshes/ tree')
+    parser.add_argument('--mesh-dir', default='meshes',
+                       help='Root of the mesh tree (default: meshes)')
+    parser.add_argument('--repeat', type=int, default=3,
+                       help='Number of timed runs, the best one is reported')
+    parser.add_argument('--json', dest='json_file',
+                       help='Also write the results to this JSON file')
+
+    args = parser.parse_args()
+    results = run_benchmark(args.mesh_dir, args.repeat)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.json_file}")
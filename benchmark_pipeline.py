@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Meshing Pipeline Benchmark
+Times each stage of the templateflow_processor.py meshing pipeline on
+synthetic label volumes, without any network access:
+  label index -> label masks -> opening/closing -> marching cubes
+  -> RAS conversion -> decimation -> serialization (JSON and binary bundle)
+Results are written as JSON and compared against a stored baseline; a stage
+slower than the baseline by more than the regression threshold fails the run.
+"""
+
+import argparse
+import json
+import platform
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from skimage import measure
+
+import synthetic_data
+from mesh_decimation import DEFAULT_LOD_RATIOS, DEFAULT_MAX_ERROR, build_lod_chain
+from templateflow_processor import (
+    build_label_index, compact_label_dtype, extract_label_mask, save_meshes, smooth_mask, voxels_to_ras
+)
+
+DEFAULT_BASELINE = 'benchmark_pipeline_baseline.json'
+
+# Scenario name -> (voxel size in mm, number of labels)
+SCENARIOS = {
+    '1mm-14': (1.0, 14),
+    '1mm-400': (1.0, 400),
+    '0.5mm-14': (0.5, 14),
+    '0.5mm-400': (0.5, 400),
+}
+
+STAGES = ['label_index', 'label_masks', 'morphology', 'marching_cubes',
+          'ras_conversion', 'decimation', 'serialization']
+
+def make_label_volume(n_labels, voxel_size=1.0, seed=0):
+    """Synthetic label volume (see synthetic_data.py) in the processor's atlas dtype"""
+    # Same compact dtype as the atlas loaded by process_templateflow_data
+    volume = synthetic_data.make_label_volume(n_labels, voxel_size, seed)
+    return volume.astype(compact_label_dtype(volume.max()))
+
+def run_pipeline(volume, output_dir, smoothing_iterations=2):
+    """Run every stage on a volume; returns (stage timings in seconds, counts)"""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    start = time.perf_counter()
+    label_index = build_label_index(volume)
+    timings['label_index'] = time.perf_counter() - start
+
+    counts = {'labels': len(label_index), 'voxels': 0, 'vertices': 0, 'faces': 0}
+    meshes = {}
+    decimated_ratios = [ratio for ratio in DEFAULT_LOD_RATIOS if ratio < 1.0]
+    for label_id, entry in label_index.items():
+        start = time.perf_counter()
+        mask, origin = extract_label_mask(volume, label_id, smoothing_iterations, entry['bbox'])
+        timings['label_masks'] += time.perf_counter() - start
+        counts['voxels'] += entry['voxels']
+
+        start = time.perf_counter()
+        mask = smooth_mask(mask, smoothing_iterations)
+        timings['morphology'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            vertices, faces, normals, _ = measure.marching_cubes(mask, level=0.5, spacing=(1.0, 1.0, 1.0))
+        except ValueError:
+            # Label removed by the opening
+            continue
+        timings['marching_cubes'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        vertices = voxels_to_ras(vertices, origin)
+        timings['ras_conversion'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        build_lod_chain(vertices, faces, decimated_ratios, DEFAULT_MAX_ERROR)
+        timings['decimation'] += time.perf_counter() - start
+
+        meshes[f'label_{label_id}'] = {'vertices': vertices, 'faces': faces, 'normals': normals}
+        counts['vertices'] += len(vertices)
+        counts['faces'] += len(faces)
+
+    start = time.perf_counter()
+    save_meshes(meshes, Path(output_dir), 'benchmark', 'both')
+    timings['serialization'] = time.perf_counter() - start
+
+    counts['meshes'] = len(meshes)
+    return timings, counts
+
+def run_benchmark(scenarios=list(SCENARIOS), repeat=1):
+    """Benchmark the pipeline on every scenario; the best time of each stage is kept"""
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+        },
+        'repeat': repeat,
+        'scenarios': {},
+    }
+
+    for name in scenarios:
+        voxel_size, n_labels = SCENARIOS[name]
+        print(f"{name}: building a {voxel_size} mm volume with {n_labels} labels...")
+        volume = make_label_volume(n_labels, voxel_size)
+
+        best = dict.fromkeys(STAGES, float('inf'))
+        with tempfile.TemporaryDirectory() as output_dir:
+            for _ in range(repeat):
+                timings, counts = run_pipeline(volume, output_dir)
+                best = {stage: min(best[stage], timings[stage]) for stage in STAGES}
+
+        results['scenarios'][name] = {
+            'shape': list(volume.shape),
+            'voxel_size': voxel_size,
+            **counts,
+            'stages': best,
+            'total': sum(best.values()),
+        }
+        for stage in STAGES:
+            print(f"  {stage:<16} {best[stage]:8.3f} s")
+        print(f"  {'total':<16} {sum(best.values()):8.3f} s "
+              f"({counts['meshes']} meshes, {counts['faces']} faces)")
+    return results
+
+def compare_to_baseline(results, baseline, threshold=0.25, min_seconds=0.05):
+    """Stages slower than the baseline by more than `threshold` (a fraction)
+
+    Stages faster than `min_seconds` in the baseline are too noisy to
+    compare and are skipped. Returns a list of regression dicts.
+    """
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        reference = baseline.get('scenarios', {}).get(name)
+        if reference is None:
+            continue
+        for stage, seconds in scenario['stages'].items():
+            before = reference['stages'].get(stage)
+            if before is None or before < min_seconds:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append({
+                    'scenario': name,
+                    'stage': stage,
+                    'baseline': before,
+                    'current': seconds,
+                    'slowdown': seconds / before,
+                })
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the meshing pipeline on synthetic label volumes')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS),
+                       help='Volume sizes and label counts to benchmark (default: all)')
+    parser.add_argument('--repeat', type=int, default=1,
+                       help='Number of timed runs per scenario, the best time of each stage is reported')
+    parser.add_argument('--json', dest='json_file',
+                       help='Also write the results to this JSON file')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                       help=f'Baseline results to compare against (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--update-baseline', action='store_true',
+                       help='Overwrite the baseline with these results instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                       help='Allowed slowdown of a stage over the baseline, as a fraction (default: 0.25)')
+
+    args = parser.parse_args()
+    results = run_benchmark(args.scenarios, args.repeat)
+
+    if args.json_file:
+        with open(args.json_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.json_file}")
+
+    baseline_file = Path(args.baseline)
+    if args.update_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Updated baseline {baseline_file}")
+    elif baseline_file.exists():
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} stages regressed by more than {args.threshold:.0%}:")
+            for regression in regressions:
+                print(f"  {regression['scenario']} {regression['stage']}: "
+                      f"{regression['baseline']:.3f} s -> {regression['current']:.3f} s "
+                      f"({regression['slowdown']:.2f}x)")
+            raise SystemExit(1)
+        print(f"\nNo stage regressed by more than {args.threshold:.0%} against {baseline_file}")
+    else:
+        print(f"\nNo baseline at {baseline_file}, run with --update-baseline to store one")
@@ -0,0 +1,204 @@
+"""
+Incremental Builds
+Build manifest and file watcher shared by the incremental build modes of
+gallery/build_index.py and compile_mesh_bundles.py.
+
+The manifest (JSON) records a fingerprint of every input file (modification
+time, size and SHA-256) and, for every build target, the hashes of the
+inputs and the options it was built from. A target is rebuilt only if one of
+these changed or one of its outputs is missing. Files whose modification
+time and size are unchanged are not hashed again, and files that were only
+touched keep their target up to date.
+
+`watch` calls a rebuild function when watched files change, after a
+debounce delay so that a burst of changes (an editor save, a copied
+directory) gives a single rebuild. It uses filesystem notifications through
+the watchdog package (in requirements.txt); if it is missing, it falls back
+to polling the modification times of the whole tree every
+DEFAULT_POLL_INTERVAL seconds, which is slower to notice changes.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from mesh_cache import hash_file
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    WATCHDOG_AVAILABLE = True
+except ImportError:
+    WATCHDOG_AVAILABLE = False
+
+MANIFEST_VERSION = 1
+DEFAULT_DEBOUNCE = 0.2  # seconds
+DEFAULT_POLL_INTERVAL = 0.5  # seconds
+
+class BuildManifest:
+    """Input fingerprints and target records, stored in a JSON file
+
+    Paths are recorded relative to the manifest's directory.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.root = self.path.parent
+        self.files = {}
+        self.targets = {}
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                self.files = manifest['files']
+                self.targets = manifest['targets']
+        except (OSError, ValueError, KeyError):
+            pass
+        self.saved = self._serialize()
+
+    def _key(self, path):
+        return Path(os.path.relpath(os.path.abspath(path), self.root)).as_posix()
+
+    def fingerprint(self, path):
+        """SHA-256 of a file, hashed again only if its mtime or size changed; None if it is missing"""
+        key = self._key(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files.pop(key, None)
+            return None
+        record = self.files.get(key)
+        if record is None or record['mtime_ns'] != stat.st_mtime_ns or record['size'] != stat.st_size:
+            record = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': hash_file(path)}
+            self.files[key] = record
+        return record['sha256']
+
+    def input_hashes(self, inputs):
+        return {self._key(path): self.fingerprint(path) for path in inputs}
+
+    def is_current(self, target, inputs, options=None, outputs=()):
+        """Whether `target` was built from these inputs and options and its outputs exist"""
+        record = self.targets.get(target)
+        return (record is not None
+                and record['options'] == options
+                and record['inputs'] == self.input_hashes(inputs)
+                and all(Path(output).exists() for output in outputs))
+
+    def record(self, target, inputs, options=None):
+        self.targets[target] = {'options': options, 'inputs': self.input_hashes(inputs)}
+
+    def _serialize(self):
+        return json.dumps({'version': MANIFEST_VERSION, 'files': self.files, 'targets': self.targets},
+                          indent=1, sort_keys=True)
+
+    def save(self):
+        """Write the manifest if it changed"""
+        data = self._serialize()
+        if data != self.saved:
+            self.root.mkdir(parents=True, exist_ok=True)
+            temporary = self.path.with_name(self.path.name + '.tmp')
+            temporary.write_text(data)
+            os.replace(temporary, self.path)
+            self.saved = data
+
+def write_if_changed(path, data):
+    """Write bytes or text to `path` unless it already holds them; returns whether it was written
+
+    Unchanged outputs keep their modification time, so whatever depends on
+    them (HTTP caches, later build steps) sees no change either.
+    """
+    path = Path(path)
+    data = data.encode() if isinstance(data, str) else data
+    try:
+        if path.stat().st_size == len(data) and path.read_bytes() == data:
+            return False
+    except OSError:
+        pass
+    path.write_bytes(data)
+    return True
+
+def _snapshot(roots, ignore):
+    """{path: (mtime_ns, size)} of every file under `roots` that is not ignored"""
+    files = {}
+    for root in roots:
+        for directory, _, names in os.walk(root):
+            for name in names:
+                path = os.path.join(directory, name)
+                if ignore(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+def _poll_changes(roots, ignore, events, poll_interval):
+    """Put the paths of changed, added and removed files on `events`, forever"""
+    previous = _snapshot(roots, ignore)
+    while True:
+        time.sleep(poll_interval)
+        current = _snapshot(roots, ignore)
+        for path in set(previous) | set(current):
+            if previous.get(path) != current.get(path):
+                events.put(path)
+        previous = current
+
+def watch(roots, rebuild, ignore=lambda path: False, debounce=DEFAULT_DEBOUNCE,
+          poll_interval=DEFAULT_POLL_INTERVAL):
+    """Call `rebuild(changed paths)` whenever files under `roots` change, until interrupted
+
+    Changes are collected until none arrived for `debounce` seconds. Paths
+    for which `ignore(path)` is true (e.g. the build outputs) are skipped.
+    An exception raised by `rebuild` is reported and watching goes on;
+    `rebuild` should read its inputs before writing outputs or its manifest,
+    so that a failed rebuild leaves them as they were.
+    """
+    events = queue.Queue()
+    roots = [os.path.abspath(root) for root in roots]
+    if WATCHDOG_AVAILABLE:
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Reads (e.g. by the rebuild itself) are reported as opened/closed_no_write
+                if event.is_directory or event.event_type in ('opened', 'closed_no_write'):
+                    return
+                for path in (event.src_path, getattr(event, 'dest_path', None)):
+                    if path and not ignore(path):
+                        events.put(path)
+
+        observer = Observer()
+        for root in roots:
+            observer.schedule(Handler(), root, recursive=True)
+        observer.start()
+        print(f"Watching {', '.join(roots)} (Ctrl+C to stop)")
+    else:
+        observer = None
+        threading.Thread(target=_poll_changes, args=(roots, ignore, events, poll_interval), daemon=True).start()
+        print(f"Watching {', '.join(roots)} by polling every {poll_interval} s "
+              f"(watchdog is not installed: pip install -r requirements.txt for filesystem notifications; "
+              f"Ctrl+C to stop)")
+
+    try:
+        while True:
+            changed = {events.get()}
+            while True:
+                try:
+                    changed.add(events.get(timeout=debounce))
+                except queue.Empty:
+                    break
+            try:
+                rebuild(sorted(changed))
+            except Exception as e:
+                # e.g. a file caught half-written: report it and wait for the next change
+                print(f"Rebuild failed, keeping the previous outputs: {e}")
+                traceback.print_exc()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
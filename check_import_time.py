@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Import Time Budget Check
+Imports a CLI module in a fresh interpreter with `python -X importtime` and
+fails if its import takes longer than the budget, or if it pulls in one of
+the heavy dependencies that must only be imported by the commands using
+them (see the docstring of templateflow_processor.py).
+"""
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+DEFAULT_MODULES = ['templateflow_processor']
+DEFAULT_BUDGET_MS = 350
+
+# Top-level packages that must not be imported at module import time
+HEAVY_MODULES = ['nibabel', 'skimage', 'scipy', 'templateflow', 'trimesh']
+
+def measure_import(module):
+    """Import `module` once with -X importtime
+
+    Returns (total milliseconds, {package: cumulative milliseconds}) for the
+    module and the packages it imports directly.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=Path(__file__).parent
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    # Nested imports are listed before their parent, indented by two spaces
+    # per level; interpreter startup imports are other top-level entries
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        milliseconds = int(cumulative) / 1000
+        if depth == 1:
+            children[name.strip()] = milliseconds
+        elif depth == 0:
+            if name.strip() == module:
+                return milliseconds, children
+            children = {}
+    raise RuntimeError(f"No import time reported for {module}")
+
+def imported_packages(module):
+    """Top-level package names of every module loaded by importing `module`"""
+    result = subprocess.run(
+        [sys.executable, '-c', f'import sys, {module}; print(" ".join(sys.modules))'],
+        capture_output=True, text=True, check=True, cwd=Path(__file__).parent
+    )
+    return {name.split('.')[0] for name in result.stdout.split()}
+
+def check_module(module, budget_ms, repeat=3, top=5):
+    """Check one module against the budget; returns a list of failure messages"""
+    runs = [measure_import(module) for _ in range(repeat)]
+    total, imports = min(runs, key=lambda run: run[0])
+    print(f"{module}: {total:.0f} ms (budget {budget_ms} ms, best of {repeat})")
+    for name, milliseconds in sorted(imports.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {milliseconds:8.1f} ms  {name}")
+
+    failures = []
+    if total > budget_ms:
+        failures.append(f"{module} takes {total:.0f} ms to import, over the {budget_ms} ms budget")
+    heavy = sorted(imported_packages(module) & set(HEAVY_MODULES))
+    if heavy:
+        failures.append(f"{module} imports {', '.join(heavy)} at import time")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the import time of the CLI modules against a budget')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES,
+                       help=f'Modules to check (default: {" ".join(DEFAULT_MODULES)})')
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                       help=f'Import time budget per module in milliseconds (default: {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--repeat', type=int, default=3,
+                       help='Number of imports per module, the fastest one is checked')
+
+    args = parser.parse_args()
+    failures = []
+    for module in args.modules:
+        failures += check_module(module, args.budget_ms, args.repeat)
+
+    if failures:
+        print("\nImport time check failed:")
+        for failure in failures:
+            print(f"  - {failure}")
+        raise SystemExit(1)
+    print("\nImport time check passed")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Mesh Bundle Compiler
+Packs the Brain4Blender OBJ/PLY files of the meshes/ tree into one binary
+bundle per atlas/view (see mesh_bundle.py), so that the viewer can fetch a
+whole hemisphere set in a single request instead of one HEAD + GET per
+structure.
+
+Input layout (as produced by download_meshes.sh):
+  meshes/cortical/{desikan,destrieux,dkt}/<structure>.{obj,ply}
+  meshes/subcortical/<structure>.{obj,ply}
+
+Output layout:
+  <output-dir>/cortical_<atlas>.manifest.json + .bin
+  <output-dir>/subcortical.manifest.json + .bin
+  <output-dir>/index.json   (atlas -> view -> manifest file)
+
+With --merged, every cortical atlas also gets
+  <output-dir>/cortical_<atlas>_merged.manifest.json + .bin
+holding one welded mesh per hemisphere ('left', 'right') with per-vertex
+structure ids (see mesh_merge.py), listed as the 'corticalMerged' view.
+
+With --spatial, every structure also gets its bounds and a BVH for picking
+(see mesh_spatial.py); they are left out by default as the BVH can be as
+large as the mesh itself.
+
+With --cleanup, meshes are welded, cleaned of degenerate and duplicate faces
+and reordered for the GPU vertex cache before bundling (see mesh_cleanup.py),
+and the vertex/face counts and ACMR before and after are reported.
+
+With --incremental, <output-dir>/.build_manifest.json records the mesh
+files and options of every bundle, and only bundles whose inputs changed
+are compiled again; --watch also recompiles them whenever mesh files change.
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from build_manifest import BuildManifest, watch, write_if_changed
+from mesh_bundle import write_mesh_bundle
+from mesh_cleanup import DEFAULT_WELD_TOLERANCE, cleanup_meshes, format_cleanup_stats
+from mesh_encoding import DEFAULT_MAX_POSITION_ERROR
+from mesh_io import read_mesh
+from mesh_merge import merge_structures
+
+CORTICAL_ATLASES = ['desikan', 'destrieux', 'dkt']
+
+# Same preference order as loadSingleMesh in js/mesh-loader.js
+MESH_FORMATS = ['obj', 'ply']
+
+BUILD_MANIFEST = '.build_manifest.json'
+
+# Hemisphere of a structure name, by prefix, in bundle order
+HEMISPHERE_PREFIXES = {
+    'left': ('lh_', 'Left-'),
+    'right': ('rh_', 'Right-'),
+}
+
+def structure_name_from_file(mesh_file):
+    """Map a mesh file name to the structure name used in atlas-definitions.js"""
+    name = mesh_file.stem
+    # FreeSurfer names the thalamus 'Thalamus-Proper'; the viewer uses 'Thalamus'
+    if name.endswith('-Thalamus-Proper'):
+        name = name[:-len('-Proper')]
+    return name
+
+def get_hemisphere(structure):
+    """Hemisphere group of a structure name ('left', 'right' or 'other')"""
+    for hemisphere, prefixes in HEMISPHERE_PREFIXES.items():
+        if structure.startswith(prefixes):
+            return hemisphere
+    return 'other'
+
+def find_mesh_files(directory):
+    """Map structure names to mesh files in `directory`, preferring OBJ over PLY"""
+    mesh_files = {}
+    for mesh_format in MESH_FORMATS:
+        for mesh_file in sorted(directory.glob(f'*.{mesh_format}')):
+            mesh_files.setdefault(structure_name_from_file(mesh_file), mesh_file)
+    return mesh_files
+
+def read_meshes(mesh_files, structures, cleanup=False, weld_tolerance=DEFAULT_WELD_TOLERANCE):
+    """{structure: mesh} of `structures`, cleaned up and reordered if `cleanup` is set"""
+    meshes = {structure: read_mesh(mesh_files[structure]) for structure in structures}
+    if cleanup:
+        meshes, stats = cleanup_meshes(meshes, weld_tolerance)
+        print(f"  Cleanup: {format_cleanup_stats(stats)}")
+    return meshes
+
+def compile_bundle(directory, output_dir, name, encode=False, max_position_error=None, spatial=False,
+                   cleanup=False, weld_tolerance=DEFAULT_WELD_TOLERANCE):
+    """Pack every mesh of `directory` into the <name> bundle
+
+    Structures are ordered by hemisphere, then by name, so each hemisphere
+    is one contiguous byte range recorded in the manifest's groups. With
+    `spatial`, the manifest also carries every structure's bounds and BVH.
+    With `cleanup`, meshes are cleaned up and keep their vertex cache order.
+    Returns the manifest path, or None if the directory holds no meshes.
+    """
+    mesh_files = find_mesh_files(directory)
+    if not mesh_files:
+        print(f"  No mesh files found in {directory}")
+        return None
+
+    hemisphere_order = list(HEMISPHERE_PREFIXES) + ['other']
+    structures = sorted(
+        mesh_files, key=lambda s: (hemisphere_order.index(get_hemisphere(s)), s)
+    )
+    groups = {hemisphere: [] for hemisphere in hemisphere_order}
+    for structure in structures:
+        groups[get_hemisphere(structure)].append(structure)
+
+    meshes = read_meshes(mesh_files, structures, cleanup, weld_tolerance)
+
+    manifest_file = write_mesh_bundle(
+        meshes, output_dir, name, groups=groups, encode=encode, max_position_error=max_position_error,
+        spatial=spatial, keep_face_order=cleanup
+    )
+    bundle_size = (output_dir / f'{name}.bin').stat().st_size
+    source_size = sum(f.stat().st_size for f in mesh_files.values())
+    print(f"  {name}: {len(meshes)} structures, "
+          f"{source_size / 1e6:.1f} MB of mesh files -> {bundle_size / 1e6:.1f} MB bundle")
+    return manifest_file
+
+def compile_merged_bundle(directory, output_dir, name, encode=False, max_position_error=None, spatial=False,
+                          cleanup=False, weld_tolerance=DEFAULT_WELD_TOLERANCE):
+    """Merge the meshes of `directory` into one mesh per hemisphere and write the <name> bundle
+
+    Returns the manifest path, or None if the directory holds no meshes.
+    """
+    mesh_files = find_mesh_files(directory)
+    hemispheres = {}
+    for structure in sorted(mesh_files):
+        hemisphere = get_hemisphere(structure)
+        if hemisphere in HEMISPHERE_PREFIXES:
+            hemispheres.setdefault(hemisphere, []).append(structure)
+    hemispheres = {hemisphere: read_meshes(mesh_files, structures, cleanup, weld_tolerance)
+                   for hemisphere, structures in hemispheres.items()}
+    if not hemispheres:
+        print(f"  No hemisphere meshes found in {directory}")
+        return None
+
+    merged = {}
+    for hemisphere in HEMISPHERE_PREFIXES:
+        if hemisphere in hemispheres:
+            merged[hemisphere] = merge_structures(hemispheres[hemisphere])
+    manifest_file = write_mesh_bundle(
+        merged, output_dir, name, encode=encode, max_position_error=max_position_error, spatial=spatial,
+        keep_face_order=cleanup
+    )
+    source_vertices = sum(len(mesh['vertices']) for meshes in hemispheres.values() for mesh in meshes.values())
+    merged_vertices = sum(len(mesh['vertices']) for mesh in merged.values())
+    print(f"  {name}: {sum(map(len, hemispheres.values()))} structures -> {len(merged)} meshes, "
+          f"{source_vertices} -> {merged_vertices} vertices")
+    return manifest_file
+
+def compile_mesh_bundles(mesh_dir='meshes', output_dir='meshes/bundles', atlases=CORTICAL_ATLASES,
+                         encode=False, max_position_error=None, spatial=False, merged=False,
+                         cleanup=False, weld_tolerance=DEFAULT_WELD_TOLERANCE, build_manifest=None):
+    """Compile the cortical bundle of every atlas and the subcortical bundle
+
+    With `merged`, also compile the merged hemisphere bundle of every atlas.
+    With `cleanup`, meshes are cleaned up and reordered first. With a
+    `build_manifest` (see build_manifest.py), bundles whose mesh files and
+    options are unchanged are not compiled again.
+    """
+    mesh_dir = Path(mesh_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    options = {'encode': encode, 'max_position_error': max_position_error, 'spatial': spatial,
+               'cleanup': cleanup, 'weld_tolerance': weld_tolerance}
+
+    def build(compile_function, directory, name):
+        if build_manifest is not None:
+            inputs = sorted(find_mesh_files(directory).values())
+            outputs = [output_dir / f'{name}.manifest.json', output_dir / f'{name}.bin']
+            if inputs and build_manifest.is_current(name, inputs, options, outputs):
+                print(f"  {name}: up to date")
+                return outputs[0]
+        manifest_file = compile_function(directory, output_dir, name, encode, max_position_error, spatial,
+                                         cleanup, weld_tolerance)
+        if build_manifest is not None:
+            build_manifest.record(name, inputs, options)
+        return manifest_file
+
+    index = {}
+    for atlas in atlases:
+        manifest_file = build(compile_bundle, mesh_dir / 'cortical' / atlas, f'cortical_{atlas}')
+        if manifest_file is not None:
+            index.setdefault(atlas, {})['cortical'] = manifest_file.name
+        if merged:
+            manifest_file = build(compile_merged_bundle, mesh_dir / 'cortical' / atlas, f'cortical_{atlas}_merged')
+            if manifest_file is not None:
+                index.setdefault(atlas, {})['corticalMerged'] = manifest_file.name
+
+    # Subcortical meshes are shared by every atlas
+    manifest_file = build(compile_bundle, mesh_dir / 'subcortical', 'subcortical')
+    if manifest_file is not None:
+        for atlas in atlases:
+            index.setdefault(atlas, {})['subcortical'] = manifest_file.name
+
+    index_file = output_dir / 'index.json'
+    write_if_changed(index_file, json.dumps(index, indent=2))
+    if build_manifest is not None:
+        build_manifest.save()
+
+    print(f"Wrote bundle index to {index_file}")
+    return index_file
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compile the meshes/ tree into packed binary bundles')
+    parser.add_argument('--mesh-dir', default='meshes',
+                       help='Root of the mesh tree (default: meshes)')
+    parser.add_argument('--output-dir', default='meshes/bundles',
+                       help='Output directory for the bundles (default: meshes/bundles)')
+    parser.add_argument('--atlases', nargs='+', default=CORTICAL_ATLASES,
+                       help='Cortical atlases to compile, as directories of <mesh-dir>/cortical '
+                            '(default: desikan destrieux dkt)')
+    parser.add_argument('--encode', action='store_true',
+                       help='Quantize and compress the bundles (16-bit positions, varint indices)')
+    parser.add_argument('--max-position-error', type=float, default=DEFAULT_MAX_POSITION_ERROR,
+                       help='Maximum position error in mm allowed when encoding')
+    parser.add_argument('--merged', action='store_true',
+                       help='Also merge each cortical hemisphere into one mesh with per-vertex structure ids')
+    parser.add_argument('--cleanup', action='store_true',
+                       help='Weld vertices, drop degenerate and duplicate faces and reorder for the GPU vertex cache')
+    parser.add_argument('--weld-tolerance', type=float, default=DEFAULT_WELD_TOLERANCE,
+                       help=f'Distance in mm within which --cleanup welds vertices (default: {DEFAULT_WELD_TOLERANCE})')
+    parser.add_argument('--spatial', action=argparse.BooleanOptionalAction, default=False,
+                       help='Add the per-structure bounds and BVH (see mesh_spatial.py) to the bundles')
+    parser.add_argument('--incremental', action='store_true',
+                       help=f'Only compile the bundles whose mesh files or options changed '
+                            f'(tracked in <output-dir>/{BUILD_MANIFEST})')
+    parser.add_argument('--watch', action='store_true',
+                       help='Compile incrementally, then again whenever a mesh file changes (filesystem notifications '
+                            'through watchdog; polls the tree every 0.5 s if it is not installed)')
+
+    args = parser.parse_args()
+
+    build_manifest = None
+    if args.incremental or args.watch:
+        build_manifest = BuildManifest(Path(args.output_dir) / BUILD_MANIFEST)
+
+    def compile_all():
+        start = time.perf_counter()
+        print("Compiling mesh bundles...")
+        compile_mesh_bundles(args.mesh_dir, args.output_dir, args.atlases,
+                             args.encode, args.max_position_error, args.spatial, args.merged,
+                             args.cleanup, args.weld_tolerance, build_manifest)
+        print(f"Done in {time.perf_counter() - start:.2f} s")
+
+    compile_all()
+    if args.watch:
+        output_dir = Path(args.output_dir).resolve()
+        watch([args.mesh_dir], lambda changed: compile_all(),
+              ignore=lambda path: (output_dir in Path(path).resolve().parents
+                                   or not path.endswith(tuple(f'.{mesh_format}' for mesh_format in MESH_FORMATS))))
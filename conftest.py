@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+SPHERE_LABEL = 17
+
+def mean_outwardness(vertices, normals):
+    """Mean dot product of the normals with the outward radial direction"""
+    radial = vertices - vertices.mean(axis=0)
+    radial /= np.linalg.norm(radial, axis=1, keepdims=True)
+    return np.einsum('ij,ij->i', radial, normals).mean()
+
+@pytest.fixture
+def outwardness():
+    return mean_outwardness
+
+@pytest.fixture
+def sphere_volume():
+    """(label volume holding a sphere of radius 10, its label)"""
+    size = 32
+    grid = np.indices((size, size, size)) - (size - 1) / 2
+    volume = np.where(np.sqrt((grid ** 2).sum(axis=0)) < 10, SPHERE_LABEL, 0).astype(np.int16)
+    return volume, SPHERE_LABEL
+
+@pytest.fixture
+def sphere_mesh(sphere_volume):
+    """Sphere meshed by marching cubes like a structure mask (clockwise winding seen from outside)
+
+    Returns (vertices, faces, gradient normals).
+    """
+    from skimage import measure
+
+    volume, label = sphere_volume
+    vertices, faces, normals, _ = measure.marching_cubes((volume == label).astype(np.float32), level=0.5)
+    return vertices, faces, normals
@@ -1,29 +1,161 @@
-from templateflow.api import get
-import nibabel as nib
+#!/usr/bin/env python3
+"""
+Schaefer2018 Parcellation Meshes
+Gets the Schaefer2018 parcellation of MNI152NLin2009cAsym from TemplateFlow
+(or a local dseg volume) and meshes it:
+  - by default, every parcel in one multi-label surface nets pass (see
+    surface_nets.py), so neighbouring parcels share their boundary
+    vertices; each parcel is written to <output-dir>/<name>.<format>,
+    with label_lut.json mapping label ids to names and files
+  - with --label, a single label with marching cubes, exported to STL
+"""
+
+import argparse
+import csv
+import json
+import re
+import time
+from pathlib import Path
+
 import numpy as np
-from skimage import measure
-import trimesh
 
-# 1. Get full probabilistic subcortical atlas
-paths = get(template='MNI152NLin2009cAsym', resolution=1, suffix='dseg', atlas="Schaefer2018")
-# Find the path that contains the "desc-400Parcels"
+from mesh_bundle import write_mesh_bundle
+from mesh_io import write_mesh
+from surface_nets import DEFAULT_RELAX_ITERATIONS, mesh_all_labels
+from template_manifest import parse_template_filename
+
+OUTPUT_FORMATS = ['obj', 'ply', 'bundle']
+LUT_FILE = 'label_lut.json'
+
+def get_schaefer_atlas(parcels=400, networks=None):
+    """Path of the Schaefer2018 dseg volume and of its label table (None if unavailable)"""
+    from templateflow.api import get
+
+    # 1. Get the Schaefer2018 parcellations
+    paths = get(template='MNI152NLin2009cAsym', resolution=1, suffix='dseg', atlas="Schaefer2018")
+    # Find the path that contains the "desc-<parcels>Parcels"
+    desc = f'desc-{parcels}Parcels' + (f'{networks}Networks' if networks else '')
+    matches = [path for path in paths if desc in str(path)]
+    if not matches:
+        raise ValueError(f"No Schaefer2018 parcellation matches {desc}")
+    path = matches[0]
+    print(f"Using atlas file: {path}")
+
+    try:
+        entities, _, _ = parse_template_filename(Path(path).name)
+        lut = get(template='MNI152NLin2009cAsym', atlas='Schaefer2018', desc=entities['desc'],
+                  suffix='dseg', extension='.tsv')
+        lut = lut[0] if isinstance(lut, list) else lut
+    except Exception as e:
+        print(f"Warning: could not get the label table: {e}")
+        lut = None
+    return Path(path), Path(lut) if lut else None
+
+def read_label_table(lut_file):
+    """{label id: name} from a TemplateFlow dseg TSV (index and name columns)"""
+    with open(lut_file, newline='') as f:
+        return {int(row['index']): row['name'] for row in csv.DictReader(f, delimiter='\t')}
+
+def safe_filename(name):
+    """A structure name usable as a file name"""
+    return re.sub(r'[^\w.-]+', '_', name)
+
+def mesh_single_label(atlas_file, label_value, output_file):
+    """Marching cubes mesh of one label, exported to STL"""
+    import nibabel as nib
+    from skimage import measure
+    import trimesh
+
+    # 2. Load the volume
+    img = nib.load(str(atlas_file))
+    data = img.get_fdata()
+
+    # 3. Extract the label (you must confirm this matches the structure in the atlas LUT)
+    binary_mask = (data == label_value)
+
+    # 4. Marching cubes to generate surface
+    verts, faces, _, _ = measure.marching_cubes(binary_mask.astype(np.uint8), level=0.5)
+    mesh = trimesh.Trimesh(vertices=verts, faces=faces)
+
+    # 5. Export to STL
+    mesh.export(output_file)
+    print(f"Saved label {label_value} to {output_file}")
+
+def mesh_parcellation(atlas_file, output_dir, output_format='obj', lut_file=None,
+                      relax_iterations=DEFAULT_RELAX_ITERATIONS):
+    """Mesh every parcel of a dseg volume at once and write the meshes and label_lut.json
+
+    Vertices are in the world (mm) coordinates of the volume's affine.
+    """
+    import nibabel as nib
+    from templateflow_processor import load_label_volume
+
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    img = nib.load(str(atlas_file))
+    volume, _ = load_label_volume(img)
+    names = read_label_table(lut_file) if lut_file else {}
+    print(f"Loaded {volume.shape} labels ({time.perf_counter() - start:.2f} s)")
+
+    start = time.perf_counter()
+    meshes = mesh_all_labels(volume, img.affine, relax_iterations)
+    total_faces = sum(len(mesh['faces']) for mesh in meshes.values())
+    print(f"Meshed {len(meshes)} parcels, {total_faces} faces ({time.perf_counter() - start:.2f} s)")
 
-for path in paths:
-    if 'desc-400Parcels' in str(path):
-        break
-print(f"Using atlas file: {path}")
+    start = time.perf_counter()
+    named_meshes = {names.get(label, f'label_{label:04d}'): mesh for label, mesh in meshes.items()}
+    labels = []
+    if output_format == 'bundle':
+        bundle_name = safe_filename(Path(atlas_file).name.split('.')[0])
+        manifest_file = write_mesh_bundle(named_meshes, output_path, bundle_name)
+    for (label, mesh), name in zip(meshes.items(), named_meshes):
+        entry = {'index': label, 'name': name,
+                 'vertexCount': len(mesh['vertices']), 'faceCount': len(mesh['faces'])}
+        if output_format == 'bundle':
+            entry['bundle'] = manifest_file.name
+        else:
+            mesh_file = output_path / f'{safe_filename(name)}.{output_format}'
+            write_mesh(mesh_file, mesh['vertices'], mesh['faces'])
+            entry['file'] = mesh_file.name
+        labels.append(entry)
 
-# 2. Load the volume
-img = nib.load(str(path))
-data = img.get_fdata()
+    lut_path = output_path / LUT_FILE
+    with open(lut_path, 'w') as f:
+        json.dump({'atlas': Path(atlas_file).name, 'labels': labels}, f, indent=2)
+    print(f"Saved {len(labels)} parcels and {lut_path} ({time.perf_counter() - start:.2f} s)")
+    return lut_path
 
-# 3. Example: Extract label index 10 (you must confirm this matches Thalamus in atlas LUT)
-label_value = 10
-binary_mask = (data == label_value)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mesh the Schaefer2018 parcellation (or a local dseg volume)')
+    parser.add_argument('--atlas', default=None,
+                       help='Local dseg volume (NIfTI) to mesh instead of the TemplateFlow Schaefer2018 atlas')
+    parser.add_argument('--lut', default=None,
+                       help='Label table (TSV with index and name columns) of --atlas')
+    parser.add_argument('--parcels', type=int, default=400,
+                       help='Number of Schaefer2018 parcels (default: 400)')
+    parser.add_argument('--networks', type=int, choices=[7, 17], default=None,
+                       help='Schaefer2018 network version (default: the first one found)')
+    parser.add_argument('--output-dir', default='parcellation_meshes',
+                       help='Output directory of the per-parcel meshes (default: parcellation_meshes)')
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='obj',
+                       help='Per-parcel mesh files, or a single binary bundle (default: obj)')
+    parser.add_argument('--relax-iterations', type=int, default=DEFAULT_RELAX_ITERATIONS,
+                       help=f'Surface nets smoothing iterations (default: {DEFAULT_RELAX_ITERATIONS})')
+    parser.add_argument('--label', type=int, default=None,
+                       help='Only mesh this label with marching cubes and export it to STL')
+    parser.add_argument('--stl', default='tpl-MNI152NLin2009cAsym_label-L_Thalamus.stl',
+                       help='STL file written with --label')
 
-# 4. Marching cubes to generate surface
-verts, faces, _, _ = measure.marching_cubes(binary_mask.astype(np.uint8), level=0.5)
-mesh = trimesh.Trimesh(vertices=verts, faces=faces)
+    args = parser.parse_args()
+    if args.atlas:
+        atlas_file, lut_file = Path(args.atlas), args.lut
+    else:
+        atlas_file, lut_file = get_schaefer_atlas(args.parcels, args.networks)
+        lut_file = args.lut or lut_file
 
-# 5. Export to STL
-mesh.export('tpl-MNI152NLin2009cAsym_label-L_Thalamus.stl')
+    if args.label is not None:
+        mesh_single_label(atlas_file, args.label, args.stl)
+    else:
+        mesh_parcellation(atlas_file, args.output_dir, args.format, lut_file, args.relax_iterations)
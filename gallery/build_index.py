@@ -1,10 +1,50 @@
 import os
+import sys
+import csv
 import json
 import re
+import time
+import argparse
 from pathlib import Path
 
+import numpy as np
+
+from navr_threshold import DATA_DIR, load_navr_tables, threshold_datasets
+
+# build_manifest.py lives in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from build_manifest import BuildManifest, watch, write_if_changed
+
 GALLERY_DIR = os.path.join(os.path.dirname(__file__), '.')
 INDEX_FILE = os.path.join(GALLERY_DIR, 'index.json')
+PACK_FILE = os.path.join(GALLERY_DIR, 'gallery_pack.json')
+PACK_DATA_FILE = os.path.join(GALLERY_DIR, 'gallery_pack.bin')
+MANIFEST_FILE = os.path.join(GALLERY_DIR, '.build_manifest.json')
+OUTPUT_FILES = [INDEX_FILE, PACK_FILE, PACK_DATA_FILE, MANIFEST_FILE]
+
+# Same priority as DATA_CONFIG.COHEN_D_COLUMNS in js/data-processing.js
+EFFECT_SIZE_COLUMNS = ['Cohen_d', 'd_icv', 'Cohen_d_thresholded', 'd_icv_thresholded']
+COUNT_COLUMNS = ['population_size', 'n_patients', 'n_controls']
+
+# ENIGMA subcortical names -> FreeSurfer names, as in normalizeStructureName
+SUBCORTICAL_NAMES = {
+  'Laccumb': 'Left-Accumbens-area',
+  'Raccumb': 'Right-Accumbens-area',
+  'Lamyg': 'Left-Amygdala',
+  'Ramyg': 'Right-Amygdala',
+  'Lcaud': 'Left-Caudate',
+  'Rcaud': 'Right-Caudate',
+  'Lhippo': 'Left-Hippocampus',
+  'Rhippo': 'Right-Hippocampus',
+  'Lpal': 'Left-Pallidum',
+  'Rpal': 'Right-Pallidum',
+  'Lput': 'Left-Putamen',
+  'Rput': 'Right-Putamen',
+  'Lthal': 'Left-Thalamus',
+  'Rthal': 'Right-Thalamus',
+  'LLatVent': 'Left-Lateral-Ventricle',
+  'RLatVent': 'Right-Lateral-Ventricle'
+}
 
 def assert_is_metric(metric):
     valid_metrics = ['thickness', 'volume', 'area', 'subcortical_volume']
@@ -36,8 +76,213 @@ def scan_gallery(directory):
           index.append(entry)
   return sorted(index, key=lambda x: x["file"])
 
-if __name__ == "__main__":
+def normalize_structure_name(structure):
+  """Python mirror of normalizeStructureName in js/data-processing.js"""
+  if structure in SUBCORTICAL_NAMES:
+    return SUBCORTICAL_NAMES[structure]
+  if structure.startswith('L_'):
+    return 'lh_' + structure[2:]
+  if structure.startswith('R_'):
+    return 'rh_' + structure[2:]
+  return structure
+
+def parse_number(value, dtype):
+  """CSV cell as a number, NaN (float) or 0 (int) when empty or invalid
+
+  Non-finite cells (`inf`, `nan`) count as invalid for int columns.
+  """
+  try:
+    return dtype(float(value))
+  except (TypeError, ValueError, OverflowError):
+    return np.nan if dtype is float else 0
+
+def read_dataset(csv_file):
+  """Normalized structure names and effect-size/count columns of a gallery CSV
+
+  Rows are filtered the way processCsvData does: rows without a structure
+  are dropped, and the effect size is the first column of
+  EFFECT_SIZE_COLUMNS present in the file.
+  """
+  with open(csv_file, newline='') as f:
+    reader = csv.DictReader(f)
+    effect_column = next((c for c in EFFECT_SIZE_COLUMNS if c in reader.fieldnames), None)
+    if effect_column is None:
+      raise ValueError(f"No effect size column in {csv_file}")
+    rows = [row for row in reader if (row.get('Structure') or '').strip()]
+
+  structures = [normalize_structure_name(row['Structure'].strip()) for row in rows]
+  columns = {'effectSize': np.array([parse_number(row[effect_column], float) for row in rows], dtype='<f4')}
+  for column in COUNT_COLUMNS:
+    columns[column] = np.array([parse_number(row.get(column), int) for row in rows], dtype='<i4')
+  return structures, effect_column, columns
+
+def read_description(entry):
+  """Paper metadata of an index entry's description JSON ({} if there is none)"""
+  desc_file = os.path.join(GALLERY_DIR, entry['description'])
+  if not os.path.exists(desc_file):
+    return {}
+  with open(desc_file) as f:
+    return json.load(f)
+
+def read_pack(pack_file=PACK_FILE):
+  """{dataset file: (structures, effect size column, columns, meta)} of an existing pack
+
+  NAVR-thresholded columns are left out. Returns {} if there is no pack.
+  """
+  try:
+    with open(pack_file) as f:
+      pack = json.load(f)
+    with open(os.path.join(os.path.dirname(pack_file), pack['data']), 'rb') as f:
+      data = f.read()
+  except (OSError, ValueError, KeyError):
+    return {}
+
+  datasets = {}
+  for dataset in pack['datasets']:
+    columns = {}
+    for name, view in dataset['columns'].items():
+      if name != 'effectSizeThresholded':
+        dtype = '<f4' if view['type'] == 'float32' else '<i4'
+        columns[name] = np.frombuffer(data, dtype=dtype, count=view['byteLength'] // 4, offset=view['byteOffset'])
+    datasets[dataset['file']] = (
+      pack['structureLists'][dataset['structures']], dataset['effectSizeColumn'], columns, dataset['meta']
+    )
+  return datasets
+
+def build_pack(index, pack_file=PACK_FILE, data_file=PACK_DATA_FILE, navr_tables=None, reuse=None):
+  """Write the gallery pack: one JSON manifest plus one binary file of columns
+
+  The manifest holds, per dataset, the index entry, the paper metadata of
+  its description JSON, a reference to its (shared) list of normalized
+  structure names and the byte range of each column in the binary file:
+  float32 effect sizes (NaN when missing) and int32 counts (0 when missing).
+  With `navr_tables` (see navr_threshold.py), the NAVR-thresholded effect
+  sizes are stored next to the unthresholded ones. Switching datasets then
+  needs no request and no CSV parsing.
+
+  `reuse` maps dataset files whose inputs did not change to their
+  parsed content (see `read_pack`); only the other CSVs are read. Files
+  are only rewritten if their content changed.
+  """
+  reuse = reuse or {}
+  parsed = []
+  for entry in index:
+    if entry['file'] in reuse:
+      structures, effect_column, columns, description = reuse[entry['file']]
+      parsed.append((structures, effect_column, dict(columns), description))
+    else:
+      parsed.append((*read_dataset(os.path.join(GALLERY_DIR, entry['file'])), read_description(entry)))
+  if navr_tables is not None:
+    thresholded = threshold_datasets(
+      [(entry['metric'], structures, columns['effectSize']) for entry, (structures, _, columns, _) in zip(index, parsed)],
+      navr_tables
+    )
+    for (_, _, columns, _), values in zip(parsed, thresholded):
+      columns['effectSizeThresholded'] = values
+
+  structure_lists = []
+  list_ids = {}
+  datasets = []
+  chunks = []
+  offset = 0
+  for entry, (structures, effect_column, columns, description) in zip(index, parsed):
+    key = tuple(structures)
+    if key not in list_ids:
+      list_ids[key] = len(structure_lists)
+      structure_lists.append(structures)
+
+    views = {}
+    for name, values in columns.items():
+      data = values.tobytes()
+      views[name] = {
+        "byteOffset": offset,
+        "byteLength": len(data),
+        "type": 'float32' if values.dtype.kind == 'f' else 'int32'
+      }
+      chunks.append(data)
+      offset += len(data)
+
+    datasets.append({
+      **entry,
+      "meta": description,
+      "effectSizeColumn": effect_column,
+      "structures": list_ids[key],
+      "count": len(structures),
+      "columns": views
+    })
+
+  write_if_changed(data_file, b''.join(chunks))
+  pack = {
+    "data": os.path.basename(data_file),
+    "structureLists": structure_lists,
+    "datasets": datasets
+  }
+  write_if_changed(pack_file, json.dumps(pack, separators=(',', ':')))
+  return pack
+
+def navr_files(atlas='desikan', data_dir=DATA_DIR):
+  """NAVR tables read by load_navr_tables"""
+  atlas_dir = os.path.join(data_dir, atlas)
+  return [os.path.join(atlas_dir, file) for file in sorted(os.listdir(atlas_dir))
+          if file.startswith('navr_') and file.endswith('.csv')]
+
+def dataset_inputs(entry):
+  return [os.path.join(GALLERY_DIR, entry['file']), os.path.join(GALLERY_DIR, entry['description'])]
+
+def build_incremental(manifest):
+  """Rebuild index.json and the pack, re-reading only the datasets whose CSV or description changed
+
+  The tree is still scanned, which only lists file names; index entries
+  are part of each dataset's record, so renamed or reclassified datasets
+  are read again. NAVR thresholds are always recomputed, in one pass.
+  """
+  start = time.perf_counter()
   images = scan_gallery(GALLERY_DIR)
-  with open(INDEX_FILE, 'w') as f:
-    json.dump(images, f, indent=2)
-  print(f"Indexed {len(images)} images to {INDEX_FILE}")
\ No newline at end of file
+  previous = read_pack()
+  reuse = {
+    entry['file']: previous[entry['file']] for entry in images
+    if entry['file'] in previous and manifest.is_current(entry['file'], dataset_inputs(entry), entry)
+  }
+  # The pack reads every changed file before writing, so a parse error leaves all outputs as they were
+  build_pack(images, navr_tables=load_navr_tables(), reuse=reuse)
+  index_written = write_if_changed(INDEX_FILE, json.dumps(images, indent=2))
+
+  manifest.targets = {}
+  for entry in images:
+    manifest.record(entry['file'], dataset_inputs(entry), entry)
+  manifest.save()
+  print(f"Indexed {len(images)} datasets ({len(images) - len(reuse)} read, {len(reuse)} unchanged"
+        f"{', index.json updated' if index_written else ''}) in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+def is_gallery_input(path):
+  """Whether a changed file can affect the index or the pack"""
+  path = os.path.abspath(path)
+  if path in map(os.path.abspath, OUTPUT_FILES) or '__pycache__' in path:
+    return False
+  return path.endswith(('.csv', '.json'))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Build gallery/index.json and the gallery data pack')
+  parser.add_argument('--incremental', action='store_true',
+                      help=f'Only re-read the datasets whose files changed since the last build '
+                           f'(tracked in {os.path.basename(MANIFEST_FILE)})')
+  parser.add_argument('--watch', action='store_true',
+                      help='Build incrementally, then rebuild whenever a gallery CSV/JSON or NAVR table changes '
+                           '(filesystem notifications through watchdog; polls every 0.5 s if it is not installed)')
+  args = parser.parse_args()
+
+  if args.incremental or args.watch:
+    manifest = BuildManifest(MANIFEST_FILE)
+    build_incremental(manifest)
+    if args.watch:
+      watch([GALLERY_DIR, os.path.dirname(navr_files()[0])], lambda changed: build_incremental(manifest),
+            ignore=lambda path: not is_gallery_input(path))
+  else:
+    images = scan_gallery(GALLERY_DIR)
+    with open(INDEX_FILE, 'w') as f:
+      json.dump(images, f, indent=2)
+    print(f"Indexed {len(images)} images to {INDEX_FILE}")
+    pack = build_pack(images, navr_tables=load_navr_tables())
+    pack_size = os.path.getsize(PACK_FILE) + os.path.getsize(PACK_DATA_FILE)
+    print(f"Packed {len(pack['datasets'])} datasets ({len(pack['structureLists'])} structure lists, "
+          f"{pack_size / 1e3:.1f} kB) to {PACK_FILE}")
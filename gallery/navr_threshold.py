@@ -0,0 +1,161 @@
+"""
+NAVR Thresholding
+Batch version of applyThresholding in js/data-processing.js: an effect size
+is masked (NaN) when |d| < |2 / sqrt(population_size) * NAVR|, with NAVR and
+population_size taken from the data/<atlas>/navr_*.csv tables. The tables
+are loaded once and every gallery dataset is thresholded in a single
+vectorized pass.
+"""
+
+import os
+import csv
+import argparse
+import math
+
+import numpy as np
+
+GALLERY_DIR = os.path.join(os.path.dirname(__file__), '.')
+DATA_DIR = os.path.join(GALLERY_DIR, '..', 'data')
+
+# NAVR tables used for each gallery metric, as chosen by buildNavrFilePaths
+# (subcortical_volume datasets select the 'volume' metric in the viewer)
+NAVR_TABLES = {
+  'thickness': ('cortical_thickness', 'subcortical_volume'),
+  'area': ('cortical_area', 'subcortical_volume'),
+  'volume': ('cortical_volume', 'subcortical_volume'),
+  'subcortical_volume': ('cortical_volume', 'subcortical_volume')
+}
+
+def js_number(value, parse=float):
+  """parseFloat(x) || 0 / parseInt(x) || 0, as used when loading NAVR rows"""
+  try:
+    number = parse(float(value))
+  except (TypeError, ValueError):
+    return 0
+  return number if number == number else 0
+
+def navr_threshold(navr, population_size):
+  """|2 / sqrt(population_size) * NAVR|, element-wise
+
+  A population size of 0 is handled the way JS arithmetic does it: the
+  threshold is infinite (the value is always masked), or NaN (never
+  masked) when NAVR is 0 as well.
+  """
+  navr = np.asarray(navr, dtype=np.float64)
+  population_size = np.asarray(population_size, dtype=np.float64)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    thresholds = np.abs(2 / np.sqrt(population_size) * navr)
+  empty = population_size == 0
+  return np.where(empty, np.where(navr == 0, np.nan, np.inf), thresholds)
+
+def load_navr_table(csv_file):
+  """Structure names and threshold array of one NAVR table
+
+  Cortical rows are keyed '<hemisphere>_<region>' and subcortical rows by
+  region, like processCorticalNavrData / processSubcorticalNavrData.
+  """
+  with open(csv_file, newline='') as f:
+    rows = [row for row in csv.DictReader(f) if row.get('region') and 'NAVR_corrected' in row]
+
+  names = [f"{row['hemisphere']}_{row['region']}" if 'hemisphere' in row else row['region'] for row in rows]
+  navr = np.array([js_number(row['NAVR']) for row in rows], dtype=np.float64)
+  population_size = np.array([js_number(row['population_size'], int) for row in rows], dtype=np.float64)
+  return names, navr_threshold(navr, population_size)
+
+def load_navr_tables(atlas='desikan', data_dir=DATA_DIR):
+  """Load every navr_*.csv table of an atlas: {table: {structure: threshold}}"""
+  atlas_dir = os.path.join(data_dir, atlas)
+  tables = {}
+  for file in sorted(os.listdir(atlas_dir)):
+    if file.startswith('navr_') and file.endswith('.csv'):
+      names, thresholds = load_navr_table(os.path.join(atlas_dir, file))
+      tables[file[len('navr_'):-len('.csv')]] = dict(zip(names, thresholds))
+  return tables
+
+def metric_thresholds(tables, metric):
+  """Merged structure -> threshold lookup used for a gallery metric"""
+  thresholds = {}
+  for table in NAVR_TABLES[metric]:
+    thresholds.update(tables.get(table, {}))
+  return thresholds
+
+def threshold_datasets(datasets, tables):
+  """Threshold many datasets at once
+
+  `datasets` is a list of (metric, structures, values). Every value is
+  gathered with its structure's threshold (NaN if the structure has no
+  NAVR entry, which leaves it untouched) and masked in one operation.
+  Returns the list of thresholded float32 arrays.
+  """
+  lookups = {metric: metric_thresholds(tables, metric) for metric in {d[0] for d in datasets}}
+  values = np.concatenate([np.asarray(v, dtype=np.float64) for _, _, v in datasets] + [np.zeros(0)])
+  thresholds = np.array(
+    [lookups[metric].get(s, np.nan) for metric, structures, _ in datasets for s in structures],
+    dtype=np.float64
+  )
+  thresholded = np.where(np.abs(values) < thresholds, np.nan, values).astype('<f4')
+  splits = np.cumsum([len(v) for _, _, v in datasets])[:-1]
+  return np.split(thresholded, splits)
+
+def js_apply_threshold(value, navr_row):
+  """Structure-by-structure reference of applyThresholding, for checking"""
+  if navr_row is None or math.isnan(value):
+    return value
+  navr, population_size = navr_row
+  threshold = float(navr_threshold(navr, population_size))
+  return math.nan if abs(value) < threshold else value
+
+def check_against_js(datasets, thresholded, atlas='desikan', data_dir=DATA_DIR):
+  """Number of values where the batch result differs from the JS formula"""
+  rows = {}
+  atlas_dir = os.path.join(data_dir, atlas)
+  for metric in {d[0] for d in datasets}:
+    lookup = {}
+    for table in NAVR_TABLES[metric]:
+      with open(os.path.join(atlas_dir, f'navr_{table}.csv'), newline='') as f:
+        for row in csv.DictReader(f):
+          if row.get('region') and 'NAVR_corrected' in row:
+            name = f"{row['hemisphere']}_{row['region']}" if 'hemisphere' in row else row['region']
+            lookup[name] = (js_number(row['NAVR']), js_number(row['population_size'], int))
+    rows[metric] = lookup
+
+  mismatches = 0
+  for (metric, structures, values), result in zip(datasets, thresholded):
+    for structure, value, batch_value in zip(structures, values, result):
+      expected = js_apply_threshold(float(value), rows[metric].get(structure))
+      if math.isnan(expected) != math.isnan(batch_value) or (
+          not math.isnan(expected) and np.float32(expected) != batch_value):
+        mismatches += 1
+  return mismatches
+
+if __name__ == "__main__":
+  import time
+  from build_index import scan_gallery, read_dataset
+
+  parser = argparse.ArgumentParser(description='Apply NAVR thresholding to every gallery dataset')
+  parser.add_argument('--atlas', default='desikan',
+                      help='Atlas of the NAVR tables in data/ (default: desikan)')
+  parser.add_argument('--no-check', action='store_true',
+                      help='Skip the structure-by-structure check against the JS formula')
+  args = parser.parse_args()
+
+  start = time.perf_counter()
+  index = scan_gallery(GALLERY_DIR)
+  tables = load_navr_tables(args.atlas)
+  datasets = []
+  for entry in index:
+    structures, _, columns = read_dataset(os.path.join(GALLERY_DIR, entry['file']))
+    datasets.append((entry['metric'], structures, columns['effectSize']))
+  thresholded = threshold_datasets(datasets, tables)
+  elapsed = time.perf_counter() - start
+
+  total = sum(len(v) for _, _, v in datasets)
+  masked = sum(int(np.isnan(t).sum() - np.isnan(v).sum()) for (_, _, v), t in zip(datasets, thresholded))
+  print(f"Thresholded {len(datasets)} datasets ({total} values, {masked} below NAVR threshold) "
+        f"with {len(tables)} NAVR tables in {elapsed:.3f} s")
+
+  if not args.no_check:
+    mismatches = check_against_js(datasets, thresholded, args.atlas)
+    print(f"Check against the JS formula: {mismatches} mismatches")
+    if mismatches:
+      raise SystemExit(1)
@@ -0,0 +1,227 @@
+"""
+Binary Mesh Bundles
+Packs a set of meshes into a single little-endian binary buffer described by
+a small JSON manifest, so that a browser can wrap every attribute in a typed
+array (Float32Array / Uint32Array) without any parsing.
+
+Manifest layout (<name>.manifest.json):
+{
+  "version": 1,
+  "buffer": "<name>.bin",
+  "byteLength": 123456,
+  "meshes": {
+    "Left-Thalamus": {
+      "vertexCount": 1234,
+      "faceCount": 2460,
+      "positions": {"byteOffset": 0, "byteLength": 14808, "type": "float32", "itemSize": 3},
+      "normals":   {"byteOffset": 14808, "byteLength": 14808, "type": "float32", "itemSize": 3},
+      "indices":   {"byteOffset": 29616, "byteLength": 29520, "type": "uint32", "itemSize": 3}
+    }
+  },
+  "groups": {
+    "left": {"byteOffset": 0, "byteLength": 59136, "structures": ["Left-Thalamus"]}
+  }
+}
+
+"groups" is optional: it gives the contiguous byte range of a set of
+structures (e.g. a hemisphere) so it can be fetched with one range request.
+
+Bundles written with `spatial` (off by default: the BVH can take as much
+room as the mesh itself) also give every structure a "spatial" entry
+(centroid, bounding box and sphere, surface area) and "bvhBounds" and
+"bvhNodes" views holding a flattened BVH over its triangles, whose indices
+are then stored in BVH order (see mesh_spatial.py). With `keep_face_order`
+the indices keep their order and a "bvhTriangles" view gives the BVH order.
+In encoded bundles, "bvhBounds" is quantized to uint16 on the same grid as
+the positions.
+
+Merged meshes (see mesh_merge.py) add a "structureIds" view (uint16, one
+per vertex) and a "structureNames" list mapping those ids to names.
+
+Encoded bundles (see mesh_encoding.py) use the same layout, but their
+attribute views carry an "encoding" key and its parameters, e.g.
+  "positions": {..., "type": "uint16", "itemSize": 3, "encoding": "quantized",
+                "origin": [x, y, z], "scale": [sx, sy, sz]}
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from mesh_encoding import decode_attribute, encode_mesh, quantize_bounds
+from mesh_spatial import build_bvh, structure_bounds
+
+BUNDLE_VERSION = 1
+
+# Bundle attribute -> (mesh dict key, little-endian dtype, manifest type name)
+BUNDLE_ATTRIBUTES = {
+    'positions': ('vertices', '<f4', 'float32'),
+    'normals': ('normals', '<f4', 'float32'),
+    'indices': ('faces', '<u4', 'uint32'),
+}
+
+def _plain_attributes(mesh):
+    """Bundle attributes of a mesh as little-endian (n, 3) float32/uint32 arrays"""
+    attributes = {}
+    for attribute, (key, dtype, type_name) in BUNDLE_ATTRIBUTES.items():
+        array = np.ascontiguousarray(mesh.get(key, []), dtype=dtype).reshape(-1, 3)
+        attributes[attribute] = (array, {'type': type_name, 'itemSize': 3})
+    return attributes
+
+def write_mesh_bundle(meshes, output_dir, name, groups=None, encode=False, max_position_error=None,
+                      spatial=False, keep_face_order=False):
+    """Write `meshes` as <name>.manifest.json + <name>.bin in `output_dir`
+
+    `meshes` maps structure names to dicts with 'vertices', 'faces' and
+    optionally 'normals' (NumPy arrays or nested lists), and for merged
+    meshes 'structure_ids' and 'structure_names'. Attributes are
+    streamed straight from the arrays into the buffer; every attribute is
+    4-byte aligned so it can be viewed zero-copy in the browser.
+
+    `groups` optionally maps a group name to a list of structure names that
+    are consecutive in `meshes`; the manifest then records the byte range
+    covering each group.
+
+    With `encode`, attributes are quantized and compressed by
+    mesh_encoding.encode_mesh; each entry then records its 'maxError', and
+    a ValueError is raised if one exceeds `max_position_error` (mm).
+
+    With `spatial`, the bounds and BVH of every structure are added (node
+    bounds quantized when encoding), and its faces are written in BVH order, unless `keep_face_order` is set
+    (for faces already in vertex cache order, see mesh_cleanup.py).
+    Returns the path of the manifest.
+    """
+    output_dir = Path(output_dir)
+    buffer_file = output_dir / f'{name}.bin'
+    manifest_file = output_dir / f'{name}.manifest.json'
+
+    manifest = {
+        'version': BUNDLE_VERSION,
+        'buffer': buffer_file.name,
+        'meshes': {}
+    }
+
+    # Written next to the bundle and renamed at the end, so that an error
+    # (e.g. an encoding bound) leaves the previous bundle intact
+    temporary_buffer = buffer_file.with_name(buffer_file.name + '.tmp')
+    temporary_manifest = manifest_file.with_name(manifest_file.name + '.tmp')
+    try:
+        offset = 0
+        structure_ranges = {}
+        with open(temporary_buffer, 'wb') as f:
+            for structure_name, mesh in meshes.items():
+                entry = {
+                    'vertexCount': int(np.size(mesh['vertices']) // 3),
+                    'faceCount': int(np.size(mesh['faces']) // 3)
+                }
+                if spatial:
+                    order, bvh_bounds, bvh_nodes = build_bvh(mesh['vertices'], mesh['faces'])
+                    if not keep_face_order:
+                        mesh = {**mesh, 'faces': np.asarray(mesh['faces']).reshape(-1, 3)[order]}
+                    entry['spatial'] = structure_bounds(mesh['vertices'], mesh['faces'])
+                if encode:
+                    try:
+                        attributes, entry['maxError'] = encode_mesh(mesh, max_position_error)
+                    except ValueError as e:
+                        raise ValueError(f"{structure_name}: {e}") from e
+                else:
+                    attributes = _plain_attributes(mesh)
+                if 'structure_ids' in mesh:
+                    attributes['structureIds'] = (
+                        np.ascontiguousarray(mesh['structure_ids'], dtype='<u2'), {'type': 'uint16', 'itemSize': 1}
+                    )
+                    entry['structureNames'] = list(mesh['structure_names'])
+                if spatial:
+                    if encode:
+                        positions = attributes['positions'][1]
+                        attributes['bvhBounds'] = (
+                            quantize_bounds(bvh_bounds, positions['origin'], positions['scale']),
+                            {'type': 'uint16', 'itemSize': 6, 'encoding': 'quantized',
+                             'origin': positions['origin'], 'scale': positions['scale']}
+                        )
+                    else:
+                        attributes['bvhBounds'] = (bvh_bounds, {'type': 'float32', 'itemSize': 6})
+                    attributes['bvhNodes'] = (bvh_nodes, {'type': 'uint32', 'itemSize': 2})
+                    if keep_face_order:
+                        attributes['bvhTriangles'] = (order.astype('<u4'), {'type': 'uint32', 'itemSize': 1})
+
+                start = offset
+                for attribute, (array, view) in attributes.items():
+                    f.write(array.data)
+                    entry[attribute] = {'byteOffset': offset, 'byteLength': array.nbytes, **view}
+                    offset += array.nbytes
+                    padding = -offset % 4
+                    f.write(bytes(padding))
+                    offset += padding
+                structure_ranges[structure_name] = (start, offset)
+                manifest['meshes'][structure_name] = entry
+
+        manifest['byteLength'] = offset
+
+        if encode:
+            manifest['maxError'] = max((e['maxError'] for e in manifest['meshes'].values()), default=0.0)
+            print(f"  Encoded {name}: max position error {manifest['maxError']:.4f} mm")
+
+        if groups:
+            order = list(meshes)
+            manifest['groups'] = {}
+            for group_name, structures in groups.items():
+                if not structures:
+                    continue
+                positions = [order.index(structure) for structure in structures]
+                if positions != list(range(positions[0], positions[0] + len(positions))):
+                    raise ValueError(f"Structures of group '{group_name}' are not consecutive in the bundle")
+                start = structure_ranges[structures[0]][0]
+                end = structure_ranges[structures[-1]][1]
+                manifest['groups'][group_name] = {
+                    'byteOffset': start,
+                    'byteLength': end - start,
+                    'structures': list(structures)
+                }
+        with open(temporary_manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+    except BaseException:
+        temporary_buffer.unlink(missing_ok=True)
+        temporary_manifest.unlink(missing_ok=True)
+        raise
+    os.replace(temporary_buffer, buffer_file)
+    os.replace(temporary_manifest, manifest_file)
+
+    return manifest_file
+
+def read_mesh_bundle(manifest_file):
+    """Load a bundle written by `write_mesh_bundle`
+
+    The buffer is memory-mapped; plain attributes are views into it and
+    encoded attributes are decoded. Returns a dict of structure name ->
+    {'vertices', 'faces', 'normals'}.
+    """
+    manifest_file = Path(manifest_file)
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported mesh bundle version: {manifest.get('version')}")
+
+    buffer_file = manifest_file.parent / manifest['buffer']
+    if manifest['byteLength'] == 0:
+        buffer = np.zeros(0, dtype=np.uint8)
+    else:
+        buffer = np.memmap(buffer_file, dtype=np.uint8, mode='r')
+
+    meshes = {}
+    for structure_name, entry in manifest['meshes'].items():
+        mesh = {}
+        for attribute, (key, dtype, _) in BUNDLE_ATTRIBUTES.items():
+            view = entry[attribute]
+            start = view['byteOffset']
+            data = buffer[start:start + view['byteLength']]
+            if 'encoding' in view:
+                mesh[key] = decode_attribute(data, view)
+            else:
+                mesh[key] = data.view(dtype).reshape(-1, view['itemSize'])
+        meshes[structure_name] = mesh
+
+    return meshes
@@ -0,0 +1,106 @@
+"""
+Meshing Result Cache
+Content-addressed on-disk cache for per-structure meshes. Entries are keyed
+by a hash of everything a mesh depends on (atlas file contents, label id,
+meshing parameters, affine and code version) and evicted least recently
+used first once the cache grows beyond its size limit.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_CACHE_SIZE_MB = 512
+
+def default_cache_dir():
+    """Per-user cache directory, honouring XDG_CACHE_HOME"""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'brain_render' / 'meshes'
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def make_cache_key(**fields):
+    """Stable hash of JSON-serializable key fields"""
+    payload = json.dumps(fields, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class MeshCache:
+    """Directory of <key>.npz mesh entries with size-bounded LRU eviction
+
+    An entry's modification time is refreshed on every hit, so eviction
+    removes the entries that were used least recently.
+    """
+
+    def __init__(self, cache_dir=None, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.cache_dir / f'{key}.npz'
+
+    def get(self, key):
+        """Return (found, mesh); mesh is None for labels that produced no mesh"""
+        path = self._path(key)
+        try:
+            with np.load(path) as entry:
+                mesh = None if 'empty' in entry else {
+                    'vertices': entry['vertices'],
+                    'faces': entry['faces'],
+                    'normals': entry['normals']
+                }
+        except (OSError, ValueError, KeyError):
+            # Missing or unreadable entry
+            self.misses += 1
+            return False, None
+        os.utime(path)
+        self.hits += 1
+        return True, mesh
+
+    def put(self, key, mesh):
+        """Store a mesh (or None) under `key`, writing atomically"""
+        path = self._path(key)
+        temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'wb') as f:
+            if mesh is None:
+                np.savez(f, empty=np.array(True))
+            else:
+                np.savez(f, vertices=mesh['vertices'], faces=mesh['faces'], normals=mesh['normals'])
+        os.replace(temp_path, path)
+
+    def size(self):
+        """Total size of the cache entries in bytes"""
+        return sum(entry.stat().st_size for entry in self.cache_dir.glob('*.npz'))
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its size limit"""
+        entries = [(entry.stat(), entry) for entry in self.cache_dir.glob('*.npz')]
+        entries.sort(key=lambda item: item[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in entries)
+        removed = 0
+        for stat, entry in entries:
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        """Remove every cache entry"""
+        removed = 0
+        for entry in self.cache_dir.glob('*.npz'):
+            entry.unlink(missing_ok=True)
+            removed += 1
+        return removed
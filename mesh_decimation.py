@@ -0,0 +1,287 @@
+"""
+Mesh Decimation
+Vectorized quadric-error edge collapse producing a chain of levels of detail.
+
+Every round collapses a whole independent set of cheap edges at once: an edge
+is collapsed only if it is the cheapest edge around both of its endpoints, so
+no two collapses of a round share a triangle and the round can be applied
+with array operations. Collapses that would change the topology (link
+condition), flip a triangle, or move a vertex further than `max_error` from
+the original surface planes it represents are rejected.
+"""
+
+import numpy as np
+
+DEFAULT_LOD_RATIOS = (1.0, 0.25, 0.05)
+DEFAULT_MAX_ERROR = 2.0  # mm
+
+# Independent-set selections attempted per collapse round
+SELECTION_PASSES = 16
+
+def compute_vertex_normals(vertices, faces):
+    """Area-weighted unit vertex normals"""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+    v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+    # The cross product length is twice the face area, which gives the weighting
+    face_normals = np.cross(v1 - v0, v2 - v0)
+
+    normals = np.zeros_like(vertices)
+    indices = faces.ravel()
+    for axis in range(3):
+        normals[:, axis] = np.bincount(
+            indices, weights=np.repeat(face_normals[:, axis], 3), minlength=len(vertices)
+        )
+
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0)
+
+def compute_vertex_quadrics(vertices, faces):
+    """Sum of the (unweighted) plane quadrics of the faces around each vertex"""
+    v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+    face_normals = np.cross(v1 - v0, v2 - v0)
+    lengths = np.linalg.norm(face_normals, axis=1, keepdims=True)
+    face_normals = np.divide(face_normals, lengths, out=np.zeros_like(face_normals), where=lengths > 0)
+
+    planes = np.column_stack((face_normals, -np.einsum('ij,ij->i', face_normals, v0)))
+    face_quadrics = (planes[:, :, None] * planes[:, None, :]).reshape(-1, 16)
+
+    indices = faces.ravel()
+    quadrics = np.empty((len(vertices), 16))
+    for component in range(16):
+        quadrics[:, component] = np.bincount(
+            indices, weights=np.repeat(face_quadrics[:, component], 3), minlength=len(vertices)
+        )
+    return quadrics.reshape(-1, 4, 4)
+
+def _quadric_cost(quadrics, positions):
+    """Evaluate v^T Q v for homogeneous positions, one per quadric"""
+    homogeneous = np.column_stack((positions, np.ones(len(positions))))
+    return np.einsum('ni,nij,nj->n', homogeneous, quadrics, homogeneous)
+
+def _unique_edges(faces, vertex_count):
+    """Undirected edges of `faces` with the number of faces sharing each one"""
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    keys, counts = np.unique(edges[:, 0] * vertex_count + edges[:, 1], return_counts=True)
+    return np.column_stack((keys // vertex_count, keys % vertex_count)), counts
+
+def _remove_duplicate_faces(faces):
+    """Drop degenerate faces and faces repeating the same three vertices"""
+    faces = faces[
+        (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    ]
+    _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+    return faces[np.sort(first)]
+
+def _collapse_candidates(vertices, quadrics, edges):
+    """Best position and cost of collapsing each edge
+
+    Candidates are the quadric optimum (when well conditioned and close to
+    the edge), both endpoints and the midpoint; the cheapest one wins.
+    """
+    a, b = edges[:, 0], edges[:, 1]
+    edge_quadrics = quadrics[a] + quadrics[b]
+    midpoints = 0.5 * (vertices[a] + vertices[b])
+    edge_lengths = np.linalg.norm(vertices[a] - vertices[b], axis=1)
+
+    candidates = [vertices[a], vertices[b], midpoints]
+
+    optimum = midpoints.copy()
+    system = edge_quadrics[:, :3, :3]
+    solvable = np.abs(np.linalg.det(system)) > 1e-9
+    if solvable.any():
+        optimum[solvable] = np.linalg.solve(system[solvable], -edge_quadrics[solvable, :3, 3:])[:, :, 0]
+        too_far = np.linalg.norm(optimum - midpoints, axis=1) > edge_lengths
+        optimum[too_far] = midpoints[too_far]
+    candidates.append(optimum)
+
+    costs = np.stack([_quadric_cost(edge_quadrics, c) for c in candidates])
+    best = np.argmin(costs, axis=0)
+    positions = np.stack(candidates)[best, np.arange(len(edges))]
+    return positions, np.maximum(costs[best, np.arange(len(edges))], 0.0), edge_quadrics
+
+def _independent_minima(rank, pool, a, b, vertex_count):
+    """Pool edges ranked lowest within the one-ring of both of their endpoints
+
+    Minima are taken over pool edges only but propagated across every edge,
+    so no two returned edges share a vertex or are joined by an edge.
+    """
+    no_rank = np.iinfo(np.int64).max
+    pool_rank = np.where(pool, rank, no_rank)
+    vertex_min = np.full(vertex_count, no_rank)
+    np.minimum.at(vertex_min, a, pool_rank)
+    np.minimum.at(vertex_min, b, pool_rank)
+    neighbourhood_min = vertex_min.copy()
+    np.minimum.at(neighbourhood_min, a, vertex_min[b])
+    np.minimum.at(neighbourhood_min, b, vertex_min[a])
+    return np.flatnonzero(
+        pool & (rank == neighbourhood_min[a]) & (rank == neighbourhood_min[b])
+    )
+
+def _flipping_collapses(vertices, faces, a, b, positions):
+    """Flag collapses of independent edges (a, b) -> positions that flip a face"""
+    collapse_of_vertex = np.full(len(vertices), -1)
+    collapse_of_vertex[a] = np.arange(len(a))
+    collapse_of_vertex[b] = np.arange(len(a))
+    face_collapse = collapse_of_vertex[faces].max(axis=1)
+
+    touched = np.flatnonzero(face_collapse >= 0)
+    touched_faces = faces[touched]
+    touched_collapse = face_collapse[touched]
+
+    moved = vertices.copy()
+    moved[a] = positions
+    moved[b] = positions
+    v0, v1, v2 = (vertices[touched_faces[:, k]] for k in range(3))
+    old_normals = np.cross(v1 - v0, v2 - v0)
+    v0, v1, v2 = (moved[touched_faces[:, k]] for k in range(3))
+    new_normals = np.cross(v1 - v0, v2 - v0)
+
+    # Faces containing the collapsed edge itself disappear and need no check
+    collapsing = (
+        (touched_faces == a[touched_collapse, None]).any(axis=1)
+        & (touched_faces == b[touched_collapse, None]).any(axis=1)
+    )
+    flipped = np.einsum('ij,ij->i', old_normals, new_normals) <= 0
+
+    rejected = np.zeros(len(a), dtype=bool)
+    rejected[touched_collapse[flipped & ~collapsing]] = True
+    return rejected
+
+def _collapse_round(vertices, faces, quadrics, target_faces, max_cost):
+    """Run one round of independent edge collapses, in place on vertices/quadrics
+
+    Returns the new faces, the largest cost applied and the number of collapses.
+    """
+    vertex_count = len(vertices)
+    edges, face_counts = _unique_edges(faces, vertex_count)
+    a, b = edges[:, 0], edges[:, 1]
+
+    positions, costs, edge_quadrics = _collapse_candidates(vertices, quadrics, edges)
+
+    # Unique ranks; ties (common on flat voxel faces) are broken by a hash of
+    # the edge rather than its index, so that cheap edges are spread out and
+    # many of them are local minima
+    tie_break = (a * 2654435761 + b * 40503) % 4294967296
+    rank = np.empty(len(edges), dtype=np.int64)
+    rank[np.lexsort((tie_break, costs))] = np.arange(len(edges))
+
+    # Vertices on boundary or non-manifold edges never move
+    locked = np.zeros(vertex_count, dtype=bool)
+    locked[edges[face_counts != 2].ravel()] = True
+
+    # Link condition: the endpoints must share exactly the two opposite vertices
+    # (scipy.sparse is imported here so that importing the constants stays fast)
+    from scipy import sparse
+    adjacency = sparse.csr_matrix(
+        (np.ones(len(edges)), (a, b)), shape=(vertex_count, vertex_count)
+    )
+    adjacency = (adjacency + adjacency.T).tocsr()
+    common = np.asarray(adjacency[a].multiply(adjacency[b]).sum(axis=1)).ravel()
+
+    eligible = ~locked[a] & ~locked[b] & (costs <= max_cost) & (common == 2)
+
+    # Each collapse removes two faces; don't overshoot the target
+    budget = max((len(faces) - target_faces + 1) // 2, 1)
+
+    # Edges whose collapse would flip a face are dropped and the selection is
+    # repeated away from the collapses already accepted in this round
+    accepted = []
+    frozen = np.zeros(vertex_count, dtype=bool)
+    for _ in range(SELECTION_PASSES):
+        selected = _independent_minima(rank, eligible & ~frozen[a] & ~frozen[b], a, b, vertex_count)
+        selected = selected[np.argsort(rank[selected])][:budget]
+        if len(selected) == 0:
+            break
+
+        rejected = _flipping_collapses(vertices, faces, a[selected], b[selected], positions[selected])
+        eligible[selected[rejected]] = False
+        selected = selected[~rejected]
+
+        accepted.append(selected)
+        budget -= len(selected)
+        if budget <= 0:
+            break
+
+        endpoints = np.zeros(vertex_count, dtype=bool)
+        endpoints[a[selected]] = True
+        endpoints[b[selected]] = True
+        frozen |= endpoints | (adjacency @ endpoints.astype(np.float64) > 0)
+
+    selected = np.concatenate(accepted) if accepted else np.zeros(0, dtype=np.int64)
+    if len(selected) == 0:
+        return faces, 0.0, 0
+
+    # Apply the collapses: b merges into a
+    keep, drop = a[selected], b[selected]
+    vertices[keep] = positions[selected]
+    quadrics[keep] = edge_quadrics[selected]
+
+    remap = np.arange(vertex_count)
+    remap[drop] = keep
+    faces = _remove_duplicate_faces(remap[faces])
+
+    return faces, float(costs[selected].max()), len(selected)
+
+def _compact_mesh(vertices, faces, source_normals=None):
+    """Drop unreferenced vertices and renumber faces
+
+    The normals are oriented like `source_normals` (per original vertex) if
+    given, and otherwise outward for a closed surface (positive volume
+    enclosed by the winding), whichever way the faces are wound.
+    """
+    used, inverse = np.unique(faces, return_inverse=True)
+    faces = inverse.reshape(faces.shape).astype(np.uint32)
+    vertices = vertices[used]
+    normals = compute_vertex_normals(vertices, faces)
+    if source_normals is not None:
+        inward = np.einsum('ij,ij->', normals, source_normals[used]) < 0
+    else:
+        v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+        inward = np.einsum('ij,ij->', v0, np.cross(v1, v2)) < 0
+    return {
+        'vertices': vertices,
+        'faces': faces,
+        'normals': -normals if inward else normals
+    }
+
+def build_lod_chain(vertices, faces, ratios=DEFAULT_LOD_RATIOS, max_error=DEFAULT_MAX_ERROR, normals=None):
+    """Simplify a mesh into a chain of levels of detail
+
+    `ratios` are target fractions of the original face count (e.g. 1.0, 0.25,
+    0.05). Levels are produced finest first, each continuing from the
+    previous one, so the quadrics always measure the error against the
+    original surface. No vertex moves further than `max_error` from any of
+    the original face planes it stands for; a level stops early if reaching
+    its target would exceed that bound.
+
+    Returns one dict per ratio with 'vertices', 'faces', 'normals', 'ratio'
+    and 'maxError' (the largest plane distance bound reached, in mesh units).
+    The normals of every level point the same way as `normals`, the vertex
+    normals of the original mesh (e.g. marching cubes gradients), or
+    outward if they are not given.
+    """
+    vertices = np.array(vertices, dtype=np.float64)
+    if normals is not None:
+        normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3) if np.size(normals) else None
+    faces = _remove_duplicate_faces(np.asarray(faces, dtype=np.int64))
+    quadrics = compute_vertex_quadrics(vertices, faces)
+    original_faces = len(faces)
+    max_cost = max_error ** 2
+    worst_cost = 0.0
+
+    levels = []
+    for ratio in sorted(ratios, reverse=True):
+        target_faces = int(np.ceil(ratio * original_faces))
+        while len(faces) > target_faces:
+            faces, cost, collapsed = _collapse_round(vertices, faces, quadrics, target_faces, max_cost)
+            if collapsed == 0:
+                break
+            worst_cost = max(worst_cost, cost)
+
+        level = _compact_mesh(vertices, faces, normals)
+        level['ratio'] = ratio
+        level['maxError'] = float(np.sqrt(worst_cost))
+        levels.append(level)
+
+    return levels
@@ -0,0 +1,162 @@
+"""
+Compact Mesh Encoding
+Optional encoder stage for mesh bundles (see mesh_bundle.py):
+  - positions are quantized to uint16 within each structure's bounding box,
+    and so are the BVH node bounds of spatial bundles (rounded outwards)
+  - normals are octahedral-encoded into 2 x uint8
+  - indices are delta-coded, zigzag-mapped, written as LEB128 varints and
+    deflated (zlib), which browsers can inflate with DecompressionStream
+Every step is vectorized and has a matching decoder, and the encoder
+reports the largest position error so it can be checked against a bound.
+"""
+
+import zlib
+
+import numpy as np
+
+POSITION_LEVELS = 65535
+NORMAL_LEVELS = 255
+
+# Default bound on the position error introduced by quantization, in mm
+DEFAULT_MAX_POSITION_ERROR = 0.01
+
+def quantize_positions(vertices):
+    """Quantize positions to uint16 within their bounding box
+
+    Returns (quantized, origin, scale): position = quantized * scale + origin.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    if len(vertices) == 0:
+        return np.zeros((0, 3), dtype='<u2'), np.zeros(3), np.ones(3)
+    origin = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - origin
+    scale = np.where(extent > 0, extent / POSITION_LEVELS, 1.0)
+    quantized = np.rint((vertices - origin) / scale).astype('<u2')
+    return quantized, origin, scale
+
+def dequantize_positions(quantized, origin, scale):
+    """Inverse of `quantize_positions`, as float32"""
+    return (quantized * np.asarray(scale) + np.asarray(origin)).astype(np.float32)
+
+def quantize_bounds(bounds, origin, scale):
+    """Quantize (n, 6) min/max boxes to uint16 on the grid of `quantize_positions`
+
+    Minima are rounded down and maxima up, so the decoded boxes still
+    enclose the original ones. Decoded with `dequantize_positions`.
+    """
+    bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 2, 3)
+    steps = (bounds - origin) / scale
+    quantized = np.stack((np.floor(steps[:, 0]), np.ceil(steps[:, 1])), axis=1)
+    return np.clip(quantized, 0, POSITION_LEVELS).astype('<u2').reshape(-1, 6)
+
+def encode_octahedral(normals):
+    """Encode unit normals as 2 x uint8 octahedral coordinates"""
+    normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+    l1 = np.abs(normals).sum(axis=1, keepdims=True)
+    p = np.divide(normals[:, :2], l1, out=np.zeros((len(normals), 2)), where=l1 > 0)
+    # Fold the lower hemisphere over the diagonals
+    lower = normals[:, 2] < 0
+    sign = np.where(p[lower] >= 0, 1.0, -1.0)
+    p[lower] = (1 - np.abs(p[lower][:, ::-1])) * sign
+    return np.rint((p * 0.5 + 0.5) * NORMAL_LEVELS).astype(np.uint8)
+
+def decode_octahedral(encoded):
+    """Inverse of `encode_octahedral`, as float32 unit normals"""
+    p = np.asarray(encoded, dtype=np.float64).reshape(-1, 2) / NORMAL_LEVELS * 2 - 1
+    z = 1 - np.abs(p).sum(axis=1)
+    lower = z < 0
+    sign = np.where(p[lower] >= 0, 1.0, -1.0)
+    p[lower] = (1 - np.abs(p[lower][:, ::-1])) * sign
+    normals = np.column_stack((p, z))
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return np.divide(normals, lengths, out=np.zeros_like(normals), where=lengths > 0).astype(np.float32)
+
+def encode_varints(values):
+    """Encode non-negative integers as LEB128 varints (7 bits per byte)"""
+    values = np.asarray(values, dtype=np.uint64).ravel()
+    byte_counts = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28, 35, 42, 49, 56, 63):
+        byte_counts += values >= np.uint64(1 << bits)
+
+    starts = np.cumsum(byte_counts) - byte_counts
+    encoded = np.zeros(int(byte_counts.sum()), dtype=np.uint8)
+    for k in range(int(byte_counts.max(initial=0))):
+        has_byte = byte_counts > k
+        chunk = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = (byte_counts[has_byte] > k + 1).astype(np.uint64) << np.uint64(7)
+        encoded[starts[has_byte] + k] = chunk | more
+    return encoded
+
+def decode_varints(encoded):
+    """Inverse of `encode_varints`"""
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    last_byte = encoded < 0x80
+    value_of_byte = np.cumsum(last_byte) - last_byte
+    value_starts = np.flatnonzero(np.concatenate(([True], last_byte[:-1])))
+    position = np.arange(len(encoded)) - value_starts[value_of_byte]
+
+    values = np.zeros(int(last_byte.sum()), dtype=np.uint64)
+    chunks = (encoded & 0x7f).astype(np.uint64) << (np.uint64(7) * position.astype(np.uint64))
+    np.bitwise_or.at(values, value_of_byte, chunks)
+    return values
+
+def encode_indices(faces):
+    """Delta + zigzag + varint + deflate encoding of a face index buffer"""
+    indices = np.asarray(faces, dtype=np.int64).ravel()
+    deltas = np.diff(indices, prepend=0)
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    varints = encode_varints(zigzag.astype(np.uint64))
+    return np.frombuffer(zlib.compress(varints.tobytes()), dtype=np.uint8)
+
+def decode_indices(encoded):
+    """Inverse of `encode_indices`, as (n, 3) uint32 faces"""
+    varints = np.frombuffer(zlib.decompress(np.asarray(encoded, dtype=np.uint8).tobytes()), dtype=np.uint8)
+    zigzag = decode_varints(varints).astype(np.int64)
+    deltas = (zigzag >> 1) ^ -(zigzag & 1)
+    return np.cumsum(deltas).astype(np.uint32).reshape(-1, 3)
+
+def encode_mesh(mesh, max_position_error=None):
+    """Encode a mesh's attributes for a bundle
+
+    Returns (attributes, max_error): attributes maps 'positions', 'normals'
+    and 'indices' to (array, manifest metadata); max_error is the largest
+    per-axis position error after quantization, in mesh units (mm). Raises
+    ValueError if it exceeds `max_position_error`.
+    """
+    vertices = np.asarray(mesh['vertices'], dtype=np.float64).reshape(-1, 3)
+    quantized, origin, scale = quantize_positions(vertices)
+    max_error = float(np.abs(dequantize_positions(quantized, origin, scale) - vertices).max(initial=0.0))
+    if max_position_error is not None and max_error > max_position_error:
+        raise ValueError(
+            f"Quantization error {max_error:.6f} mm exceeds the bound of {max_position_error} mm"
+        )
+
+    normals = np.asarray(mesh.get('normals', []), dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(mesh['faces']).reshape(-1, 3)
+
+    attributes = {
+        'positions': (quantized, {
+            'type': 'uint16', 'itemSize': 3, 'encoding': 'quantized',
+            'origin': origin.tolist(), 'scale': scale.tolist()
+        }),
+        'normals': (encode_octahedral(normals), {
+            'type': 'uint8', 'itemSize': 2, 'encoding': 'octahedral'
+        }),
+        'indices': (encode_indices(faces), {
+            'type': 'uint8', 'itemSize': 1, 'encoding': 'delta-zigzag-varint-deflate',
+            'count': int(faces.size)
+        }),
+    }
+    return attributes, max_error
+
+def decode_attribute(data, view):
+    """Decode one encoded bundle attribute (raw bytes + manifest view) to an (n, itemSize) array"""
+    encoding = view['encoding']
+    if encoding == 'quantized':
+        quantized = data.view('<u2').reshape(-1, 3)
+        return dequantize_positions(quantized, view['origin'], view['scale']).reshape(-1, view['itemSize'])
+    if encoding == 'octahedral':
+        return decode_octahedral(data.reshape(-1, 2))
+    if encoding == 'delta-zigzag-varint-deflate':
+        return decode_indices(data)
+    raise ValueError(f"Unknown attribute encoding: {encoding}")
@@ -0,0 +1,317 @@
+"""
+Mesh File Reader
+Vectorized readers for the OBJ and PLY (ASCII and binary) files of the
+meshes/ tree. Files are memory-mapped and parsed with NumPy bulk operations:
+the only per-line Python work is on the PLY header. Every reader returns
+contiguous float32 vertices and uint32 faces.
+
+Matching writers produce OBJ and binary PLY files in the same layout, with
+text formatted in large chunks rather than line by line.
+"""
+
+import mmap
+from pathlib import Path
+
+import numpy as np
+
+NEWLINE = ord('\n')
+
+# Rows formatted per string operation when writing text files
+WRITE_CHUNK_ROWS = 65536
+
+# Bytes first searched for the end of a PLY header
+PLY_HEADER_WINDOW = 4096
+
+# PLY property types -> NumPy dtype codes
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8',
+}
+
+PLY_BYTE_ORDERS = {
+    'binary_little_endian': '<',
+    'binary_big_endian': '>',
+}
+
+def _map_file(path):
+    """Memory-map a file as a read-only uint8 array"""
+    with open(path, 'rb') as f:
+        if Path(path).stat().st_size == 0:
+            return np.zeros(0, dtype=np.uint8)
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapping, dtype=np.uint8)
+
+def _line_starts(data):
+    """Offsets of every line start, plus a final sentinel at the end of the data"""
+    starts = np.flatnonzero(data == NEWLINE) + 1
+    if len(starts) == 0 or starts[-1] != len(data):
+        starts = np.concatenate((starts, [len(data)]))
+    return np.concatenate(([0], starts))
+
+def _parse_numbers(text, dtype):
+    """Parse whitespace-separated numbers from a uint8 array in one call"""
+    if len(text) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.fromstring(text.tobytes(), dtype=dtype, sep=' ')
+
+def _gather_records(data, line_starts, keyword):
+    """Text of all lines starting with `keyword` + space, with the keyword blanked
+
+    Returns the gathered uint8 text (newlines kept as separators) and the
+    number of records, without any per-line Python work.
+    """
+    prefix = np.frombuffer(keyword.encode() + b' ', dtype=np.uint8)
+    starts = line_starts[:-1]
+    lengths = np.diff(line_starts)
+
+    selected = lengths >= len(prefix)
+    candidates = np.minimum(starts, len(data) - len(prefix))
+    for i, byte in enumerate(prefix):
+        selected &= data[candidates + i] == byte
+
+    mask = np.repeat(selected, lengths)
+    for i in range(len(prefix)):
+        mask[starts[selected] + i] = False
+    # Keep the records separated even if the file does not end with a newline
+    return np.concatenate((data[mask], np.array([NEWLINE], dtype=np.uint8))), int(selected.sum())
+
+def _triangulate(polygons):
+    """Fan-triangulate an (n, k) array of polygons into (n * (k - 2), 3) triangles"""
+    k = polygons.shape[1]
+    if k == 3:
+        return polygons
+    if k < 3:
+        raise ValueError(f"Faces must have at least 3 vertices, found {k}")
+    fans = [polygons[:, [0, i, i + 1]] for i in range(1, k - 1)]
+    return np.stack(fans, axis=1).reshape(-1, 3)
+
+def _as_mesh(vertices, faces):
+    """Contiguous float32 vertices and uint32 faces"""
+    return {
+        'vertices': np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3),
+        'faces': np.ascontiguousarray(faces, dtype=np.uint32).reshape(-1, 3),
+    }
+
+def read_obj(path):
+    """Read the 'v' and 'f' records of a Wavefront OBJ file
+
+    Faces may use the 'v', 'v/vt', 'v//vn' or 'v/vt/vn' forms, but all faces
+    must have the same number of vertices (triangles, or polygons which are
+    fan-triangulated). Extra vertex components such as colours are ignored.
+    """
+    data = _map_file(path)
+    if len(data) == 0:
+        return _as_mesh(np.zeros((0, 3)), np.zeros((0, 3)))
+    line_starts = _line_starts(data)
+
+    text, vertex_count = _gather_records(data, line_starts, 'v')
+    values = _parse_numbers(text, np.float64)
+    if vertex_count and len(values) % vertex_count:
+        raise ValueError(f"{path}: vertex records have varying numbers of components")
+    vertices = values.reshape(vertex_count, -1)[:, :3] if vertex_count else values
+
+    text, face_count = _gather_records(data, line_starts, 'f')
+    if face_count == 0:
+        return _as_mesh(vertices, np.zeros((0, 3)))
+
+    # Work out the face layout from the first record
+    first = text[:np.argmax(text == NEWLINE)].tobytes().decode().split()
+    polygon_size = len(first)
+    components = len(first[0].replace('//', '/').split('/'))
+    if components > 1:
+        # 'a/b/c' and 'a//c' become space separated numbers
+        text[text == ord('/')] = ord(' ')
+
+    indices = _parse_numbers(text, np.int64)
+    if len(indices) != face_count * polygon_size * components:
+        raise ValueError(f"{path}: face records have varying numbers of vertices")
+    polygons = indices.reshape(face_count, polygon_size * components)[:, ::components]
+    if (polygons <= 0).any():
+        raise ValueError(f"{path}: relative (negative) face indices are not supported")
+
+    return _as_mesh(vertices, _triangulate(polygons - 1))
+
+def _read_ply_header(data):
+    """Parse a PLY header into (format, elements, body offset)
+
+    Elements are (name, count, properties) in file order; a property is
+    (name, dtype code) or (name, (count dtype code, item dtype code)) for lists.
+    """
+    # Headers are usually short: look in a window that doubles until the header ends
+    window = PLY_HEADER_WINDOW
+    while True:
+        head = bytes(data[:window])
+        end = head.find(b'end_header')
+        newline = head.find(b'\n', end) if end >= 0 else -1
+        if newline >= 0 or window >= len(data):
+            break
+        window *= 2
+    if not head.startswith(b'ply') or newline < 0:
+        raise ValueError("Not a PLY file")
+    header_end = newline + 1
+    lines = head[:header_end].decode('ascii').splitlines()
+
+    file_format = None
+    elements = []
+    for line in lines:
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == 'format':
+            file_format = parts[1]
+        elif parts[0] == 'element':
+            elements.append((parts[1], int(parts[2]), []))
+        elif parts[0] == 'property':
+            if parts[1] == 'list':
+                elements[-1][2].append((parts[4], (PLY_TYPES[parts[2]], PLY_TYPES[parts[3]])))
+            else:
+                elements[-1][2].append((parts[2], PLY_TYPES[parts[1]]))
+    return file_format, elements, header_end
+
+def _read_ply_binary(data, elements, offset, byte_order, path):
+    """Read the vertex and face elements of a binary PLY body
+
+    Records are read as one fixed-size NumPy record array per element, so
+    an element may have at most one list property, of the same length in
+    every record.
+    """
+    vertices = faces = None
+    for name, count, properties in elements:
+        lists = [prop_name for prop_name, prop_type in properties if isinstance(prop_type, tuple)]
+        if len(lists) > 1:
+            raise ValueError(f"{path}: unsupported PLY layout: {name} has several list properties")
+        fields = []
+        polygon_size = 3
+        for prop_name, prop_type in properties:
+            if isinstance(prop_type, tuple):
+                # Read the list as fixed-size, with the length of the first record
+                count_type, item_type = prop_type
+                if count:
+                    count_offset = offset + np.dtype(fields).itemsize
+                    polygon_size = int(np.frombuffer(
+                        data, dtype=byte_order + count_type, count=1, offset=count_offset
+                    )[0])
+                fields.append((prop_name + '_count', byte_order + count_type))
+                fields.append((prop_name, byte_order + item_type, (polygon_size,)))
+            else:
+                fields.append((prop_name, byte_order + prop_type))
+        dtype = np.dtype(fields)
+        if offset + count * dtype.itemsize > len(data):
+            raise ValueError(f"{path}: unsupported PLY layout: {name} lists vary in length, or the file is truncated")
+        records = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += records.nbytes
+        if lists and (records[lists[0] + '_count'] != polygon_size).any():
+            raise ValueError(f"{path}: unsupported PLY layout: {name} lists vary in length")
+
+        if name == 'vertex':
+            vertices = np.column_stack((records['x'], records['y'], records['z']))
+        elif name == 'face':
+            faces = _triangulate(records[lists[0]].reshape(count, -1))
+    return vertices, faces
+
+def _read_ply_ascii(data, elements, offset, path):
+    """Read the vertex and face elements of an ASCII PLY body"""
+    body = data[offset:]
+    line_starts = _line_starts(body)
+    vertices = faces = None
+    line = 0
+    for name, count, properties in elements:
+        # Element records are consecutive lines, so each one is a plain slice
+        text = body[line_starts[line]:line_starts[min(line + count, len(line_starts) - 1)]]
+        line += count
+        if name not in ('vertex', 'face'):
+            continue
+        values = _parse_numbers(text, np.float64)
+        if count and len(values) % count:
+            raise ValueError(f"{path}: {name} records have varying lengths")
+        records = values.reshape(count, -1)
+
+        if name == 'vertex':
+            columns = [p for p, _ in properties]
+            vertices = records[:, [columns.index(axis) for axis in ('x', 'y', 'z')]]
+        else:
+            # Only a single vertex index list is supported for faces
+            if len(properties) != 1:
+                raise ValueError(f"{path}: unsupported face properties")
+            polygon_size = records.shape[1] - 1 if count else 3
+            if count and (records[:, 0] != polygon_size).any():
+                raise ValueError(f"{path}: faces have varying numbers of vertices")
+            faces = _triangulate(records[:, 1:].astype(np.int64))
+    return vertices, faces
+
+def read_ply(path):
+    """Read the vertices and faces of an ASCII or binary PLY file
+
+    All faces must have the same number of vertices (triangles, or polygons
+    which are fan-triangulated).
+    """
+    data = _map_file(path)
+    file_format, elements, offset = _read_ply_header(data)
+
+    if file_format == 'ascii':
+        vertices, faces = _read_ply_ascii(data, elements, offset, path)
+    elif file_format in PLY_BYTE_ORDERS:
+        vertices, faces = _read_ply_binary(data, elements, offset, PLY_BYTE_ORDERS[file_format], path)
+    else:
+        raise ValueError(f"{path}: unsupported PLY format '{file_format}'")
+
+    if vertices is None:
+        raise ValueError(f"{path}: no vertex element")
+    if faces is None:
+        faces = np.zeros((0, 3))
+    return _as_mesh(vertices, faces)
+
+def read_mesh(path):
+    """Read an OBJ or PLY file, dispatching on the extension"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.obj':
+        return read_obj(path)
+    if suffix == '.ply':
+        return read_ply(path)
+    raise ValueError(f"Unsupported mesh format: {path}")
+
+def _write_rows(f, line_format, rows):
+    """Write `line_format` % row for every row of a 2D array, in large chunks"""
+    for start in range(0, len(rows), WRITE_CHUNK_ROWS):
+        chunk = rows[start:start + WRITE_CHUNK_ROWS]
+        f.write((line_format * len(chunk)) % tuple(chunk.ravel().tolist()))
+
+def write_obj(path, vertices, faces):
+    """Write triangles as a Wavefront OBJ file ('v' and 1-based 'f' records)"""
+    mesh = _as_mesh(vertices, faces)
+    with open(path, 'w') as f:
+        _write_rows(f, 'v %.6g %.6g %.6g\n', mesh['vertices'])
+        _write_rows(f, 'f %d %d %d\n', mesh['faces'].astype(np.int64) + 1)
+
+def write_ply(path, vertices, faces):
+    """Write triangles as a binary little-endian PLY file"""
+    mesh = _as_mesh(vertices, faces)
+    header = (
+        "ply\nformat binary_little_endian 1.0\n"
+        f"element vertex {len(mesh['vertices'])}\n"
+        "property float x\nproperty float y\nproperty float z\n"
+        f"element face {len(mesh['faces'])}\n"
+        "property list uchar int vertex_index\nend_header\n"
+    )
+    face_records = np.empty(len(mesh['faces']), dtype=[('count', 'u1'), ('indices', '<i4', (3,))])
+    face_records['count'] = 3
+    face_records['indices'] = mesh['faces']
+    with open(path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(mesh['vertices'].astype('<f4').tobytes())
+        f.write(face_records.tobytes())
+
+def write_mesh(path, vertices, faces):
+    """Write an OBJ or PLY file, dispatching on the extension"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.obj':
+        return write_obj(path, vertices, faces)
+    if suffix == '.ply':
+        return write_ply(path, vertices, faces)
+    raise ValueError(f"Unsupported mesh format: {path}")
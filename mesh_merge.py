@@ -0,0 +1,103 @@
+"""
+Merged Hemisphere Meshes
+Merges the parcels of a hemisphere into a single welded, indexed mesh, so the
+viewer draws a hemisphere with one call and recolours structures through a
+small lookup table instead of one material per parcel:
+  - vertices at the same position in neighbouring parcels are welded, and
+    normals are recomputed on the welded surface
+  - every vertex has a uint16 structure id, an index into the mesh's
+    structure name table
+  - every face is rotated (keeping its winding) so that its last vertex
+    carries the face's structure id; a face none of whose vertices does gets
+    a copy of its last vertex with that id. With the id attribute declared
+    `flat` in the shader (WebGL2 takes flat attributes from the last
+    vertex), every triangle is coloured by its own structure.
+"""
+
+import numpy as np
+
+from mesh_decimation import compute_vertex_normals
+
+MAX_STRUCTURES = np.iinfo(np.uint16).max + 1
+
+def weld_vertices(vertices, tolerance=0.0):
+    """Merge vertices with identical float32 positions; returns (unique vertices, inverse index)
+
+    With a `tolerance`, vertices closer than it to each other (directly or
+    through a chain of such vertices) are merged too, at the position of one
+    of them. Used by mesh_cleanup.py.
+    """
+    # Adding 0.0 maps -0.0 to 0.0, so both weld together
+    vertices = np.ascontiguousarray(np.asarray(vertices, dtype='<f4').reshape(-1, 3) + np.float32(0.0))
+    _, first, inverse = np.unique(vertices.view('V12').ravel(), return_index=True, return_inverse=True)
+    vertices, inverse = vertices[first], inverse.ravel()
+    if tolerance > 0 and len(vertices) > 1:
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+        from scipy.spatial import cKDTree
+
+        pairs = cKDTree(vertices).query_pairs(tolerance, output_type='ndarray')
+        if len(pairs):
+            graph = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                               shape=(len(vertices), len(vertices)))
+            _, labels = connected_components(graph, directed=False)
+            _, first, labels = np.unique(labels, return_index=True, return_inverse=True)
+            vertices, inverse = vertices[first], labels.ravel()[inverse]
+    return vertices, inverse
+
+def merge_structures(meshes):
+    """Merge {structure name: mesh} into one welded mesh with per-vertex structure ids
+
+    Returns a mesh dict with 'vertices', 'faces', 'normals', 'structure_ids'
+    (uint16, one per vertex) and 'structure_names' (id -> name), as written
+    by mesh_bundle.write_mesh_bundle.
+    """
+    names = list(meshes)
+    if len(names) > MAX_STRUCTURES:
+        raise ValueError(f"{len(names)} structures do not fit in uint16 structure ids")
+
+    vertex_counts = [len(np.asarray(mesh['vertices']).reshape(-1, 3)) for mesh in meshes.values()]
+    vertex_offsets = np.concatenate(([0], np.cumsum(vertex_counts)[:-1]))
+    all_vertices = np.vstack([np.asarray(mesh['vertices']).reshape(-1, 3) for mesh in meshes.values()])
+    all_faces = np.vstack([
+        np.asarray(mesh['faces'], dtype=np.int64).reshape(-1, 3) + offset
+        for mesh, offset in zip(meshes.values(), vertex_offsets)
+    ])
+    face_ids = np.repeat(np.arange(len(names)), [len(np.asarray(mesh['faces']).reshape(-1, 3))
+                                                 for mesh in meshes.values()])
+
+    vertices, inverse = weld_vertices(all_vertices)
+    faces = inverse[all_faces]
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    faces, face_ids = faces[keep], face_ids[keep]
+    normals = compute_vertex_normals(vertices, faces)
+
+    # Every vertex takes the id of one of its faces
+    vertex_ids = np.zeros(len(vertices), dtype=np.int64)
+    vertex_ids[faces.ravel()] = np.repeat(face_ids, 3)
+
+    # Rotate each face so that a vertex with the face's id comes last
+    matches = vertex_ids[faces] == face_ids[:, None]
+    last = np.where(matches[:, 2], 2, np.where(matches[:, 1], 1, np.where(matches[:, 0], 0, 2)))
+    rows = np.arange(len(faces))[:, None]
+    faces = faces[rows, (last[:, None] + [1, 2, 3]) % 3]
+
+    # Faces without such a vertex get a copy of their last vertex, one per (vertex, id) pair
+    unmatched = ~matches.any(axis=1)
+    if unmatched.any():
+        pairs, pair_index = np.unique(
+            faces[unmatched, 2] * MAX_STRUCTURES + face_ids[unmatched], return_inverse=True
+        )
+        copied = pairs // MAX_STRUCTURES
+        faces[unmatched, 2] = len(vertices) + pair_index.ravel()
+        vertices = np.vstack((vertices, vertices[copied]))
+        normals = np.vstack((normals, normals[copied]))
+        vertex_ids = np.concatenate((vertex_ids, pairs % MAX_STRUCTURES))
+
+    return {
+        'vertices': vertices,
+        'faces': faces.astype(np.uint32),
+        'normals': normals.astype(np.float32),
+        'structure_ids': vertex_ids.astype(np.uint16),
+        'structure_names': names,
+    }
@@ -0,0 +1,87 @@
+"""
+Mesh Rasterizer
+A small CPU z-buffer rasterizer for rendering meshes to images without a
+GPU, used by render_thumbnails.py. Orthographic projection; every step is
+vectorized over triangles:
+  - each triangle is expanded into the pixels of its bounding box, in
+    chunks of at most MAX_FRAGMENTS pixels
+  - pixel centres are tested against the triangle with barycentric
+    coordinates, which also interpolate depth and shading
+  - the nearest fragment of each pixel is kept with one sort per chunk
+    and merged into the depth buffer
+"""
+
+import numpy as np
+
+MAX_FRAGMENTS = 1 << 22
+
+def look_at(forward, up=(0, 0, 1)):
+    """3x3 rotation whose rows are the screen right, up and depth axes of a camera looking along `forward`"""
+    forward = np.asarray(forward, dtype=np.float64)
+    forward = forward / np.linalg.norm(forward)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right)
+    return np.vstack((right, np.cross(right, forward), forward))
+
+def rasterize(points, faces, width, height):
+    """Z-buffer rasterization of triangles given in screen space
+
+    `points` are (x, y, depth) per vertex, with x and y in pixels (y down)
+    and smaller depths nearer. Returns (triangle, weights): the index of the
+    triangle seen at every pixel (-1 for background) as a (height, width)
+    array, and the barycentric weights of its vertices there, (height, width, 3).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    depth_buffer = np.full(width * height, np.inf)
+    triangle_buffer = np.full(width * height, -1, dtype=np.int64)
+    weight_buffer = np.zeros((width * height, 3))
+
+    corners = points[faces]
+    # Twice the signed area; degenerate (edge-on) triangles cover no pixel
+    area = ((corners[:, 1, 0] - corners[:, 0, 0]) * (corners[:, 2, 1] - corners[:, 0, 1])
+            - (corners[:, 2, 0] - corners[:, 0, 0]) * (corners[:, 1, 1] - corners[:, 0, 1]))
+    x0 = np.clip(np.ceil(corners[:, :, 0].min(axis=1) - 0.5), 0, width).astype(np.int64)
+    x1 = np.clip(np.floor(corners[:, :, 0].max(axis=1) - 0.5), -1, width - 1).astype(np.int64)
+    y0 = np.clip(np.ceil(corners[:, :, 1].min(axis=1) - 0.5), 0, height).astype(np.int64)
+    y1 = np.clip(np.floor(corners[:, :, 1].max(axis=1) - 0.5), -1, height - 1).astype(np.int64)
+    box_width = np.maximum(x1 - x0 + 1, 0)
+    counts = box_width * np.maximum(y1 - y0 + 1, 0)
+    counts[np.abs(area) < 1e-12] = 0
+    triangles = np.flatnonzero(counts)
+
+    # Chunks of triangles with at most MAX_FRAGMENTS bounding box pixels
+    ends = np.cumsum(counts[triangles])
+    chunk_starts = np.searchsorted(ends, np.arange(0, ends[-1] if len(ends) else 0, MAX_FRAGMENTS), side='right')
+    for chunk in np.split(triangles, chunk_starts[1:]):
+        chunk_counts = counts[chunk]
+        fragment_triangle = np.repeat(chunk, chunk_counts)
+        local = np.arange(chunk_counts.sum()) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        px = x0[fragment_triangle] + local % box_width[fragment_triangle]
+        py = y0[fragment_triangle] + local // box_width[fragment_triangle]
+
+        # Barycentric weights of the pixel centres
+        a, b, c = (corners[fragment_triangle, k] for k in range(3))
+        sx = px + 0.5
+        sy = py + 0.5
+        weights = np.column_stack((
+            (b[:, 0] - sx) * (c[:, 1] - sy) - (c[:, 0] - sx) * (b[:, 1] - sy),
+            (c[:, 0] - sx) * (a[:, 1] - sy) - (a[:, 0] - sx) * (c[:, 1] - sy),
+            (a[:, 0] - sx) * (b[:, 1] - sy) - (b[:, 0] - sx) * (a[:, 1] - sy),
+        )) / area[fragment_triangle, None]
+        inside = (weights >= 0).all(axis=1)
+        fragment_triangle, weights = fragment_triangle[inside], weights[inside]
+        pixel = (py * width + px)[inside]
+        depth = (weights * corners[fragment_triangle, :, 2]).sum(axis=1)
+
+        # Nearest fragment of every pixel, then merge with the buffer
+        order = np.lexsort((depth, pixel))
+        pixel, first = np.unique(pixel[order], return_index=True)
+        nearest = order[first]
+        closer = depth[nearest] < depth_buffer[pixel]
+        pixel, nearest = pixel[closer], nearest[closer]
+        depth_buffer[pixel] = depth[nearest]
+        triangle_buffer[pixel] = fragment_triangle[nearest]
+        weight_buffer[pixel] = weights[nearest]
+
+    return triangle_buffer.reshape(height, width), weight_buffer.reshape(height, width, 3)
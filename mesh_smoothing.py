@@ -0,0 +1,64 @@
+"""
+Mesh Smoothing
+Taubin (lambda-mu) smoothing of marching cubes surfaces, as an alternative
+to opening/closing the voxel mask before marching cubes.
+
+Each iteration is a shrinking Laplacian step (lambda > 0) followed by an
+inflating one (mu < -lambda), both applied to every vertex at once as a
+sparse matrix product with the umbrella operator of the vertex adjacency.
+This removes the voxel staircase without the volume loss of plain
+Laplacian smoothing, and keeps thin structures that an opening would erase.
+"""
+
+import numpy as np
+
+from mesh_decimation import compute_vertex_normals
+
+SMOOTHING_METHODS = ('morphology', 'taubin')
+DEFAULT_SMOOTHING_METHOD = 'morphology'
+
+DEFAULT_TAUBIN_ITERATIONS = 10
+TAUBIN_LAMBDA = 0.5
+TAUBIN_MU = -0.53
+
+def umbrella_operator(faces, vertex_count):
+    """Sparse (vertex_count x vertex_count) matrix averaging the neighbours of each vertex"""
+    from scipy import sparse
+
+    # Both directions of every face edge: on a closed manifold mesh every
+    # neighbour is then counted twice (once per face sharing the edge), so
+    # the row-normalized counts are the uniform neighbour average
+    rows = faces.ravel()
+    columns = faces[:, [1, 2, 0]].ravel()
+    adjacency = sparse.coo_matrix(
+        (np.ones(2 * len(rows)), (np.concatenate((rows, columns)), np.concatenate((columns, rows)))),
+        shape=(vertex_count, vertex_count)
+    ).tocsr()
+
+    row_entries = np.diff(adjacency.indptr)
+    weights = np.repeat(np.asarray(adjacency.sum(axis=1)).ravel(), row_entries)
+    adjacency.data /= weights
+    return adjacency
+
+def taubin_smooth(vertices, faces, iterations=DEFAULT_TAUBIN_ITERATIONS, lam=TAUBIN_LAMBDA, mu=TAUBIN_MU):
+    """Taubin-smoothed copy of `vertices`; the faces are unchanged"""
+    vertices = np.asarray(vertices, dtype=np.float64)
+    average = umbrella_operator(np.asarray(faces), len(vertices))
+
+    smoothed = vertices.copy()
+    for _ in range(iterations):
+        for factor in (lam, mu):
+            smoothed += factor * (average @ smoothed - smoothed)
+    return smoothed
+
+def smooth_mesh(vertices, faces, iterations=DEFAULT_TAUBIN_ITERATIONS):
+    """Taubin-smoothed vertices of a marching cubes mesh and their recomputed normals"""
+    vertices = taubin_smooth(vertices, faces, iterations)
+    # Marching cubes winds its faces clockwise seen from outside: flip the
+    # area-weighted normals to point outward like its gradient normals
+    return vertices, -compute_vertex_normals(vertices, faces)
+
+def mesh_volume(vertices, faces):
+    """Enclosed volume of a closed, consistently oriented mesh (divergence theorem)"""
+    v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+    return abs(np.einsum('ij,ij->i', v0, np.cross(v1, v2)).sum()) / 6
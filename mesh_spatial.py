@@ -0,0 +1,128 @@
+"""
+Mesh Spatial Metadata
+Per-structure bounds and a flattened bounding volume hierarchy (BVH) over
+the triangles, stored in mesh bundles (see mesh_bundle.py) so the viewer can
+frame the camera and pick structures without scanning every triangle.
+
+Bounds (manifest entry "spatial"):
+  centroid      area-weighted centroid of the surface
+  min, max      axis-aligned bounding box
+  sphere        {"center", "radius"}: bounding sphere around the box centre
+                or the centroid, whichever is smaller
+  area          surface area (mm^2)
+
+BVH (bundle views "bvhBounds" and "bvhNodes"), nodes in breadth-first order
+with the root first:
+  bvhBounds  float32 x 6 per node: min x, y, z, max x, y, z
+  bvhNodes   uint32 x 2 per node: (first, count)
+               leaf:     triangles first .. first + count - 1 of the
+                         structure's indices, which are stored in BVH order
+               interior: count is 0, children are nodes first and first + 1
+  bvhTriangles  uint32 per triangle, only in bundles that keep their face
+                order (e.g. a vertex cache order, see mesh_cleanup.py):
+                leaves then index this list of triangle numbers instead
+Triangles are split at the median of their centroids along the longest axis
+of each node. The build is vectorized level by level: every node of a level
+is split with a single sort.
+"""
+
+import numpy as np
+
+DEFAULT_LEAF_SIZE = 8
+
+def triangle_areas(vertices, faces):
+    """Area of every triangle"""
+    v0, v1, v2 = (vertices[faces[:, k]] for k in range(3))
+    return np.linalg.norm(np.cross(v1 - v0, v2 - v0), axis=1) / 2
+
+def structure_bounds(vertices, faces):
+    """Centroid, bounding box, bounding sphere and surface area of a mesh, as JSON types"""
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    if len(vertices) == 0:
+        return None
+
+    low = vertices.min(axis=0)
+    high = vertices.max(axis=0)
+    areas = triangle_areas(vertices, faces)
+    area = areas.sum()
+    if area > 0:
+        centroid = (areas[:, None] * vertices[faces].mean(axis=1)).sum(axis=0) / area
+    else:
+        centroid = vertices.mean(axis=0)
+
+    sphere_center = min(
+        ((low + high) / 2, centroid),
+        key=lambda center: np.linalg.norm(vertices - center, axis=1).max()
+    )
+    return {
+        'centroid': centroid.tolist(),
+        'min': low.tolist(),
+        'max': high.tolist(),
+        'sphere': {
+            'center': sphere_center.tolist(),
+            'radius': float(np.linalg.norm(vertices - sphere_center, axis=1).max()),
+        },
+        'area': float(area),
+    }
+
+def _segment_positions(starts, lengths):
+    """Concatenated ranges starts[i] .. starts[i] + lengths[i] - 1, and the segment of each"""
+    segments = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return starts[segments] + offsets, segments
+
+def build_bvh(vertices, faces, leaf_size=DEFAULT_LEAF_SIZE):
+    """Median-split BVH over the triangles of a mesh
+
+    Returns (order, bounds, nodes): the triangles in BVH order (faces[order]
+    is what the leaves index), float32 (n, 6) node bounds and uint32 (n, 2)
+    (first, count) node records, laid out as described in the module docstring.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+    faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    corners = vertices[faces]
+    triangle_min = corners.min(axis=1)
+    triangle_max = corners.max(axis=1)
+    centroids = corners.mean(axis=1)
+
+    order = np.arange(len(faces))
+    if len(faces) == 0:
+        return order, np.zeros((0, 6), dtype='<f4'), np.zeros((0, 2), dtype='<u4')
+    bounds = []
+    nodes = []
+    # Triangle ranges of the nodes of the current level
+    starts = np.array([0])
+    lengths = np.array([len(faces)])
+    next_node = 1
+    while len(starts):
+        positions, segments = _segment_positions(starts, lengths)
+        offsets = np.cumsum(lengths) - lengths
+        triangles = order[positions]
+        level_min = np.minimum.reduceat(triangle_min[triangles], offsets)
+        level_max = np.maximum.reduceat(triangle_max[triangles], offsets)
+        bounds.append(np.hstack((level_min, level_max)))
+
+        split = lengths > leaf_size
+        # Interior nodes point at their two children, numbered in level order
+        children = next_node + 2 * (np.cumsum(split) - 1)
+        nodes.append(np.column_stack((np.where(split, children, starts), np.where(split, 0, lengths))))
+        next_node += 2 * int(split.sum())
+
+        # Sort the triangles of every node along its longest centroid axis,
+        # in one sort: the key is the node index plus the centroid scaled to [0, 1)
+        level_centroids = centroids[triangles]
+        centroid_min = np.minimum.reduceat(level_centroids, offsets)
+        centroid_extent = np.maximum.reduceat(level_centroids, offsets) - centroid_min
+        axes = np.argmax(centroid_extent, axis=1)
+        extent = centroid_extent[np.arange(len(axes)), axes]
+        scale = np.divide(0.5, extent, out=np.zeros_like(extent), where=extent > 0)
+        keys = segments + (level_centroids[np.arange(len(triangles)), axes[segments]]
+                           - centroid_min[segments, axes[segments]]) * scale[segments]
+        order[positions] = triangles[np.argsort(keys)]
+
+        halves = lengths[split] // 2
+        starts = np.column_stack((starts[split], starts[split] + halves)).ravel()
+        lengths = np.column_stack((halves, lengths[split] - halves)).ravel()
+
+    return (order, np.vstack(bounds).astype('<f4'), np.vstack(nodes).astype('<u4'))
@@ -0,0 +1,119 @@
+"""
+Pipeline Profiling
+Optional per-stage instrumentation for process_templateflow_data: every
+stage records its wall time, CPU time, peak traced memory (tracemalloc) and
+the process's peak RSS, per structure, together with voxel, vertex and face
+counts. Enabled with --profile or the BRAIN_RENDER_PROFILE environment
+variable ('json' or 'csv'; any other non-empty value means json).
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+PROFILE_ENV_VAR = 'BRAIN_RENDER_PROFILE'
+REPORT_FORMATS = ('json', 'csv')
+
+REPORT_FIELDS = ['stage', 'structure', 'wall_seconds', 'cpu_seconds', 'peak_traced_mb', 'peak_rss_mb',
+                 'voxels', 'vertices', 'faces', 'pid']
+
+def profile_format_from_env():
+    """Report format requested through BRAIN_RENDER_PROFILE, or None"""
+    value = os.environ.get(PROFILE_ENV_VAR, '').strip().lower()
+    if value in ('', '0', 'false', 'no'):
+        return None
+    return value if value in REPORT_FORMATS else 'json'
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB; None where it is unavailable (Windows)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+def profile_stage(profiler, name, structure=None, **counts):
+    """`profiler.stage(...)`, or a context that records nothing if `profiler` is None"""
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, structure, **counts)
+
+class PipelineProfiler:
+    """Collects one record per (stage, structure)
+
+    Usage:
+        with profiler.stage('marching_cubes', 'Left-Caudate') as record:
+            ...
+            record['vertices'] = len(vertices)
+
+    Records are plain dicts, so profilers of worker processes can send
+    theirs back to be merged with `extend`.
+    """
+
+    def __init__(self):
+        self.records = []
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, structure=None, **counts):
+        record = {'stage': name, 'structure': structure, **counts}
+        tracemalloc.reset_peak()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall_seconds'] = time.perf_counter() - wall_start
+            record['cpu_seconds'] = time.process_time() - cpu_start
+            record['peak_traced_mb'] = (tracemalloc.get_traced_memory()[1] - traced_before) / 1e6
+            record['peak_rss_mb'] = peak_rss_mb()
+            record['pid'] = os.getpid()
+            self.records.append(record)
+
+    def extend(self, records):
+        """Merge records collected elsewhere (e.g. in a worker process)"""
+        self.records.extend(records)
+
+    def summary(self):
+        """Totals per stage: wall/CPU time summed, memory as the maximum"""
+        stages = {}
+        for record in self.records:
+            total = stages.setdefault(record['stage'], {
+                'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                'peak_traced_mb': 0.0, 'peak_rss_mb': 0.0
+            })
+            total['count'] += 1
+            total['wall_seconds'] += record['wall_seconds']
+            total['cpu_seconds'] += record['cpu_seconds']
+            total['peak_traced_mb'] = max(total['peak_traced_mb'], record['peak_traced_mb'])
+            if record['peak_rss_mb'] is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+        return stages
+
+    def write_report(self, output_path, report_format='json'):
+        """Write the records as profile_report.<format> in `output_path`"""
+        report_file = output_path / f'profile_report.{report_format}'
+        if report_format == 'csv':
+            with open(report_file, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, restval='')
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(report_file, 'w') as f:
+                json.dump({'summary': self.summary(), 'records': self.records}, f, indent=2)
+        return report_file
+
+    def print_summary(self):
+        """Print the per-stage totals"""
+        print("\nProfile (wall / CPU seconds, peak traced MB):")
+        for name, total in self.summary().items():
+            print(f"  {name:<16} {total['wall_seconds']:8.3f} s  {total['cpu_seconds']:8.3f} s  "
+                  f"{total['peak_traced_mb']:8.1f} MB  ({total['count']} records)")
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Gallery Thumbnail Renderer
+Renders a PNG thumbnail of every gallery dataset on the meshes/ geometry,
+without a GPU (see mesh_raster.py), so the gallery can show what a dataset
+looks like before it is loaded in WebGL.
+
+Datasets come from the gallery pack (gallery/build_index.py). Structures are
+coloured like getColorFromCohenD in js/scene-renderer.js (blue - white - red
+over the colour range, grey without a value), on the dark scene background.
+Each dataset gets one image per view, made of panels side by side:
+  lateral      left and right cortex, seen from the outside
+  medial       left and right cortex, seen from the midline
+  subcortical  left structures from the left, all from above, right from the right
+Cortical datasets get the lateral and medial views, subcortical ones the
+subcortical view.
+
+Rendering runs in two parallel phases: the geometry of every distinct
+(view, structure set) is rasterized once into structure-id and shading
+buffers (meshes are parsed once per worker), then every dataset only
+colours those buffers and writes its PNGs.
+
+Output: <output-dir>/<dataset file without .csv>_<view>.png and
+<output-dir>/index.json (dataset file -> view -> thumbnail path).
+"""
+
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from compile_mesh_bundles import find_mesh_files, get_hemisphere
+from mesh_decimation import compute_vertex_normals
+from mesh_io import read_mesh
+from mesh_merge import weld_vertices
+from mesh_raster import look_at, rasterize
+
+GALLERY_PACK = Path('gallery') / 'gallery_pack.json'
+DEFAULT_OUTPUT_DIR = Path('gallery') / 'thumbnails'
+DEFAULT_PANEL_SIZE = 192
+DEFAULT_SUPERSAMPLE = 2
+
+# colorMapping and the dark theme background of js/scene-renderer.js
+DEFAULT_COLOR_RANGE = (-2.0, 2.0)
+MISSING_COLOR = (0.5, 0.5, 0.5)
+BACKGROUND_COLOR = (0x1a, 0x1a, 0x2e)
+
+AMBIENT_LIGHT = 0.35
+DIFFUSE_LIGHT = 0.65
+PANEL_MARGIN = 0.05
+
+# View -> panels (hemisphere, camera direction, screen up) and the structure type it shows
+VIEWS = {
+    'lateral': ('cortical', [('left', (1, 0, 0), (0, 0, 1)), ('right', (-1, 0, 0), (0, 0, 1))]),
+    'medial': ('cortical', [('left', (-1, 0, 0), (0, 0, 1)), ('right', (1, 0, 0), (0, 0, 1))]),
+    'subcortical': ('subcortical', [('left', (1, 0, 0), (0, 0, 1)), ('both', (0, 0, -1), (0, 1, 0)),
+                                    ('right', (-1, 0, 0), (0, 0, 1))]),
+}
+
+def get_color_from_cohen_d(values, color_range=DEFAULT_COLOR_RANGE):
+    """(n, 3) RGB in [0, 1] of Cohen's d values; vectorized getColorFromCohenD"""
+    values = np.asarray(values, dtype=np.float64)
+    low, high = color_range
+    normalized = np.clip((values - low) / (high - low), 0, 1)
+    t = np.where(normalized < 0.5, normalized * 2, (normalized - 0.5) * 2)
+    colors = np.where(
+        (normalized < 0.5)[:, None],
+        np.column_stack((t, t, np.ones_like(t))),
+        np.column_stack((np.ones_like(t), 1 - t, 1 - t)),
+    )
+    colors[np.isnan(values)] = MISSING_COLOR
+    return colors
+
+def load_gallery_pack(pack_file=GALLERY_PACK):
+    """[(index entry, structure names, effect sizes)] of every dataset in the gallery pack"""
+    with open(pack_file) as f:
+        pack = json.load(f)
+    data = (Path(pack_file).parent / pack['data']).read_bytes()
+    datasets = []
+    for dataset in pack['datasets']:
+        view = dataset['columns']['effectSize']
+        values = np.frombuffer(data, dtype='<f4', count=view['byteLength'] // 4, offset=view['byteOffset'])
+        datasets.append((dataset, pack['structureLists'][dataset['structures']], values))
+    return datasets
+
+def find_structure_meshes(mesh_dir='meshes', atlas='desikan'):
+    """{structure: (type, mesh file)}, subcortical first as in getStructureType"""
+    meshes = {name: ('cortical', path) for name, path in find_mesh_files(Path(mesh_dir) / 'cortical' / atlas).items()}
+    meshes.update({name: ('subcortical', path) for name, path in find_mesh_files(Path(mesh_dir) / 'subcortical').items()})
+    return meshes
+
+@lru_cache(maxsize=None)
+def load_structure(mesh_file):
+    """Welded vertices, faces and normals of a mesh file, parsed once per process"""
+    mesh = read_mesh(mesh_file)
+    # Same as mergeVertices + computeVertexNormals in the viewer
+    vertices, inverse = weld_vertices(mesh['vertices'])
+    faces = inverse[np.asarray(mesh['faces'], dtype=np.int64).reshape(-1, 3)]
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])]
+    return vertices.astype(np.float64), faces, compute_vertex_normals(vertices, faces)
+
+def render_view(view, mesh_files, panel_size=DEFAULT_PANEL_SIZE, supersample=DEFAULT_SUPERSAMPLE):
+    """Rasterize the panels of a view of `mesh_files` ((structure, file) pairs)
+
+    Returns one (structure index, shade) pair of (size, size) buffers per
+    panel, with size = panel_size * supersample: the index in `mesh_files`
+    of the structure seen at every pixel (-1 for background) and its
+    lighting intensity. All panels of a view share one scale.
+    """
+    size = panel_size * supersample
+    geometry = [load_structure(path) for _, path in mesh_files]
+    hemispheres = [get_hemisphere(structure) for structure, _ in mesh_files]
+    all_vertices = np.vstack([vertices for vertices, _, _ in geometry])
+
+    panels = []
+    rotations = [look_at(forward, up) for _, forward, up in VIEWS[view][1]]
+    scale = min(
+        size * (1 - 2 * PANEL_MARGIN) / np.ptp(all_vertices @ rotation[:2].T, axis=0).max()
+        for rotation in rotations
+    )
+    for (hemisphere, forward, _), rotation in zip(VIEWS[view][1], rotations):
+        shown = [i for i, h in enumerate(hemispheres) if hemisphere == 'both' or h in (hemisphere, 'other')]
+        vertex_counts = [len(geometry[i][0]) for i in shown]
+        offsets = np.concatenate(([0], np.cumsum(vertex_counts)[:-1])).astype(np.int64)
+        vertices = np.vstack([geometry[i][0] for i in shown])
+        normals = np.vstack([geometry[i][2] for i in shown])
+        faces = np.vstack([geometry[i][1] + offset for i, offset in zip(shown, offsets)])
+        face_structure = np.repeat(shown, [len(geometry[i][1]) for i in shown])
+
+        # Screen space: pixels with y down, centred on the panel's structures
+        projected = vertices @ rotation.T
+        center = (projected[:, :2].min(axis=0) + projected[:, :2].max(axis=0)) / 2
+        points = np.column_stack((
+            size / 2 + (projected[:, 0] - center[0]) * scale,
+            size / 2 - (projected[:, 1] - center[1]) * scale,
+            projected[:, 2],
+        ))
+        triangle, weights = rasterize(points, faces, size, size)
+
+        # Two-sided diffuse light from the camera, slightly from above
+        light = rotation[1] * 0.5 - rotation[2]
+        light /= np.linalg.norm(light)
+        intensity = AMBIENT_LIGHT + DIFFUSE_LIGHT * np.abs(normals @ light)
+        covered = triangle >= 0
+        structure_index = np.full(triangle.shape, -1, dtype=np.int16)
+        structure_index[covered] = face_structure[triangle[covered]]
+        shade = np.zeros(triangle.shape, dtype=np.float32)
+        shade[covered] = (weights[covered] * intensity[faces[triangle[covered]]]).sum(axis=1)
+        panels.append((structure_index, shade))
+    return panels
+
+def compose_image(panels, colors, supersample=DEFAULT_SUPERSAMPLE):
+    """uint8 RGB image of rendered panels side by side, with `colors` per structure index"""
+    background = np.array(BACKGROUND_COLOR, dtype=np.float32)
+    images = []
+    for structure_index, shade in panels:
+        covered = structure_index >= 0
+        image = np.empty(structure_index.shape + (3,), dtype=np.float32)
+        image[...] = background
+        image[covered] = colors[structure_index[covered]] * shade[covered, None] * 255
+        height, width = structure_index.shape
+        images.append(image.reshape(height // supersample, supersample, width // supersample, supersample, 3)
+                      .mean(axis=(1, 3)))
+    return np.clip(np.hstack(images) + 0.5, 0, 255).astype(np.uint8)
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def encode_png(image):
+    """PNG file of a (height, width, 3) uint8 RGB image
+
+    Every scanline uses the Up filter (difference with the row above), which
+    suits the flat shading of the thumbnails.
+    """
+    height, width, _ = image.shape
+    rows = np.ascontiguousarray(image, dtype=np.uint8).reshape(height, width * 3)
+    filtered = rows.copy()
+    filtered[1:] -= rows[:-1]
+    scanlines = np.hstack((np.full((height, 1), 2, dtype=np.uint8), filtered))
+    return (b'\x89PNG\r\n\x1a\n'
+            + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + png_chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 9))
+            + png_chunk(b'IEND', b''))
+
+def write_thumbnail(path, image):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(encode_png(image))
+
+def render_gallery(pack_file=GALLERY_PACK, output_dir=DEFAULT_OUTPUT_DIR, mesh_dir='meshes', atlas='desikan',
+                   panel_size=DEFAULT_PANEL_SIZE, supersample=DEFAULT_SUPERSAMPLE,
+                   color_range=DEFAULT_COLOR_RANGE, jobs=None):
+    """Render the thumbnails of every gallery dataset; returns the thumbnail index"""
+    start = time.perf_counter()
+    output_dir = Path(output_dir)
+    structure_meshes = find_structure_meshes(mesh_dir, atlas)
+
+    # Structures shown in each view of each dataset, and the distinct sets to rasterize
+    renders = []
+    for dataset, structures, values in load_gallery_pack(pack_file):
+        for view, (structure_type, _) in VIEWS.items():
+            shown = sorted((structure, structure_meshes[structure][1]) for structure in set(structures)
+                           if structure_meshes.get(structure, (None,))[0] == structure_type)
+            if shown:
+                renders.append((dataset, structures, values, view, tuple(shown)))
+    keys = sorted({(view, shown) for _, _, _, view, shown in renders})
+    print(f"{len(renders)} thumbnails of {len(set(r[0]['file'] for r in renders))} datasets, "
+          f"{len(keys)} distinct views to rasterize")
+
+    with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count(), len(keys) or 1)) as pool:
+        rendered = dict(zip(keys, pool.map(render_view, *zip(*keys), [panel_size] * len(keys),
+                                           [supersample] * len(keys))))
+    print(f"Rasterized {len(keys)} views ({time.perf_counter() - start:.2f} s)")
+
+    def colour(render):
+        dataset, structures, values, view, shown = render
+        value_of = dict(zip(structures, values))
+        colors = get_color_from_cohen_d([value_of[structure] for structure, _ in shown], color_range)
+        path = output_dir / f"{Path(dataset['file']).with_suffix('')}_{view}.png"
+        write_thumbnail(path, compose_image(rendered[view, shown], colors.astype(np.float32), supersample))
+        return dataset['file'], view, path
+
+    index = {}
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        for file, view, path in pool.map(colour, renders):
+            index.setdefault(file, {})[view] = path.relative_to(output_dir).as_posix()
+    with open(output_dir / 'index.json', 'w') as f:
+        json.dump(index, f, indent=2)
+    print(f"Wrote {len(renders)} thumbnails to {output_dir} ({time.perf_counter() - start:.2f} s)")
+    return index
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render PNG thumbnails of the gallery datasets without a GPU')
+    parser.add_argument('--pack', default=str(GALLERY_PACK),
+                       help=f'Gallery pack written by gallery/build_index.py (default: {GALLERY_PACK})')
+    parser.add_argument('--output-dir', default=str(DEFAULT_OUTPUT_DIR),
+                       help=f'Output directory of the thumbnails (default: {DEFAULT_OUTPUT_DIR})')
+    parser.add_argument('--meshes', default='meshes',
+                       help='meshes/ tree to render (default: meshes)')
+    parser.add_argument('--atlas', default='desikan',
+                       help='Cortical atlas of the gallery datasets (default: desikan)')
+    parser.add_argument('--size', type=int, default=DEFAULT_PANEL_SIZE,
+                       help=f'Height and width of each panel in pixels (default: {DEFAULT_PANEL_SIZE})')
+    parser.add_argument('--supersample', type=int, default=DEFAULT_SUPERSAMPLE,
+                       help=f'Antialiasing factor per axis (default: {DEFAULT_SUPERSAMPLE})')
+    parser.add_argument('--color-range', type=float, nargs=2, default=list(DEFAULT_COLOR_RANGE),
+                       metavar=('MIN', 'MAX'), help="Cohen's d mapped to blue and red (default: -2 2)")
+    parser.add_argument('--jobs', type=int, default=0,
+                       help='Number of worker processes (0 = all cores)')
+
+    args = parser.parse_args()
+    render_gallery(args.pack, args.output_dir, args.meshes, args.atlas, args.size, args.supersample,
+                   tuple(args.color_range), args.jobs or None)
@@ -0,0 +1,139 @@
+"""
+Multi-Label Surface Nets
+Meshes every label of a label volume in a single pass. There is one vertex
+per 2x2x2 block of voxels holding more than one label, and one quad per
+face between two voxels of different labels, listed for both labels. The
+parcels on either side of a border therefore share its vertices exactly,
+without the gaps and overlaps of meshing each label separately with
+marching cubes.
+
+A vertex starts at the mean of the midpoints of the label-crossing edges
+of its block, and is then relaxed towards its neighbours while staying
+inside its block (constrained surface nets smoothing). Every step is
+vectorized over the whole volume; only the final split into per-label
+meshes loops over labels.
+"""
+
+import numpy as np
+
+from mesh_decimation import compute_vertex_normals
+from mesh_smoothing import umbrella_operator
+
+DEFAULT_RELAX_ITERATIONS = 5
+RELAX_FACTOR = 0.5
+
+def _crop_to_labels(volume):
+    """Smallest sub-volume holding every non-zero voxel, and its voxel offset"""
+    bounds = []
+    for axis in range(3):
+        other_axes = tuple(a for a in range(3) if a != axis)
+        present = np.flatnonzero(np.any(volume, axis=other_axes))
+        if len(present) == 0:
+            raise ValueError("The label volume is empty")
+        bounds.append(slice(present[0], present[-1] + 1))
+    return volume[tuple(bounds)], np.array([s.start for s in bounds])
+
+def surface_nets(volume, relax_iterations=DEFAULT_RELAX_ITERATIONS):
+    """Shared-vertex surface of every label of `volume`
+
+    Returns (vertices, faces, face_labels): vertices in voxel coordinates,
+    and every triangle once per non-zero label it bounds, wound
+    counter-clockwise seen from outside that label.
+    """
+    cropped, offset = _crop_to_labels(np.asarray(volume))
+    # A background layer closes the surfaces of labels touching the border
+    padded = np.pad(cropped, 1)
+    cell_shape = np.array(padded.shape) - 1
+
+    quads = []
+    midpoints = []
+    low_labels = []
+    high_labels = []
+    for axis in range(3):
+        low = padded[tuple(slice(0, -1) if a == axis else slice(None) for a in range(3))]
+        high = padded[tuple(slice(1, None) if a == axis else slice(None) for a in range(3))]
+        voxels = np.nonzero(low != high)
+        low_labels.append(low[voxels])
+        high_labels.append(high[voxels])
+        voxels = np.column_stack(voxels)
+        midpoint = voxels.astype(np.float64)
+        midpoint[:, axis] += 0.5
+        midpoints.append(midpoint)
+
+        # The four blocks around the face, counter-clockwise seen from the
+        # high voxel: the face normal points along +axis
+        u, v = (axis + 1) % 3, (axis + 2) % 3
+        corners = []
+        for du, dv in ((-1, -1), (0, -1), (0, 0), (-1, 0)):
+            cell = voxels.copy()
+            cell[:, u] += du
+            cell[:, v] += dv
+            corners.append(np.ravel_multi_index(cell.T, cell_shape))
+        quads.append(np.column_stack(corners))
+
+    quads = np.vstack(quads)
+    midpoints = np.vstack(midpoints)
+    low_labels = np.concatenate(low_labels)
+    high_labels = np.concatenate(high_labels)
+
+    # One vertex per block touched by a quad
+    cells, quads = np.unique(quads, return_inverse=True)
+    quads = quads.reshape(-1, 4)
+    vertex_count = len(cells)
+
+    # Start from the mean midpoint of the block's label-crossing edges: each
+    # face is the dual of one such edge and has its four blocks as corners
+    corner_ids = quads.ravel()
+    counts = np.bincount(corner_ids, minlength=vertex_count)
+    vertices = np.column_stack([
+        np.bincount(corner_ids, weights=np.repeat(midpoints[:, axis], 4), minlength=vertex_count)
+        for axis in range(3)
+    ]) / counts[:, None]
+
+    faces = np.vstack((quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]))
+    if relax_iterations > 0:
+        # Block centres: a relaxed vertex never leaves its block
+        centers = np.column_stack(np.unravel_index(cells, cell_shape)) + 0.5
+        average = umbrella_operator(faces, vertex_count)
+        for _ in range(relax_iterations):
+            vertices += RELAX_FACTOR * (average @ vertices - vertices)
+            np.clip(vertices, centers - 0.5, centers + 0.5, out=vertices)
+
+    # Back to the voxel coordinates of `volume`, undoing the padding
+    vertices += offset - 1
+
+    # Quads face the high voxel: as is for the low label, reversed for the high one
+    face_labels = np.concatenate((np.tile(low_labels, 2), np.tile(high_labels, 2)))
+    faces = np.vstack((faces, faces[:, ::-1]))
+    keep = face_labels != 0
+    return vertices, faces[keep], face_labels[keep]
+
+def split_labels(vertices, faces, face_labels, affine=None):
+    """Per-label meshes {label: {'vertices', 'faces', 'normals'}} of a surface_nets result
+
+    With `affine` (a 4x4 voxel-to-world matrix), vertices are converted to
+    world coordinates, keeping the faces wound counter-clockwise.
+    """
+    if affine is not None:
+        affine = np.asarray(affine, dtype=np.float64)
+        vertices = vertices @ affine[:3, :3].T + affine[:3, 3]
+        if np.linalg.det(affine[:3, :3]) < 0:
+            faces = faces[:, ::-1]
+
+    order = np.argsort(face_labels, kind='stable')
+    labels, starts = np.unique(face_labels[order], return_index=True)
+    meshes = {}
+    for label, label_faces in zip(labels, np.split(faces[order], starts[1:])):
+        used, local_faces = np.unique(label_faces, return_inverse=True)
+        local_faces = local_faces.reshape(-1, 3).astype(np.uint32)
+        local_vertices = vertices[used]
+        meshes[int(label)] = {
+            'vertices': local_vertices.astype(np.float32),
+            'faces': local_faces,
+            'normals': compute_vertex_normals(local_vertices, local_faces).astype(np.float32),
+        }
+    return meshes
+
+def mesh_all_labels(volume, affine=None, relax_iterations=DEFAULT_RELAX_ITERATIONS):
+    """Mesh every non-zero label of `volume` at once; see `surface_nets` and `split_labels`"""
+    return split_labels(*surface_nets(volume, relax_iterations), affine)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Synthetic Atlas and Mesh Generator
+Builds synthetic label volumes and matching meshes of any size for load
+testing, without TemplateFlow or network access:
+  - the label volume splits a brain-sized ellipsoid into Voronoi parcels
+    (14 labels use the FreeSurfer subcortical label ids and a central
+    region), at any voxel size
+  - every label gets a closed ellipsoid mesh centred on its parcel, sized
+    to its volume, with a configurable number of faces
+Everything is generated with array operations, so thousands of labels and
+millions of faces take seconds. The outputs cover every format of the
+pipeline: NIfTI atlas, processor JSON, binary bundle (plain and encoded)
+and an OBJ/PLY meshes/ tree for compile_mesh_bundles.py.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from mesh_bundle import write_mesh_bundle
+from mesh_io import write_mesh
+from templateflow_processor import get_subcortical_labels, save_meshes, voxels_to_ras
+
+OUTPUT_FORMATS = ['nifti', 'json', 'binary', 'encoded', 'obj', 'ply']
+
+# 1 mm MNI152 grid, centred on the voxel used by voxels_to_ras
+MNI_SHAPE = (182, 218, 182)
+MNI_CENTER = np.array([91, 109, 91])
+
+# Semi-axes (mm) of the region split into parcels: the whole brain for a
+# cortical parcellation, a central block for the subcortical structures
+PARCELLATED_RADII = {
+    'cortical': np.array([68, 86, 62]),
+    'subcortical': np.array([24, 28, 18]),
+}
+
+# Name of the cortical atlas directory of the generated meshes/ tree
+SYNTHETIC_ATLAS = 'synthetic'
+
+def synthetic_labels(n_labels):
+    """Label ids and the parcellated region; the subcortical ids for 14 labels"""
+    subcortical_ids = sorted(get_subcortical_labels())
+    if n_labels == len(subcortical_ids):
+        return np.array(subcortical_ids), PARCELLATED_RADII['subcortical']
+    return np.arange(1, n_labels + 1), PARCELLATED_RADII['cortical']
+
+def make_parcellation(n_labels, seed=0):
+    """1 mm label volume: an ellipsoid split into `n_labels` Voronoi parcels"""
+    from scipy.spatial import cKDTree
+
+    rng = np.random.default_rng(seed)
+    label_ids, radii = synthetic_labels(n_labels)
+
+    grid = np.indices(MNI_SHAPE, dtype=np.float32).reshape(3, -1).T
+    inside = (((grid - MNI_CENTER) / radii) ** 2).sum(axis=1) <= 1
+
+    # Seeds spread uniformly over the ellipsoid
+    seeds = np.zeros((0, 3))
+    while len(seeds) < n_labels:
+        draws = rng.uniform(-1, 1, size=(n_labels * 4, 3))
+        seeds = np.vstack((seeds, draws[(draws ** 2).sum(axis=1) <= 1]))
+    seeds = seeds[:n_labels] * radii + MNI_CENTER
+    _, nearest = cKDTree(seeds).query(grid[inside], workers=-1)
+
+    dtype = np.uint16 if label_ids.max() < 2 ** 16 else np.uint32
+    volume = np.zeros(np.prod(MNI_SHAPE), dtype=dtype)
+    volume[inside] = label_ids[nearest]
+    return volume.reshape(MNI_SHAPE)
+
+def resample_labels(volume, voxel_size):
+    """Nearest-neighbour resampling of a 1 mm label volume to `voxel_size` mm"""
+    if voxel_size == 1.0:
+        return volume
+    axes = [
+        np.minimum((np.arange(int(round(size / voxel_size))) * voxel_size).astype(int), size - 1)
+        for size in volume.shape
+    ]
+    return volume[np.ix_(*axes)]
+
+def make_label_volume(n_labels, voxel_size=1.0, seed=0):
+    """Synthetic label volume of `n_labels` Voronoi parcels at `voxel_size` mm"""
+    return resample_labels(make_parcellation(n_labels, seed), voxel_size)
+
+def label_names(label_ids, centers):
+    """Structure names: FreeSurfer names for the subcortical ids, else lh_/rh_ parcels"""
+    subcortical = get_subcortical_labels()
+    is_subcortical = set(label_ids) <= set(subcortical)
+    names = []
+    for label_id, center in zip(label_ids, centers):
+        if is_subcortical:
+            names.append(subcortical[label_id])
+        else:
+            # RAS x < 0 is the left hemisphere
+            names.append(f"{'lh' if center[0] < 0 else 'rh'}_parcel{label_id:04d}")
+    return names
+
+def unit_sphere(faces_per_mesh):
+    """Closed latitude/longitude unit sphere with about `faces_per_mesh` triangles"""
+    rings = max(int(round(np.sqrt(faces_per_mesh / 4))), 2)
+    segments = 2 * rings
+
+    # Poles plus (rings - 1) latitude circles of `segments` vertices
+    theta = np.pi * np.arange(1, rings) / rings
+    phi = 2 * np.pi * np.arange(segments) / segments
+    theta_grid, phi_grid = np.meshgrid(theta, phi, indexing='ij')
+    ring_vertices = np.column_stack((
+        (np.sin(theta_grid) * np.cos(phi_grid)).ravel(),
+        (np.sin(theta_grid) * np.sin(phi_grid)).ravel(),
+        np.cos(theta_grid).ravel()
+    ))
+    vertices = np.vstack(([0, 0, 1], ring_vertices, [0, 0, -1]))
+    south = len(vertices) - 1
+
+    j = np.arange(segments)
+    j_next = (j + 1) % segments
+    ring = 1 + np.arange(rings - 2)[:, None] * segments
+    quads_a = np.stack((ring + j, ring + segments + j, ring + j_next), axis=-1)
+    quads_b = np.stack((ring + j_next, ring + segments + j, ring + segments + j_next), axis=-1)
+    last = 1 + (rings - 2) * segments
+    faces = np.vstack((
+        np.column_stack((np.zeros(segments, dtype=int), 1 + j, 1 + j_next)),
+        np.stack((quads_a, quads_b), axis=2).reshape(-1, 3),
+        np.column_stack((last + j_next, last + j, np.full(segments, south)))
+    ))
+    return vertices, faces
+
+def make_label_meshes(volume, voxel_size=1.0, faces_per_mesh=2000, seed=0):
+    """One closed ellipsoid mesh per label of `volume`, matching its parcel
+
+    Each ellipsoid is centred on the parcel's centroid (RAS mm) and has the
+    parcel's volume, with a random aspect ratio. All meshes share the sphere
+    topology, so vertices and normals are computed for all of them at once.
+    """
+    rng = np.random.default_rng(seed)
+    flat = volume.ravel()
+    counts = np.bincount(flat)
+    label_ids = np.flatnonzero(counts[1:]) + 1
+
+    # Parcel centroids from coordinate sums, without a pass per label
+    coordinates = np.unravel_index(np.arange(flat.size), volume.shape)
+    centroids = np.column_stack([
+        np.bincount(flat, weights=axis_coordinates)[label_ids] for axis_coordinates in coordinates
+    ]) / counts[label_ids, None]
+    centers = voxels_to_ras(centroids * voxel_size)
+
+    equivalent_radii = np.cbrt(3 * counts[label_ids] * voxel_size ** 3 / (4 * np.pi))
+    aspect = rng.uniform(0.8, 1.25, size=(len(label_ids), 3))
+    aspect /= np.cbrt(aspect.prod(axis=1, keepdims=True))
+    radii = equivalent_radii[:, None] * aspect
+
+    sphere, faces = unit_sphere(faces_per_mesh)
+    vertices = (sphere[None] * radii[:, None] + centers[:, None]).astype(np.float32)
+    normals = sphere[None] / radii[:, None]
+    normals = (normals / np.linalg.norm(normals, axis=2, keepdims=True)).astype(np.float32)
+    faces = faces.astype(np.uint32)
+
+    return {
+        name: {'vertices': vertices[i], 'faces': faces, 'normals': normals[i]}
+        for i, name in enumerate(label_names(label_ids, centers))
+    }
+
+def save_label_volume(volume, path, voxel_size=1.0):
+    """Save a label volume as NIfTI with an MNI152-like affine"""
+    import nibabel as nib
+
+    affine = np.diag([-voxel_size, voxel_size, voxel_size, 1.0])
+    affine[:3, 3] = [90, -126, -72]
+    nib.save(nib.Nifti1Image(volume, affine), path)
+
+def write_mesh_tree(meshes, mesh_dir, mesh_format):
+    """Write meshes as a meshes/ tree: cortical/<atlas>/ and subcortical/ files"""
+    for name, mesh in meshes.items():
+        directory = mesh_dir / 'subcortical' if name.startswith(('Left-', 'Right-')) \
+            else mesh_dir / 'cortical' / SYNTHETIC_ATLAS
+        directory.mkdir(parents=True, exist_ok=True)
+        write_mesh(directory / f'{name}.{mesh_format}', mesh['vertices'], mesh['faces'])
+
+def generate_synthetic_data(output_dir='synthetic', n_labels=400, voxel_size=1.0, faces_per_mesh=2000,
+                            formats=OUTPUT_FORMATS, seed=0):
+    """Generate a synthetic atlas and its meshes and write them in `formats`"""
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    parcellation = make_parcellation(n_labels, seed)
+    volume = resample_labels(parcellation, voxel_size)
+    print(f"Label volume: {volume.shape}, {n_labels} labels at {voxel_size} mm "
+          f"({time.perf_counter() - start:.2f} s)")
+
+    # Parcel centroids and volumes are taken from the 1 mm parcellation,
+    # which the resampled volume only refines
+    start = time.perf_counter()
+    meshes = make_label_meshes(parcellation, 1.0, faces_per_mesh, seed)
+    total_faces = sum(len(mesh['faces']) for mesh in meshes.values())
+    print(f"Meshes: {len(meshes)} meshes, {total_faces} faces ({time.perf_counter() - start:.2f} s)")
+
+    written = {}
+    for output_format in formats:
+        start = time.perf_counter()
+        if output_format == 'nifti':
+            path = output_path / 'synthetic_atlas.nii.gz'
+            save_label_volume(volume, path, voxel_size)
+        elif output_format in ('json', 'binary'):
+            path = save_meshes(meshes, output_path, 'synthetic_meshes', output_format)
+        elif output_format == 'encoded':
+            path = write_mesh_bundle(meshes, output_path, 'synthetic_meshes_encoded', encode=True)
+        else:
+            path = output_path / 'meshes'
+            write_mesh_tree(meshes, path, output_format)
+        written[output_format] = path
+        print(f"  {output_format}: {path} ({time.perf_counter() - start:.2f} s)")
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate a synthetic atlas and matching meshes for load testing')
+    parser.add_argument('--output-dir', default='synthetic',
+                       help='Output directory (default: synthetic)')
+    parser.add_argument('--labels', type=int, default=400,
+                       help='Number of labels; 14 uses the FreeSurfer subcortical label ids (default: 400)')
+    parser.add_argument('--voxel-size', type=float, default=1.0,
+                       help='Voxel size of the label volume in mm (default: 1.0)')
+    parser.add_argument('--faces-per-mesh', type=int, default=2000,
+                       help='Approximate number of triangles of each mesh (default: 2000)')
+    parser.add_argument('--formats', nargs='+', default=OUTPUT_FORMATS, choices=OUTPUT_FORMATS,
+                       help='Outputs to write (default: all)')
+    parser.add_argument('--seed', type=int, default=0,
+                       help='Random seed')
+
+    args = parser.parse_args()
+    generate_synthetic_data(args.output_dir, args.labels, args.voxel_size, args.faces_per_mesh,
+                            args.formats, args.seed)
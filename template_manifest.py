@@ -0,0 +1,186 @@
+"""
+Template Resolution Manifest
+Remembers which query found each template file, so that later runs open the
+file directly instead of trying every TemplateFlow query again:
+  - online, the strategies (templateflow.api.get queries) are tried in
+    order and the first one returning an existing file is recorded in the
+    manifest with the file's path, size, modification time and SHA-256
+  - a recorded file is reused while it exists and its size and modification
+    time are unchanged, or its checksum still matches; otherwise it is
+    resolved again
+  - offline, the strategies are matched against the file names of a local
+    TemplateFlow-style directory (tpl-<template>/tpl-<template>_res-01_...)
+    without importing templateflow or using the network
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+from mesh_cache import hash_file
+
+def default_manifest_path():
+    """Per-user manifest file, next to the meshing cache"""
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'brain_render' / 'templates.json'
+
+def default_templateflow_home():
+    """Local TemplateFlow directory: TEMPLATEFLOW_HOME or TemplateFlow's own default"""
+    return Path(os.environ.get('TEMPLATEFLOW_HOME') or Path.home() / '.cache' / 'templateflow')
+
+def parse_template_filename(name):
+    """BIDS-like file name -> (entities, suffix, extension)
+
+    'tpl-MNI152NLin2009cAsym_res-01_desc-aseg_dseg.nii.gz' ->
+    ({'tpl': 'MNI152NLin2009cAsym', 'res': '01', 'desc': 'aseg'}, 'dseg', '.nii.gz')
+    """
+    base, dot, extension = name.partition('.')
+    *pairs, suffix = base.split('_')
+    entities = dict(pair.split('-', 1) for pair in pairs if '-' in pair)
+    return entities, suffix, dot + extension
+
+def match_local_files(root, params):
+    """Files of a local TemplateFlow directory matching templateflow.api.get parameters"""
+    template = params['template']
+    matches = []
+    for path in sorted((Path(root) / f'tpl-{template}').glob(f'tpl-{template}_*')):
+        entities, suffix, extension = parse_template_filename(path.name)
+        if 'suffix' in params and suffix != params['suffix']:
+            continue
+        if 'extension' in params and extension != params['extension']:
+            continue
+        if 'resolution' in params and (not entities.get('res', '').isdigit()
+                                       or int(entities['res']) != int(params['resolution'])):
+            continue
+        if 'desc' in params and entities.get('desc') != params['desc']:
+            continue
+        matches.append(path)
+    return matches
+
+def file_record(path):
+    """Manifest record of a file: absolute path, size, modification time and SHA-256"""
+    path = Path(path).resolve()
+    stat = path.stat()
+    return {
+        'path': str(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': hash_file(path),
+    }
+
+class TemplateResolver:
+    """Resolves named template files through strategies, recording results in a manifest
+
+    A strategy is a dict with a 'name' and the 'params' of a
+    templateflow.api.get query. With `offline_dir`, queries are answered
+    from that local directory instead of TemplateFlow.
+    """
+
+    def __init__(self, manifest_path=None, offline_dir=None):
+        self.manifest_path = Path(manifest_path) if manifest_path else default_manifest_path()
+        self.offline_dir = Path(offline_dir) if offline_dir else None
+
+    @property
+    def source(self):
+        """Where queries are answered: 'templateflow' or the offline directory"""
+        return str(self.offline_dir.resolve()) if self.offline_dir else 'templateflow'
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        """Write the manifest atomically"""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def check_record(self, record):
+        """Whether a recorded file is still the one that was resolved
+
+        Returns (valid, record), the record being refreshed when the file
+        was touched but its contents are unchanged.
+        """
+        path = Path(record['path'])
+        try:
+            stat = path.stat()
+        except OSError:
+            return False, record
+        if stat.st_size == record['size'] and stat.st_mtime_ns == record['mtime_ns']:
+            return True, record
+        current = file_record(path)
+        return current['sha256'] == record['sha256'], {**record, **current}
+
+    def recorded_sha256(self, path):
+        """SHA-256 recorded for the file at `path`, if it is unchanged since (same size and mtime); else None"""
+        path = Path(path).resolve()
+        for record in self.load_manifest().values():
+            if record.get('path') != str(path):
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                return None
+            if stat.st_size == record['size'] and stat.st_mtime_ns == record['mtime_ns']:
+                return record['sha256']
+        return None
+
+    def query(self, params):
+        """Files returned by one strategy, from TemplateFlow or the offline directory"""
+        if self.offline_dir:
+            return match_local_files(self.offline_dir, params)
+
+        from templateflow import api as tflow
+        params = dict(params)
+        files = tflow.get(params.pop('template'), **params)
+        # tflow.get returns a path, a list of paths, or an empty list
+        if not isinstance(files, list):
+            files = [] if files is None else [files]
+        return [Path(f) for f in files]
+
+    def resolve(self, name, strategies, refresh=False):
+        """Path of the template file `name`, from the manifest or the first working strategy"""
+        manifest = self.load_manifest()
+        record = manifest.get(name)
+        if record is not None and record.get('source') == self.source and not refresh:
+            valid, checked = self.check_record(record)
+            if valid:
+                if checked != record:
+                    manifest[name] = checked
+                    self.save_manifest(manifest)
+                print(f"Using {name} from the template manifest ({record['strategy']}): {record['path']}")
+                return Path(record['path'])
+            print(f"Recorded {name} changed or is missing, resolving it again...")
+
+        for strategy in strategies:
+            print(f"Trying {strategy['name']}...")
+            try:
+                files = self.query(strategy['params'])
+            except Exception as e:
+                print(f"  Failed {strategy['name']}: {e}")
+                continue
+            existing = [path for path in files if path.exists()]
+            if not existing:
+                print(f"  No files found for {strategy['name']}")
+                continue
+            if len(existing) > 1:
+                print(f"  Found {len(existing)} files, using: {existing[0].name}")
+
+            manifest[name] = {
+                'strategy': strategy['name'],
+                'params': strategy['params'],
+                'source': self.source,
+                'resolved_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                **file_record(existing[0]),
+            }
+            self.save_manifest(manifest)
+            print(f"Resolved {name} with {strategy['name']}: {existing[0]}")
+            return existing[0]
+
+        raise ValueError(f"Could not resolve {name} from {self.source}")
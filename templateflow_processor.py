@@ -3,27 +3,49 @@
 TemplateFlow Subcortical Volume Processor
 Downloads subcortical segmentations from TemplateFlow and converts them to 3D meshes
 for web visualization.
+
+Commands:
+  process         download the atlas and mesh its structures (default)
+  sample          write the sample meshes only
+  list-templates  list the available TemplateFlow templates
+  clear-cache     empty the meshing cache
+
+nibabel, scikit-image, scipy and templateflow are imported by the functions
+that need them, so that the light commands and --help start fast; see
+check_import_time.py.
 """
 
 import numpy as np
 import json
 from pathlib import Path
-import nibabel as nib
-from skimage import measure
-from scipy import ndimage
 import argparse
+import importlib.util
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from mesh_bundle import write_mesh_bundle
+from mesh_cache import DEFAULT_CACHE_SIZE_MB, MeshCache, hash_file, make_cache_key
+from mesh_cleanup import DEFAULT_WELD_TOLERANCE, cleanup_meshes, format_cleanup_stats
+from mesh_decimation import DEFAULT_LOD_RATIOS, DEFAULT_MAX_ERROR, build_lod_chain
+from mesh_encoding import DEFAULT_MAX_POSITION_ERROR
+from mesh_smoothing import DEFAULT_SMOOTHING_METHOD, SMOOTHING_METHODS, smooth_mesh
+from pipeline_profile import REPORT_FORMATS, PipelineProfiler, peak_rss_mb, profile_format_from_env, profile_stage
+from template_manifest import TemplateResolver, default_templateflow_home
 
-try:
+TEMPLATEFLOW_AVAILABLE = importlib.util.find_spec('templateflow') is not None
+
+def _templateflow_api():
+    """Import the TemplateFlow client on first use"""
     from templateflow import api as tflow
-    TEMPLATEFLOW_AVAILABLE = True
-except ImportError:
-    TEMPLATEFLOW_AVAILABLE = False
-    print("Warning: templateflow not installed. Install with: pip install templateflow")
+    return tflow
 
 def list_available_templates():
     """List available templates to help with debugging"""
     if not TEMPLATEFLOW_AVAILABLE:
         return
+    tflow = _templateflow_api()
     
     try:
         print("Checking available templates...")
@@ -49,166 +71,61 @@ def list_available_templates():
     except Exception as e:
         print(f"Error listing templates: {e}")
 
-def download_subcortical_atlas():
-    """Download subcortical atlas from TemplateFlow with multiple fallback strategies"""
-    if not TEMPLATEFLOW_AVAILABLE:
-        raise ImportError("TemplateFlow is required. Install with: pip install templateflow")
-    
-    # List available files for debugging
-    list_available_templates()
-    
-    print("\nAttempting to download atlas...")
-    
-    # Strategy 1: Standard FreeSurfer aseg
-    strategies = [
-        {
-            'name': 'FreeSurfer aseg',
-            'params': {
-                'template': 'MNI152NLin2009cAsym',
-                'resolution': 1,
-                'desc': 'aseg',
-                'suffix': 'dseg',
-                'extension': '.nii.gz'
-            }
-        },
-        {
-            'name': 'Any dseg file',
-            'params': {
-                'template': 'MNI152NLin2009cAsym',
-                'resolution': 1,
-                'suffix': 'dseg'
-            }
-        },
-        {
-            'name': 'Lower resolution dseg',
-            'params': {
-                'template': 'MNI152NLin2009cAsym',
-                'resolution': 2,
-                'suffix': 'dseg'
-            }
-        },
-        {
-            'name': 'Any segmentation',
-            'params': {
-                'template': 'MNI152NLin2009cAsym',
-                'suffix': 'seg'
-            }
-        },
-        {
-            'name': 'FSL MNI template',
-            'params': {
-                'template': 'MNI152NLin6Asym',
-                'suffix': 'dseg'
-            }
+# templateflow.api.get queries tried in order to find the subcortical atlas
+SUBCORTICAL_ATLAS_STRATEGIES = [
+    {
+        'name': 'FreeSurfer aseg',
+        'params': {
+            'template': 'MNI152NLin2009cAsym',
+            'resolution': 1,
+            'desc': 'aseg',
+            'suffix': 'dseg',
+            'extension': '.nii.gz'
         }
-    ]
-    
-    for strategy in strategies:
-        try:
-            print(f"Trying {strategy['name']}...")
-            atlas_files = tflow.get(**strategy['params'])
-            
-            # Handle the case where tflow.get returns a list
-            if isinstance(atlas_files, list):
-                if len(atlas_files) == 0:
-                    print(f"  No files found for {strategy['name']}")
-                    continue
-                atlas_file = atlas_files[0]
-                print(f"  Found {len(atlas_files)} files, using: {Path(atlas_file).name}")
-            else:
-                atlas_file = atlas_files
-                
-            if atlas_file is None:
-                print(f"  No file returned for {strategy['name']}")
-                continue
-                
-            # Verify the file exists
-            if Path(atlas_file).exists():
-                print(f"Successfully found atlas: {atlas_file}")
-                return atlas_file
-            else:
-                print(f"  File doesn't exist: {atlas_file}")
-                
-        except Exception as e:
-            print(f"  Failed {strategy['name']}: {e}")
-            continue
-    
-    raise ValueError("Could not download any suitable atlas from TemplateFlow")
+    },
+    {
+        'name': 'Any dseg file',
+        'params': {
+            'template': 'MNI152NLin2009cAsym',
+            'resolution': 1,
+            'suffix': 'dseg'
+        }
+    },
+    {
+        'name': 'Lower resolution dseg',
+        'params': {
+            'template': 'MNI152NLin2009cAsym',
+            'resolution': 2,
+            'suffix': 'dseg'
+        }
+    },
+    {
+        'name': 'Any segmentation',
+        'params': {
+            'template': 'MNI152NLin2009cAsym',
+            'suffix': 'seg'
+        }
+    },
+    {
+        'name': 'FSL MNI template',
+        'params': {
+            'template': 'MNI152NLin6Asym',
+            'suffix': 'dseg'
+        }
+    }
+]
 
-def download_subcortical_atlas():
-    """Download subcortical atlas from TemplateFlow"""
-    if not TEMPLATEFLOW_AVAILABLE:
+def download_subcortical_atlas(resolver=None, refresh=False):
+    """Download subcortical atlas from TemplateFlow with multiple fallback strategies
+
+    The strategy and file that worked are recorded in the template manifest
+    of `resolver` and reused by later runs; see template_manifest.py.
+    """
+    resolver = resolver or TemplateResolver()
+    if resolver.offline_dir is None and not TEMPLATEFLOW_AVAILABLE:
         raise ImportError("TemplateFlow is required. Install with: pip install templateflow")
     
-    # Download MNI152NLin2009cAsym template with subcortical segmentation
-    try:
-        # First try to get the standard aseg segmentation
-        atlas_files = tflow.get(
-            'MNI152NLin2009cAsym',
-            resolution=1,
-            desc='aseg',
-            suffix='dseg',
-            extension='.nii.gz'
-        )
-        
-        # Handle case where multiple files are returned
-        if isinstance(atlas_files, list):
-            if len(atlas_files) == 0:
-                raise ValueError("No atlas files found")
-            atlas_file = atlas_files[0]  # Use the first file
-            print(f"Found {len(atlas_files)} atlas files, using: {atlas_file}")
-        else:
-            atlas_file = atlas_files
-            
-        if atlas_file is None:
-            raise ValueError("No atlas file returned")
-            
-    except Exception as e:
-        print(f"Failed to download aseg atlas: {e}")
-        print("Trying alternative atlas...")
-        
-        # Try alternative: get any available segmentation
-        try:
-            atlas_files = tflow.get(
-                'MNI152NLin2009cAsym',
-                resolution=1,
-                suffix='dseg',
-                extension='.nii.gz'
-            )
-            
-            if isinstance(atlas_files, list):
-                if len(atlas_files) == 0:
-                    raise ValueError("No alternative atlas files found")
-                atlas_file = atlas_files[0]
-                print(f"Using alternative atlas: {atlas_file}")
-            else:
-                atlas_file = atlas_files
-                
-        except Exception as e2:
-            print(f"Failed to download alternative atlas: {e2}")
-            print("Trying to get any MNI template...")
-            
-            # Last resort: get any MNI template
-            try:
-                atlas_files = tflow.get(
-                    'MNI152NLin2009cAsym',
-                    resolution=2,  # Lower resolution might be more available
-                    suffix='dseg'
-                )
-                
-                if isinstance(atlas_files, list):
-                    if len(atlas_files) == 0:
-                        raise ValueError("No template files found")
-                    atlas_file = atlas_files[0]
-                    print(f"Using lower resolution template: {atlas_file}")
-                else:
-                    atlas_file = atlas_files
-                    
-            except Exception as e3:
-                raise ValueError(f"Could not download any suitable atlas: {e3}")
-    
-    print(f"Successfully obtained atlas file: {atlas_file}")
-    return atlas_file
+    return resolver.resolve('subcortical_atlas', SUBCORTICAL_ATLAS_STRATEGIES, refresh)
 
 def get_subcortical_labels():
     """Define subcortical structure labels based on FreeSurfer atlas"""
@@ -229,53 +146,423 @@ def get_subcortical_labels():
         58: 'Right-Accumbens'
     }
 
-def create_mesh_from_volume(volume_data, label_value, smoothing_iterations=2):
-    """Convert volume data to 3D mesh using marching cubes"""
-    # Extract binary mask for the specific label
-    mask = (volume_data == label_value).astype(np.uint8)
+# Voxels converted or counted at a time, bounding temporaries to ~32 MB of int64
+SLAB_VOXELS = 1 << 22
+
+def _slabs(length, voxels_per_index):
+    """Consecutive slices of `length` indices covering about SLAB_VOXELS voxels each"""
+    step = max(1, SLAB_VOXELS // max(voxels_per_index, 1))
+    for start in range(0, length, step):
+        yield slice(start, min(start + step, length))
+
+def compact_label_dtype(max_label):
+    """Smallest unsigned integer dtype holding labels up to `max_label`"""
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if max_label <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError(f"Label {max_label} does not fit in 32 bits")
+
+def load_label_volume(atlas_img):
+    """Read the labels of a NIfTI image without float64/int64 copies
+
+    Labels are read in their on-disk dtype through `dataobj` and converted
+    slab by slab (along z) into the smallest unsigned dtype that fits.
+    Uncompressed images whose on-disk labels already fit are returned as the
+    memory map itself. A 4D probabilistic atlas is reduced to a maximum
+    probability label volume (volume k -> label k + 1, 0 where every
+    probability is 0). Returns (volume, memory_mapped).
+    """
+    proxy = atlas_img.dataobj
+    if hasattr(proxy, 'get_unscaled'):
+        raw = proxy.get_unscaled()
+        slope, inter = float(proxy.slope), float(proxy.inter)
+    else:
+        raw = np.asanyarray(proxy)
+        slope, inter = 1.0, 0.0
+    scaled = (slope, inter) != (1.0, 0.0)
     
-    if mask.sum() == 0:
-        return None
+    probabilistic = raw.ndim == 4 and raw.shape[3] > 1
+    if raw.ndim == 4 and not probabilistic:
+        raw = raw[..., 0]
     
-    # Apply smoothing to reduce noise
+    def labels_of(block):
+        if probabilistic:
+            labels = block.argmax(axis=3) + 1
+            labels[block.max(axis=3) * slope + inter <= 0] = 0
+            return labels
+        if scaled:
+            block = block * slope + inter
+        if block.dtype.kind == 'f':
+            block = np.rint(block)
+        return block
+    
+    # Label range, to pick the dtype
+    depth, voxels_per_slice = raw.shape[2], int(np.prod(raw.shape)) // raw.shape[2]
+    low, high = 0, 0
+    for slab in _slabs(depth, voxels_per_slice):
+        labels = labels_of(raw[:, :, slab])
+        low, high = min(low, labels.min()), max(high, labels.max())
+    if low < 0:
+        raise ValueError(f"Atlas has negative labels (minimum {low})")
+    dtype = compact_label_dtype(int(high))
+    
+    if (isinstance(raw, np.memmap) and not scaled and not probabilistic
+            and raw.dtype.kind in 'ui' and raw.dtype.itemsize <= dtype.itemsize):
+        return raw, True
+    
+    volume = np.empty(raw.shape[:3], dtype=dtype, order='F')
+    for slab in _slabs(depth, voxels_per_slice):
+        volume[:, :, slab] = labels_of(raw[:, :, slab])
+    return volume, False
+
+def build_label_index(volume_data):
+    """Index every label of a volume in a single pass.
+
+    Returns a dict mapping each non-zero label id to its voxel count and its
+    tight bounding box (a tuple of slices), so that later stages never have
+    to rescan the whole volume for a single structure.
+    """
+    from scipy import ndimage
+    
+    # Count slab by slab: bincount converts its input to int64
+    counts = np.zeros(1, dtype=np.int64)
+    for slab in _slabs(volume_data.shape[0], int(np.prod(volume_data.shape[1:]))):
+        slab_counts = np.bincount(volume_data[slab].ravel())
+        if len(slab_counts) > len(counts):
+            counts = np.pad(counts, (0, len(slab_counts) - len(counts)))
+        counts[:len(slab_counts)] += slab_counts
+    bounding_boxes = ndimage.find_objects(volume_data)
+    
+    label_index = {}
+    for label_id, bbox in enumerate(bounding_boxes, start=1):
+        if bbox is None:
+            continue
+        label_index[label_id] = {
+            'voxels': int(counts[label_id]),
+            'bbox': bbox
+        }
+    return label_index
+
+def pad_bounding_box(bbox, shape, padding):
+    """Grow a bounding box by `padding` voxels on every side, clipped to `shape`"""
+    return tuple(
+        slice(max(s.start - padding, 0), min(s.stop + padding, size))
+        for s, size in zip(bbox, shape)
+    )
+
+def extract_label_mask(volume_data, label_value, smoothing_iterations=2, bbox=None):
+    """Binary mask of one label and the voxel origin of the mask
+
+    If `bbox` is given (see `build_label_index`), the mask only covers the
+    label's bounding box, padded to cover the reach of the opening/closing
+    and the zero layer marching cubes needs.
+    """
+    origin = np.zeros(3)
+    if bbox is not None:
+        padding = 2 * smoothing_iterations + 1
+        bbox = pad_bounding_box(bbox, volume_data.shape, padding)
+        volume_data = volume_data[bbox]
+        origin = np.array([s.start for s in bbox])
+    return (volume_data == label_value).astype(np.uint8), origin
+
+def smooth_mask(mask, smoothing_iterations=2):
+    """Morphological opening then closing of a binary mask to reduce noise"""
+    from scipy import ndimage
     if smoothing_iterations > 0:
         mask = ndimage.binary_opening(mask, iterations=smoothing_iterations)
         mask = ndimage.binary_closing(mask, iterations=smoothing_iterations)
+    return mask
+
+def voxels_to_ras(vertices, origin=(0, 0, 0)):
+    """Convert (sub-volume) voxel coordinates to MNI RAS coordinates"""
+    # Move sub-volume vertices back into full volume voxel coordinates
+    vertices = vertices + origin
+    
+    # Standard MNI space transformation
+    vertices = vertices - np.array([91, 109, 91])  # Center at origin
+    vertices = vertices * np.array([-1, -1, 1])    # Convert to RAS
+    return vertices
+
+def create_mesh_from_volume(volume_data, label_value, smoothing_iterations=2, bbox=None,
+                            profiler=None, structure=None, smoothing_method=DEFAULT_SMOOTHING_METHOD):
+    """Convert volume data to 3D mesh using marching cubes
+
+    If `bbox` is given (see `build_label_index`), masking, morphology and
+    marching cubes only run on the label's padded sub-volume, with a result
+    identical to processing the full volume. With a `profiler` (see
+    pipeline_profile.py), every stage is recorded under `structure`.
+    
+    `smoothing_method` is 'morphology' (`smoothing_iterations` of opening
+    and closing on the voxel mask) or 'taubin' (Taubin smoothing of the
+    marching cubes surface and recomputed normals, see mesh_smoothing.py).
+    """
+    from skimage import measure
+    
+    if smoothing_method not in SMOOTHING_METHODS:
+        raise ValueError(f"Unknown smoothing method: {smoothing_method}")
+    if smoothing_method != 'morphology':
+        smoothing_iterations = 0
+    
+    # Extract binary mask for the specific label
+    with profile_stage(profiler, 'label_mask', structure) as record:
+        mask, origin = extract_label_mask(volume_data, label_value, smoothing_iterations, bbox)
+        voxel_count = int(mask.sum())
+        record['voxels'] = voxel_count
+    
+    if voxel_count == 0:
+        return None
+    
+    # Apply smoothing to reduce noise
+    with profile_stage(profiler, 'morphology', structure, voxels=voxel_count):
+        mask = smooth_mask(mask, smoothing_iterations)
     
     # Generate mesh using marching cubes
     try:
-        vertices, faces, normals, values = measure.marching_cubes(
-            mask, 
-            level=0.5,
-            spacing=(1.0, 1.0, 1.0)
-        )
+        with profile_stage(profiler, 'marching_cubes', structure) as record:
+            vertices, faces, normals, values = measure.marching_cubes(
+                mask, 
+                level=0.5,
+                spacing=(1.0, 1.0, 1.0)
+            )
+            record['vertices'] = len(vertices)
+            record['faces'] = len(faces)
         
-        # Convert to RAS coordinates (from voxel coordinates)
-        # Standard MNI space transformation
-        vertices = vertices - np.array([91, 109, 91])  # Center at origin
-        vertices = vertices * np.array([-1, -1, 1])    # Convert to RAS
+        with profile_stage(profiler, 'ras_conversion', structure, vertices=len(vertices)):
+            vertices = voxels_to_ras(vertices, origin)
+            # The RAS conversion turns the volume half a turn about z: turn the normals too
+            normals = normals * np.array([-1, -1, 1], dtype=normals.dtype)
+        
+        if smoothing_method == 'taubin':
+            with profile_stage(profiler, 'taubin', structure, vertices=len(vertices), faces=len(faces)):
+                vertices, normals = smooth_mesh(vertices, faces)
         
         return {
-            'vertices': vertices.tolist(),
-            'faces': faces.tolist(),
-            'normals': normals.tolist()
+            'vertices': vertices,
+            'faces': faces,
+            'normals': normals
         }
     except ValueError as e:
         print(f"Warning: Could not generate mesh for label {label_value}: {e}")
         return None
 
-def process_templateflow_data(output_dir='subcortical_meshes'):
-    """Main processing function"""
-    print("Downloading TemplateFlow subcortical atlas...")
+# Bump whenever a change to the meshing code changes its output, so that
+# cached meshes from older versions are not reused
+MESHING_VERSION = 2
+
+def smoothing_key_fields(smoothing_method, smoothing_iterations):
+    """Smoothing fields of a cache key: the method and the parameters it uses"""
+    if smoothing_method == 'morphology':
+        return {'smoothing_method': smoothing_method, 'smoothing_iterations': smoothing_iterations}
+    # Taubin smoothing ignores smoothing_iterations (see create_mesh_from_volume)
+    return {'smoothing_method': smoothing_method}
+
+# Label volume shared with the worker processes of mesh_structures
+_shared_block = None
+_shared_volume = None
+
+def _attach_shared_volume(block_name, shape, dtype):
+    """Pool initializer: map the shared label volume into this worker"""
+    global _shared_block, _shared_volume
+    _shared_block = shared_memory.SharedMemory(name=block_name)
+    _shared_volume = np.ndarray(shape, dtype=dtype, buffer=_shared_block.buf)
+
+def _mesh_shared_label(task):
+    """Pool task: mesh one (label_id, structure, bbox, smoothing_iterations, smoothing_method,
+    profile) task of the shared label volume; returns the mesh and the profile records, if any"""
+    label_id, structure, bbox, smoothing_iterations, smoothing_method, profile = task
+    profiler = PipelineProfiler() if profile else None
+    mesh = create_mesh_from_volume(
+        _shared_volume, label_id, smoothing_iterations, bbox=bbox, profiler=profiler, structure=structure,
+        smoothing_method=smoothing_method
+    )
+    return mesh, profiler.records if profile else None
+
+def mesh_structures(volume_data, tasks, jobs=1, smoothing_iterations=2, profiler=None,
+                    smoothing_methods=None):
+    """Mesh a list of (label_id, structure, bbox) tasks, in order
+
+    With `jobs` > 1 the volume is copied once into shared memory and the
+    tasks are spread across a process pool. Results come back in task order,
+    so the output is the same as the serial path. Profile records of the
+    workers are merged into `profiler`. `smoothing_methods` maps structures
+    to their smoothing method; the others use DEFAULT_SMOOTHING_METHOD.
+    """
+    smoothing_methods = smoothing_methods or {}
+    if jobs <= 1 or len(tasks) <= 1:
+        return [
+            create_mesh_from_volume(volume_data, label_id, smoothing_iterations, bbox=bbox,
+                                    profiler=profiler, structure=structure,
+                                    smoothing_method=smoothing_methods.get(structure, DEFAULT_SMOOTHING_METHOD))
+            for label_id, structure, bbox in tasks
+        ]
     
+    block = shared_memory.SharedMemory(create=True, size=volume_data.nbytes)
+    shared = np.ndarray(volume_data.shape, dtype=volume_data.dtype, buffer=block.buf)
+    try:
+        shared[...] = volume_data
+        with ProcessPoolExecutor(
+            max_workers=min(jobs, len(tasks)),
+            initializer=_attach_shared_volume,
+            initargs=(block.name, volume_data.shape, volume_data.dtype.str)
+        ) as executor:
+            results = list(executor.map(
+                _mesh_shared_label,
+                [(label_id, structure, bbox, smoothing_iterations,
+                  smoothing_methods.get(structure, DEFAULT_SMOOTHING_METHOD), profiler is not None)
+                 for label_id, structure, bbox in tasks]
+            ))
+        if profiler is not None:
+            for _, records in results:
+                profiler.extend(records)
+        return [mesh for mesh, _ in results]
+    finally:
+        del shared
+        block.close()
+        block.unlink()
+
+def save_meshes(meshes, output_path, name, output_format='json', encode=False, max_position_error=None,
+                profiler=None, keep_face_order=False, spatial=False):
+    """Save meshes as indented JSON, a binary bundle, or both
+
+    The binary bundle (see mesh_bundle.py) is streamed straight from the
+    NumPy arrays, quantized and compressed if `encode` is set; only the
+    JSON output converts them to nested lists. With `spatial`, the bundle
+    carries the bounds and BVH of every structure (see mesh_spatial.py);
+    `keep_face_order` then keeps its faces in their (vertex cache) order
+    instead of BVH order.
+    Returns the path of the first file written.
+    """
+    saved_files = []
+    counts = {
+        'vertices': sum(len(mesh['vertices']) for mesh in meshes.values()),
+        'faces': sum(len(mesh['faces']) for mesh in meshes.values())
+    }
+    
+    if output_format in ('json', 'both'):
+        json_file = output_path / f'{name}.json'
+        with profile_stage(profiler, 'json_dump', name, **counts):
+            with open(json_file, 'w') as f:
+                json.dump(
+                    {structure: {key: np.asarray(values).tolist() for key, values in mesh.items()}
+                     for structure, mesh in meshes.items()},
+                    f, indent=2
+                )
+        saved_files.append(json_file)
+    
+    if output_format in ('binary', 'both'):
+        with profile_stage(profiler, 'binary_bundle', name, **counts):
+            saved_files.append(write_mesh_bundle(
+                meshes, output_path, name, encode=encode, max_position_error=max_position_error, spatial=spatial,
+                keep_face_order=keep_face_order
+            ))
+    
+    return saved_files[0]
+
+def save_mesh_lods(meshes, output_path, name, full_file, ratios, max_error, output_format='json',
+                   encode=False, max_position_error=None, profiler=None, cleanup=False, spatial=False):
+    """Decimate every mesh into a chain of levels of detail and save them
+
+    Each level below 100% is written as <name>_lod<k> (k = 1 is the finest)
+    in the requested format. The <name>_lods.json index lists the levels
+    coarsest first, with the face count and geometric error of every
+    structure; the 100% level points at the full mesh file. With `cleanup`,
+    every level is also cleaned up and reordered (see mesh_cleanup.py).
+    `spatial` is passed on to `save_meshes`.
+    """
+    ratios = sorted(set(ratios), reverse=True)
+    decimated_ratios = [ratio for ratio in ratios if ratio < 1.0]
+    
+    level_meshes = [{} for _ in decimated_ratios]
+    for structure_name, mesh in meshes.items():
+        print(f"  Decimating {structure_name}...")
+        with profile_stage(profiler, 'decimation', structure_name, vertices=len(mesh['vertices']),
+                           faces=len(mesh['faces'])):
+            lods = build_lod_chain(mesh['vertices'], mesh['faces'], decimated_ratios, max_error,
+                                   mesh.get('normals'))
+        for level, lod in zip(level_meshes, lods):
+            level[structure_name] = lod
+    
+    levels = []
+    if ratios[0] >= 1.0:
+        levels.append({
+            'level': 0,
+            'ratio': 1.0,
+            'file': Path(full_file).name,
+            'faces': {structure: len(mesh['faces']) for structure, mesh in meshes.items()},
+            'maxError': {structure: 0.0 for structure in meshes}
+        })
+    
+    for k, (ratio, level) in enumerate(zip(decimated_ratios, level_meshes), start=1):
+        level_file_meshes = {structure: {key: lod[key] for key in ('vertices', 'faces', 'normals')}
+                             for structure, lod in level.items()}
+        if cleanup:
+            with profile_stage(profiler, 'cleanup', f'{name}_lod{k}'):
+                level_file_meshes, _ = cleanup_meshes(level_file_meshes)
+        level_file = save_meshes(
+            level_file_meshes, output_path, f'{name}_lod{k}', output_format, encode, max_position_error, profiler,
+            keep_face_order=cleanup, spatial=spatial
+        )
+        levels.append({
+            'level': k,
+            'ratio': ratio,
+            'file': level_file.name,
+            'faces': {structure: len(lod['faces']) for structure, lod in level.items()},
+            'maxError': {structure: lod['maxError'] for structure, lod in level.items()}
+        })
+    
+    lod_index_file = output_path / f'{name}_lods.json'
+    with open(lod_index_file, 'w') as f:
+        json.dump({
+            'maxErrorBound': max_error,
+            'levels': levels[::-1]  # Coarsest first
+        }, f, indent=2)
+    
+    return lod_index_file
+
+def process_templateflow_data(output_dir='subcortical_meshes', jobs=1, output_format='json',
+                              lod_ratios=DEFAULT_LOD_RATIOS, max_error=DEFAULT_MAX_ERROR,
+                              encode=False, max_position_error=None,
+                              smoothing_iterations=2, cache=None, profile=None, atlas_file=None,
+                              smoothing_method=DEFAULT_SMOOTHING_METHOD, structure_smoothing=None,
+                              resolver=None, refresh_atlas=False, cleanup=False,
+                              weld_tolerance=DEFAULT_WELD_TOLERANCE, spatial=False):
+    """Main processing function
+
+    `atlas_file` is a local label volume to mesh instead of the TemplateFlow
+    atlas, e.g. one written by synthetic_data.py. Otherwise the atlas is
+    resolved through `resolver` (see template_manifest.py), online or from
+    an offline TemplateFlow directory; `refresh_atlas` ignores the manifest.
+    
+    Structures are smoothed with `smoothing_method`, except those listed in
+    `structure_smoothing` ({structure: method}, see mesh_smoothing.py).
+
+    With a `cache` (see mesh_cache.py), structures whose atlas, label and
+    meshing parameters are unchanged are loaded instead of re-meshed.
+    With `profile` set to 'json' or 'csv', the wall time, CPU time and peak
+    memory of every stage are written to profile_report.<profile> next to
+    the meshes (see pipeline_profile.py).
+    
+    With `cleanup`, meshes are welded within `weld_tolerance`, cleaned of
+    degenerate and duplicate faces and reordered for the vertex cache
+    before they are saved (see mesh_cleanup.py). With `spatial`, binary
+    bundles carry the bounds and BVH of every structure (see mesh_spatial.py).
+    """
+    import nibabel as nib
+    
+    profiler = PipelineProfiler() if profile else None
+    resolver = resolver or TemplateResolver()
     # Create output directory
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
     
     try:
         # Download atlas
-        atlas_file = download_subcortical_atlas()
-        print(f"Downloaded atlas: {atlas_file}")
+        if atlas_file is None:
+            print("Resolving TemplateFlow subcortical atlas...")
+            atlas_file = download_subcortical_atlas(resolver, refresh_atlas)
+            print(f"Atlas file: {atlas_file}")
+        else:
+            print(f"Using local atlas: {atlas_file}")
         
         # Verify the file exists and is readable
         if not Path(atlas_file).exists():
@@ -283,12 +570,19 @@ def process_templateflow_data(output_dir='subcortical_meshes'):
         
         # Load volume data
         print("Loading atlas data...")
-        atlas_img = nib.load(atlas_file)
-        atlas_data = atlas_img.get_fdata().astype(int)
+        with profile_stage(profiler, 'load_atlas') as record:
+            atlas_img = nib.load(atlas_file)
+            atlas_data, memory_mapped = load_label_volume(atlas_img)
+            record['voxels'] = int(atlas_data.size)
         
-        print(f"Atlas shape: {atlas_data.shape}")
-        unique_labels = np.unique(atlas_data)
-        print(f"Unique labels found: {len(unique_labels)} labels")
+        print(f"Atlas shape: {atlas_data.shape}, labels as {atlas_data.dtype} "
+              f"({atlas_data.nbytes / 1e6:.1f} MB{', memory-mapped' if memory_mapped else ''})")
+        
+        # Index voxel counts and bounding boxes of every label once
+        with profile_stage(profiler, 'label_index', voxels=int(atlas_data.size)):
+            label_index = build_label_index(atlas_data)
+        unique_labels = np.array(sorted(label_index))
+        print(f"Non-zero labels found: {len(unique_labels)} labels")
         print(f"Label range: {unique_labels.min()} to {unique_labels.max()}")
         
         # Show some of the labels
@@ -303,7 +597,7 @@ def process_templateflow_data(output_dir='subcortical_meshes'):
         # Check which labels are actually present
         available_labels = {}
         for label_id, structure_name in subcortical_labels.items():
-            if label_id in unique_labels:
+            if label_id in label_index:
                 available_labels[label_id] = structure_name
             else:
                 print(f"Warning: Label {label_id} ({structure_name}) not found in atlas")
@@ -312,33 +606,91 @@ def process_templateflow_data(output_dir='subcortical_meshes'):
         
         if len(available_labels) == 0:
             print("No expected subcortical labels found. This might not be a FreeSurfer-style segmentation.")
-            print("Available labels:", unique_labels[unique_labels > 0][:20])  # Show first 20 non-zero labels
+            print("Available labels:", unique_labels[:20])  # Show first 20 non-zero labels
             
             # Try to use any available labels as a fallback
             print("Attempting to use available labels...")
             fallback_structures = {
                 'Structure_' + str(label): f'Unknown_Structure_{label}' 
-                for label in unique_labels[1:min(11, len(unique_labels))]  # Skip 0, take up to 10 structures
+                for label in unique_labels[:10]  # Take up to 10 structures
             }
             available_labels = {int(k.split('_')[1]): v for k, v in fallback_structures.items()}
         
-        # Process each structure
-        all_meshes = {}
+        # Select the structures to mesh
+        structures_to_mesh = []
         
         for label_id, structure_name in available_labels.items():
             print(f"Processing {structure_name} (label {label_id})...")
             
             # Check how many voxels this structure has
-            voxel_count = np.sum(atlas_data == label_id)
+            voxel_count = label_index[label_id]['voxels']
             print(f"  Found {voxel_count} voxels")
             
             if voxel_count < 10:
                 print(f"  Skipping {structure_name} - too few voxels")
                 continue
             
-            # Create mesh for this structure
-            mesh_data = create_mesh_from_volume(atlas_data, label_id)
-            
+            structures_to_mesh.append((label_id, structure_name))
+        
+        structure_smoothing = structure_smoothing or {}
+        for structure_name in sorted(set(structure_smoothing) - set(available_labels.values())):
+            print(f"Warning: smoothing method given for unknown structure {structure_name}")
+        smoothing_methods = {
+            structure_name: structure_smoothing.get(structure_name, smoothing_method)
+            for _, structure_name in structures_to_mesh
+        }
+        
+        # Serve unchanged structures from the cache
+        mesh_results = [None] * len(structures_to_mesh)
+        to_compute = list(range(len(structures_to_mesh)))
+        if cache is not None:
+            with profile_stage(profiler, 'cache_lookup'):
+                # The template manifest already holds the hash of a resolved atlas
+                atlas_hash = resolver.recorded_sha256(atlas_file) or hash_file(atlas_file)
+                cache_keys = [
+                    make_cache_key(
+                        atlas=atlas_hash,
+                        label=int(label_id),
+                        **smoothing_key_fields(smoothing_methods[structure_name], smoothing_iterations),
+                        affine=atlas_img.affine.tolist(),
+                        zooms=[float(z) for z in atlas_img.header.get_zooms()],
+                        version=MESHING_VERSION
+                    )
+                    for label_id, structure_name in structures_to_mesh
+                ]
+                to_compute = []
+                for i, key in enumerate(cache_keys):
+                    found, mesh_results[i] = cache.get(key)
+                    if not found:
+                        to_compute.append(i)
+                print(f"Cache: {len(structures_to_mesh) - len(to_compute)} structures cached, "
+                      f"{len(to_compute)} to mesh")
+        
+        # Create a mesh for each remaining structure, possibly across several processes
+        if jobs > 1 and to_compute:
+            print(f"Meshing {len(to_compute)} structures with {jobs} processes...")
+        computed = mesh_structures(
+            atlas_data,
+            [(structures_to_mesh[i][0], structures_to_mesh[i][1], label_index[structures_to_mesh[i][0]]['bbox'])
+             for i in to_compute],
+            jobs=jobs,
+            smoothing_iterations=smoothing_iterations,
+            profiler=profiler,
+            smoothing_methods=smoothing_methods
+        )
+        for i, mesh_data in zip(to_compute, computed):
+            mesh_results[i] = mesh_data
+            if cache is not None:
+                cache.put(cache_keys[i], mesh_data)
+        
+        if cache is not None:
+            evicted = cache.evict()
+            if evicted:
+                print(f"Cache: evicted {evicted} least recently used entries")
+        
+        all_meshes = {}
+        
+        for (label_id, structure_name), mesh_data in zip(structures_to_mesh, mesh_results):
             if mesh_data is not None:
                 all_meshes[structure_name] = mesh_data
                 print(f"  Generated mesh with {len(mesh_data['vertices'])} vertices")
@@ -348,53 +700,36 @@ def process_templateflow_data(output_dir='subcortical_meshes'):
         if len(all_meshes) == 0:
             raise ValueError("No meshes could be generated from the atlas data")
         
-        # Save all meshes to JSON file
-        output_file = output_path / 'subcortical_meshes.json'
-        with open(output_file, 'w') as f:
-            json.dump(all_meshes, f, indent=2)
+        if cleanup:
+            with profile_stage(profiler, 'cleanup'):
+                all_meshes, cleanup_stats = cleanup_meshes(all_meshes, weld_tolerance)
+            print(f"Cleanup: {format_cleanup_stats(cleanup_stats)}")
+        
+        # Save all meshes
+        output_file = save_meshes(
+            all_meshes, output_path, 'subcortical_meshes', output_format, encode, max_position_error, profiler,
+            keep_face_order=cleanup, spatial=spatial
+        )
         
         print(f"\nSaved {len(all_meshes)} meshes to {output_file}")
         
-        # Create a simplified version for faster loading
-        simplified_meshes = {}
-        for name, mesh in all_meshes.items():
-            # Downsample vertices for web display
-            vertices = np.array(mesh['vertices'])
-            faces = np.array(mesh['faces'])
-            
-            # Simple decimation - keep every nth vertex
-            if len(vertices) > 1000:
-                step = max(1, len(vertices) // 500)  # Target ~500 vertices
-                keep_indices = np.arange(0, len(vertices), step)
-                vertices = vertices[keep_indices]
-                
-                # Update faces (simplified approach)
-                face_mapping = {old_idx: new_idx for new_idx, old_idx in enumerate(keep_indices)}
-                new_faces = []
-                for face in faces:
-                    if all(v in face_mapping for v in face):
-                        new_faces.append([face_mapping[v] for v in face])
-                
-                if len(new_faces) > 0:
-                    simplified_meshes[name] = {
-                        'vertices': vertices.tolist(),
-                        'faces': new_faces,
-                        'normals': mesh['normals'][:len(vertices)] if len(mesh['normals']) >= len(vertices) else []
-                    }
-                else:
-                    # If face mapping failed, just use original
-                    simplified_meshes[name] = mesh
-            else:
-                simplified_meshes[name] = mesh
+        # Build the levels of detail; the viewer loads the coarsest one first
+        lod_index_file = save_mesh_lods(
+            all_meshes, output_path, 'subcortical_meshes', output_file,
+            lod_ratios, max_error, output_format, encode, max_position_error, profiler, cleanup, spatial
+        )
         
-        # Save simplified version
-        simplified_file = output_path / 'subcortical_meshes_simplified.json'
-        with open(simplified_file, 'w') as f:
-            json.dump(simplified_meshes, f, indent=2)
+        print(f"Saved levels of detail index to {lod_index_file}")
         
-        print(f"Saved simplified meshes to {simplified_file}")
+        if profiler is not None:
+            peak_rss = peak_rss_mb()
+            if peak_rss is not None:
+                print(f"Peak memory (RSS): {peak_rss:.0f} MB")
+            profiler.print_summary()
+            report_file = profiler.write_report(output_path, profile)
+            print(f"Saved profile report to {report_file}")
         
-        return output_file, simplified_file
+        return output_file, lod_index_file
         
     except Exception as e:
         print(f"Error processing TemplateFlow data: {e}")
@@ -402,7 +737,7 @@ def process_templateflow_data(output_dir='subcortical_meshes'):
         traceback.print_exc()
         return None, None
 
-def create_sample_data():
+def create_sample_data(output_dir='subcortical_meshes'):
     """Create sample mesh data if TemplateFlow is not available"""
     print("Creating sample subcortical mesh data...")
     
@@ -417,7 +752,7 @@ def create_sample_data():
     }
     
     # Save sample data
-    output_path = Path('subcortical_meshes')
+    output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
     
     output_file = output_path / 'subcortical_meshes_sample.json'
@@ -427,6 +762,15 @@ def create_sample_data():
     print(f"Saved sample meshes to {output_file}")
     return output_file
 
+def _grid_faces(rows, cols):
+    """Two triangles per quad of a rows x cols vertex grid, in row-major order"""
+    i, j = np.meshgrid(np.arange(rows - 1), np.arange(cols - 1), indexing='ij')
+    v1 = i * cols + j
+    v2 = v1 + 1
+    v3 = v1 + cols
+    v4 = v3 + 1
+    return np.stack((np.stack((v1, v2, v3), axis=-1), np.stack((v2, v4, v3), axis=-1)), axis=2).reshape(-1, 3)
+
 def generate_ellipsoid_mesh(center, scale=1.0):
     """Generate a simple ellipsoid mesh"""
     # Create sphere vertices
@@ -440,22 +784,9 @@ def generate_ellipsoid_mesh(center, scale=1.0):
     
     vertices = np.column_stack((x.flatten(), y.flatten(), z.flatten()))
     
-    # Create triangular faces
-    faces = []
-    for i in range(len(theta) - 1):
-        for j in range(len(phi) - 1):
-            # Two triangles per quad
-            v1 = i * len(phi) + j
-            v2 = i * len(phi) + (j + 1)
-            v3 = (i + 1) * len(phi) + j
-            v4 = (i + 1) * len(phi) + (j + 1)
-            
-            faces.append([v1, v2, v3])
-            faces.append([v2, v4, v3])
-    
     return {
         'vertices': vertices.tolist(),
-        'faces': faces,
+        'faces': _grid_faces(len(theta), len(phi)).tolist(),
         'normals': []  # Will be computed in JavaScript
     }
 
@@ -464,31 +795,18 @@ def generate_curved_mesh(center, scale=1.0):
     # Create a curved tube
     t = np.linspace(0, 2*np.pi, 30)
     s = np.linspace(0, 1, 10)
+    t_grid, s_grid = np.meshgrid(t, s, indexing='ij')
     
-    vertices = []
-    for i, t_val in enumerate(t):
-        for j, s_val in enumerate(s):
-            # Curved path
-            x = scale * (2 * s_val - 1) * np.cos(t_val * 0.5) + center[0]
-            y = scale * 0.3 * np.sin(t_val) + center[1]
-            z = scale * s_val * 2 + center[2]
-            vertices.append([x, y, z])
-    
-    # Create faces
-    faces = []
-    for i in range(len(t) - 1):
-        for j in range(len(s) - 1):
-            v1 = i * len(s) + j
-            v2 = i * len(s) + (j + 1)
-            v3 = (i + 1) * len(s) + j
-            v4 = (i + 1) * len(s) + (j + 1)
-            
-            faces.append([v1, v2, v3])
-            faces.append([v2, v4, v3])
+    # Curved path
+    x = scale * (2 * s_grid - 1) * np.cos(t_grid * 0.5) + center[0]
+    y = scale * 0.3 * np.sin(t_grid) + center[1]
+    z = scale * s_grid * 2 + center[2]
+    
+    vertices = np.column_stack((x.ravel(), y.ravel(), z.ravel()))
     
     return {
-        'vertices': vertices,
-        'faces': faces,
+        'vertices': vertices.tolist(),
+        'faces': _grid_faces(len(t), len(s)).tolist(),
         'normals': []
     }
 
@@ -496,38 +814,105 @@ def generate_almond_mesh(center, scale=1.0):
     """Generate an almond-shaped amygdala mesh"""
     return generate_ellipsoid_mesh(center, scale)
 
-if __name__ == "__main__":
+# Commands of the CLI; `process` runs when none is given
+COMMANDS = ['process', 'sample', 'list-templates', 'clear-cache']
+
+# Flags of the former single-command CLI, mapped to their commands
+LEGACY_COMMAND_FLAGS = {
+    '--sample-only': 'sample',
+    '--list-templates': 'list-templates',
+}
+
+def parse_structure_smoothing(value):
+    """argparse type of --structure-smoothing: 'STRUCTURE=METHOD' -> (structure, method)"""
+    structure, _, method = value.rpartition('=')
+    if not structure or method not in SMOOTHING_METHODS:
+        raise argparse.ArgumentTypeError(
+            f"expected STRUCTURE=METHOD with METHOD in {', '.join(SMOOTHING_METHODS)}, got {value!r}"
+        )
+    return structure, method
+
+def build_parser():
+    """Argument parser with one subcommand per entry of COMMANDS"""
     parser = argparse.ArgumentParser(description='Process TemplateFlow subcortical data')
-    parser.add_argument('--output-dir', default='subcortical_meshes', 
+    commands = parser.add_subparsers(dest='command', metavar='{' + ','.join(COMMANDS) + '}')
+    
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--output-dir', default='subcortical_meshes', 
                        help='Output directory for mesh files')
-    parser.add_argument('--sample-only', action='store_true',
-                       help='Generate sample data only (no TemplateFlow download)')
-    parser.add_argument('--list-templates', action='store_true',
-                       help='List available TemplateFlow templates and exit')
     
-    args = parser.parse_args()
+    cache_options = argparse.ArgumentParser(add_help=False)
+    cache_options.add_argument('--cache-dir', default=None,
+                       help='Meshing cache directory (default: ~/.cache/brain_render/meshes)')
+    cache_options.add_argument('--cache-size-mb', type=float, default=DEFAULT_CACHE_SIZE_MB,
+                       help='Size limit of the meshing cache in MB, least recently used entries are evicted')
     
-    if args.list_templates:
-        if TEMPLATEFLOW_AVAILABLE:
-            list_available_templates()
-        else:
-            print("TemplateFlow not available. Install with: pip install templateflow")
-        exit(0)
-    
-    if args.sample_only or not TEMPLATEFLOW_AVAILABLE:
-        if not TEMPLATEFLOW_AVAILABLE:
-            print("TemplateFlow not available, generating sample data...")
-        else:
-            print("Generating sample data as requested...")
-        create_sample_data()
-    else:
-        print("Attempting to download and process TemplateFlow data...")
-        result = process_templateflow_data(args.output_dir)
-        
-        if result == (None, None):
-            print("\nTemplateFlow processing failed. Generating sample data as fallback...")
-            create_sample_data()
+    process = commands.add_parser('process', parents=[output, cache_options],
+                                  help='Download the atlas and mesh its structures (default)')
+    process.add_argument('--atlas', default=None,
+                       help='Local label volume (NIfTI) to mesh instead of downloading the TemplateFlow atlas')
+    process.add_argument('--offline', nargs='?', const=str(default_templateflow_home()), default=None,
+                       metavar='TEMPLATEFLOW_DIR',
+                       help='Resolve the atlas from a local TemplateFlow directory, without network access '
+                            '(default: $TEMPLATEFLOW_HOME or ~/.cache/templateflow)')
+    process.add_argument('--manifest', default=None,
+                       help='Template manifest file (default: ~/.cache/brain_render/templates.json)')
+    process.add_argument('--refresh-manifest', action='store_true',
+                       help='Resolve the atlas again instead of using the file recorded in the manifest')
+    process.add_argument('--jobs', type=int, default=1,
+                       help='Number of processes used to mesh structures (0 = all cores)')
+    process.add_argument('--format', choices=['json', 'binary', 'both'], default='json',
+                       help='Mesh output format: indented JSON, binary bundle (manifest + .bin), or both')
+    process.add_argument('--lod-ratios', type=float, nargs='+', default=list(DEFAULT_LOD_RATIOS),
+                       help='Face count ratios of the levels of detail (default: 1.0 0.25 0.05)')
+    process.add_argument('--max-error', type=float, default=DEFAULT_MAX_ERROR,
+                       help='Maximum geometric error in mm allowed when decimating meshes')
+    process.add_argument('--smoothing-iterations', type=int, default=2,
+                       help='Iterations of binary opening/closing applied before marching cubes (morphology smoothing)')
+    process.add_argument('--smoothing', choices=SMOOTHING_METHODS, default=DEFAULT_SMOOTHING_METHOD,
+                       help='Smoothing: opening/closing of the voxel mask, or Taubin smoothing of the surface '
+                            f'(default: {DEFAULT_SMOOTHING_METHOD})')
+    process.add_argument('--structure-smoothing', nargs='+', type=parse_structure_smoothing, default=[],
+                       metavar='STRUCTURE=METHOD',
+                       help='Smoothing method of individual structures, e.g. Left-Hippocampus=taubin')
+    process.add_argument('--no-cache', action='store_true',
+                       help='Do not read or write the meshing cache')
+    process.add_argument('--clear-cache', action='store_true',
+                       help='Empty the meshing cache before processing')
+    process.add_argument('--encode', action='store_true',
+                       help='Quantize and compress binary bundles (16-bit positions, octahedral normals, varint indices)')
+    process.add_argument('--max-position-error', type=float, default=DEFAULT_MAX_POSITION_ERROR,
+                       help='Maximum position error in mm allowed when encoding binary bundles')
+    process.add_argument('--cleanup', action='store_true',
+                       help='Weld vertices, drop degenerate and duplicate faces and reorder the meshes for the '
+                            'GPU vertex cache before saving')
+    process.add_argument('--weld-tolerance', type=float, default=DEFAULT_WELD_TOLERANCE,
+                       help=f'Distance in mm within which --cleanup welds vertices (default: {DEFAULT_WELD_TOLERANCE})')
+    process.add_argument('--spatial', action=argparse.BooleanOptionalAction, default=False,
+                       help='Add the per-structure bounds and BVH (see mesh_spatial.py) to binary bundles')
+    process.add_argument('--profile', nargs='?', const='json', choices=REPORT_FORMATS,
+                       default=profile_format_from_env(),
+                       help='Write per-stage timing and peak memory to profile_report.json/.csv in the output '
+                            'directory (also enabled by BRAIN_RENDER_PROFILE=json|csv)')
     
+    commands.add_parser('sample', parents=[output],
+                        help='Generate sample data only (no TemplateFlow download)')
+    commands.add_parser('list-templates', help='List available TemplateFlow templates and exit')
+    commands.add_parser('clear-cache', parents=[cache_options], help='Empty the meshing cache and exit')
+    return parser
+
+def parse_args(argv=None):
+    """Parse the command line, defaulting to `process` and accepting the legacy flags"""
+    argv = list(sys.argv[1:] if argv is None else argv)
+    for flag, command in LEGACY_COMMAND_FLAGS.items():
+        if flag in argv:
+            argv.remove(flag)
+            argv.insert(0, command)
+    if not argv or argv[0] not in COMMANDS + ['-h', '--help']:
+        argv.insert(0, 'process')
+    return build_parser().parse_args(argv)
+
+def print_next_steps():
     print("\nSetup complete! Next steps:")
     print("1. Copy the generated JSON files to your web server/GitHub Pages repository")
     print("2. Open the HTML viewer in a web browser")
@@ -538,4 +923,55 @@ if __name__ == "__main__":
     print("- scikit-image: pip install scikit-image")
     print("- scipy: pip install scipy")
     print("\nIf TemplateFlow download fails, the sample data will still provide")
-    print("a good approximation of subcortical brain structures.")
\ No newline at end of file
+    print("a good approximation of subcortical brain structures.")
+
+if __name__ == "__main__":
+    args = parse_args()
+    
+    if args.command == 'list-templates':
+        if TEMPLATEFLOW_AVAILABLE:
+            list_available_templates()
+        else:
+            print("TemplateFlow not available. Install with: pip install templateflow")
+        exit(0)
+    
+    if args.command == 'clear-cache':
+        cache = MeshCache(args.cache_dir, args.cache_size_mb)
+        print(f"Cleared {cache.clear()} entries from {cache.cache_dir}")
+        exit(0)
+    
+    if args.command == 'sample':
+        print("Generating sample data as requested...")
+        create_sample_data(args.output_dir)
+    elif not TEMPLATEFLOW_AVAILABLE and args.atlas is None and args.offline is None:
+        print("Warning: templateflow not installed. Install with: pip install templateflow")
+        print("TemplateFlow not available, generating sample data...")
+        create_sample_data(args.output_dir)
+    else:
+        jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        
+        cache = None
+        if not args.no_cache:
+            cache = MeshCache(args.cache_dir, args.cache_size_mb)
+        if args.clear_cache:
+            cleared_cache = cache or MeshCache(args.cache_dir, args.cache_size_mb)
+            print(f"Cleared {cleared_cache.clear()} entries from {cleared_cache.cache_dir}")
+        
+        if args.atlas is None:
+            print("Attempting to download and process TemplateFlow data...")
+        result = process_templateflow_data(
+            args.output_dir, jobs=jobs, output_format=args.format,
+            lod_ratios=args.lod_ratios, max_error=args.max_error,
+            encode=args.encode, max_position_error=args.max_position_error,
+            smoothing_iterations=args.smoothing_iterations, cache=cache, profile=args.profile,
+            atlas_file=args.atlas, smoothing_method=args.smoothing,
+            structure_smoothing=dict(args.structure_smoothing),
+            resolver=TemplateResolver(args.manifest, args.offline), refresh_atlas=args.refresh_manifest,
+            cleanup=args.cleanup, weld_tolerance=args.weld_tolerance, spatial=args.spatial
+        )
+        
+        if result == (None, None):
+            print("\nTemplateFlow processing failed. Generating sample data as fallback...")
+            create_sample_data(args.output_dir)
+    
+    print_next_steps()
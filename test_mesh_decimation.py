@@ -0,0 +1,17 @@
+from mesh_decimation import build_lod_chain
+
+def test_source_normals_point_outward(sphere_mesh, outwardness):
+    vertices, _, normals = sphere_mesh
+    assert outwardness(vertices, normals) > 0.9
+
+def test_lod_normals_point_outward(sphere_mesh, outwardness):
+    vertices, faces, normals = sphere_mesh
+    for source_normals in (normals, None):
+        levels = build_lod_chain(vertices, faces, (0.25, 0.05), normals=source_normals)
+        for level in levels:
+            assert outwardness(level['vertices'], level['normals']) > 0.9
+
+def test_lod_normals_follow_winding_without_source_normals(sphere_mesh, outwardness):
+    vertices, faces, _ = sphere_mesh
+    level, = build_lod_chain(vertices, faces[:, ::-1], (0.25,))
+    assert outwardness(level['vertices'], level['normals']) > 0.9
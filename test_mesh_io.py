@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from mesh_io import read_ply, write_ply
+
+VERTICES = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+FACES = np.array([[0, 1, 2], [0, 1, 3], [0, 2, 3], [1, 2, 3]], dtype=np.uint32)
+
+# Comment lines pushing end_header well past the first 4 KB
+LONG_COMMENTS = ''.join(f'comment line {i} of a long header\n' for i in range(500))
+
+def test_binary_ply_with_long_header(tmp_path):
+    path = tmp_path / 'mesh.ply'
+    write_ply(path, VERTICES, FACES)
+    data = path.read_bytes()
+    format_end = data.index(b'\n', data.index(b'format')) + 1
+    path.write_bytes(data[:format_end] + LONG_COMMENTS.encode() + data[format_end:])
+
+    mesh = read_ply(path)
+    np.testing.assert_array_equal(mesh['vertices'], VERTICES)
+    np.testing.assert_array_equal(mesh['faces'], FACES)
+
+def test_ascii_ply_with_long_header(tmp_path):
+    path = tmp_path / 'mesh.ply'
+    path.write_text(
+        'ply\nformat ascii 1.0\n' + LONG_COMMENTS
+        + f'element vertex {len(VERTICES)}\nproperty float x\nproperty float y\nproperty float z\n'
+        + f'element face {len(FACES)}\nproperty list uchar int vertex_indices\nend_header\n'
+        + ''.join('%g %g %g\n' % tuple(v) for v in VERTICES)
+        + ''.join('3 %d %d %d\n' % tuple(f) for f in FACES)
+    )
+
+    mesh = read_ply(path)
+    np.testing.assert_array_equal(mesh['vertices'], VERTICES)
+    np.testing.assert_array_equal(mesh['faces'], FACES)
+
+def write_binary_ply(path, face_records, face_properties):
+    """Binary PLY of VERTICES with the given face record array and header property lines"""
+    header = (
+        f'ply\nformat binary_little_endian 1.0\nelement vertex {len(VERTICES)}\n'
+        'property float x\nproperty float y\nproperty float z\n'
+        f'element face {len(face_records)}\n{face_properties}end_header\n'
+    )
+    path.write_bytes(header.encode() + VERTICES.astype('<f4').tobytes() + face_records.tobytes())
+
+def test_binary_ply_with_property_before_list(tmp_path):
+    records = np.zeros(len(FACES), dtype=[('flags', 'u1'), ('count', 'u1'), ('indices', '<i4', (3,))])
+    records['flags'] = 7
+    records['count'] = 3
+    records['indices'] = FACES
+    path = tmp_path / 'mesh.ply'
+    write_binary_ply(path, records, 'property uchar flags\nproperty list uchar int vertex_indices\n')
+
+    mesh = read_ply(path)
+    np.testing.assert_array_equal(mesh['vertices'], VERTICES)
+    np.testing.assert_array_equal(mesh['faces'], FACES)
+
+def test_binary_ply_with_several_lists_is_rejected(tmp_path):
+    records = np.zeros(len(FACES), dtype=[('count', 'u1'), ('indices', '<i4', (3,)),
+                                          ('texture_count', 'u1'), ('texture', '<f4', (6,))])
+    records['count'] = 3
+    records['indices'] = FACES
+    records['texture_count'] = 6
+    path = tmp_path / 'mesh.ply'
+    write_binary_ply(path, records, 'property list uchar int vertex_indices\n'
+                                    'property list uchar float texcoord\n')
+
+    with pytest.raises(ValueError, match='unsupported PLY layout'):
+        read_ply(path)
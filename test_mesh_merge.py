@@ -0,0 +1,68 @@
+import numpy as np
+
+from mesh_cleanup import cleanup_mesh
+from mesh_merge import merge_structures, weld_vertices
+
+def test_weld_identical_positions():
+    vertices = np.array([[0.0, 1, 2], [-0.0, 1, 2], [0, 1, 2.5]])
+    welded, inverse = weld_vertices(vertices)
+    assert len(welded) == 2
+    assert inverse[0] == inverse[1] != inverse[2]
+
+def test_weld_pair_straddling_a_cell_boundary():
+    # 0.0015 is the boundary between two cells of a 1e-3 grid
+    vertices = np.array([[0.0014999, 0, 0], [0.0015001, 0, 0], [0.003, 0, 0]])
+    welded, inverse = weld_vertices(vertices, tolerance=1e-3)
+    assert len(welded) == 2
+    assert inverse[0] == inverse[1] != inverse[2]
+    assert np.abs(welded[inverse[0]] - vertices[:2]).max(axis=1).min() < 1e-7
+
+def test_weld_keeps_vertices_further_than_tolerance():
+    vertices = np.array([[0, 0, 0], [0.0011, 0, 0], [0, 0.0011, 0]])
+    welded, _ = weld_vertices(vertices, tolerance=1e-3)
+    assert len(welded) == 3
+
+def test_cleanup_welds_across_cell_boundary():
+    # Two triangles whose shared edge was duplicated on either side of a cell boundary
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0.5, 1.5e-5 - 1e-7, 0],
+                         [1, 0, 0], [0.5, 1.5e-5 + 1e-7, 0], [1, 1, 0]], dtype=np.float32)
+    faces = np.array([[0, 1, 2], [3, 5, 4]])
+    cleaned, stats = cleanup_mesh({'vertices': vertices, 'faces': faces}, tolerance=1e-5)
+    assert stats['vertices_after'] == 4
+    assert len(cleaned['faces']) == 2
+
+def make_bordering_parcels():
+    """Two parcels sharing the border p0, p1, p2
+
+    Parcel 'a' is the triangle (p0, p1, p2) plus (p0, t, p1); parcel 'b'
+    surrounds the triangle with one face on each of its edges, so every
+    vertex of (p0, p1, p2) is shared and takes the id of 'b'.
+    """
+    p = [[0, 0, 0], [1, 0, 0], [0, 1, 0]]
+    t, q, r, s = [0.5, -1, 0], [0.5, -0.5, 0], [1, 1, 0], [-0.5, 0.5, 0]
+    a = {'vertices': np.array(p + [t], dtype=np.float32), 'faces': np.array([[0, 1, 2], [0, 3, 1]])}
+    b = {'vertices': np.array(p + [q, r, s], dtype=np.float32), 'faces': np.array([[0, 3, 1], [1, 4, 2], [2, 5, 0]])}
+    return {'a': a, 'b': b}
+
+def test_merge_structures():
+    meshes = make_bordering_parcels()
+    merged = merge_structures(meshes)
+    face_structures = np.array([0, 0, 1, 1, 1])
+    vertices, faces = merged['vertices'], merged['faces'].astype(np.int64)
+
+    assert merged['structure_names'] == ['a', 'b']
+    # The last vertex of every face carries the face's structure
+    np.testing.assert_array_equal(merged['structure_ids'][faces[:, 2]], face_structures)
+    # Border vertices are welded: 7 distinct positions, plus one copy for the
+    # face of 'a' none of whose vertices has its id
+    assert len(vertices) == 8
+    copied = vertices[7]
+    assert merged['structure_ids'][7] == 0
+    assert np.any(np.all(vertices[:7] == copied, axis=1))
+    # Faces keep their corners and winding
+    source = np.vstack([mesh['vertices'][mesh['faces']] for mesh in meshes.values()])
+    merged_corners = vertices[faces]
+    np.testing.assert_allclose(np.cross(merged_corners[:, 1] - merged_corners[:, 0],
+                                        merged_corners[:, 2] - merged_corners[:, 0]),
+                               np.cross(source[:, 1] - source[:, 0], source[:, 2] - source[:, 0]))
+    np.testing.assert_allclose(merged_corners.mean(axis=1), source.mean(axis=1))
@@ -0,0 +1,10 @@
+from mesh_decimation import build_lod_chain
+from templateflow_processor import create_mesh_from_volume
+
+def test_mesh_and_lod_normals_point_outward(sphere_volume, outwardness):
+    volume, label = sphere_volume
+    for smoothing_method in ('morphology', 'taubin'):
+        mesh = create_mesh_from_volume(volume, label, smoothing_iterations=1, smoothing_method=smoothing_method)
+        assert outwardness(mesh['vertices'], mesh['normals']) > 0.9
+        for level in build_lod_chain(mesh['vertices'], mesh['faces'], (0.25, 0.05), normals=mesh['normals']):
+            assert outwardness(level['vertices'], level['normals']) > 0.9